@@ -1,10 +1,19 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+import startup_timing  # imported first so import time is measured from here
+from flask import Flask, Response, request, jsonify, send_file
+from werkzeug.wsgi import wrap_file
+import gzip
 from flask_socketio import SocketIO
+from eventlet import tpool
+import logging
 import os
+import time
+from datetime import datetime, timedelta
 
 from config import get_config
-from database.db_factory import get_repository
+import cors
+from database.lazy_repository import LazyRepository
+from database.base_repository import DuplicateUserError, parse_timestamp
+from existence_filter import UserExistenceFilter
 from auth import (
     generate_salt,
     hash_master_password,
@@ -12,36 +21,191 @@ from auth import (
     generate_jwt_token,
     token_required
 )
-from crypto_utils import sanitize_input, validate_password_strength
+from crypto_utils import sanitize_input, validate_password_strength, is_valid_fingerprint, normalize_tags
+from profiling import SlowQueryLog, RequestProfiler
+import structured_logging
+import tracing
+from blob_store import BlobTooLarge, create_blob_store
+from typeahead import TypeaheadCache
+from rate_limit import Limit, RateLimiter, create_backend
+from token_revocation import RevocationList
+from vault_rotation import VaultRotations
+from password_history import PasswordHistory
+from audit_log import AuditLog
+from readiness import InFlight, Readiness
+from breach_filter import BreachedPasswordFilter
+
+startup_timing.mark('imports')
 
 # Initialize Flask app
 app = Flask(__name__)
 config_name = os.getenv('FLASK_ENV', 'development')
 app.config.from_object(get_config(config_name))
 
-# CORS Configuration
-CORS(app, resources={r"/*": {"origins": "*"}},
-     supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization"],
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+structured_logging.setup_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'],
+                                 app.config['LOG_ERROR_RATE'], app.config['LOG_ERROR_BURST'],
+                                 app.config['LOG_QUEUE_SIZE'])
+structured_logging.init_app(app)
+logger = logging.getLogger(__name__)
+
+# Request tracing; registered first so its after_request hook runs last
+span_exporter = tracing.JsonlSpanExporter(app.config['TRACE_EXPORT_PATH']) if app.config['TRACE_EXPORT_PATH'] else None
+tracing.init_app(app, server_timing=app.config['SERVER_TIMING_ENABLED'], exporter=span_exporter)
+
+# CORS: preflights are answered in front of routing/auth and cached by the browser
+cors.init_app(app, cors.CorsPolicy(app.config['CORS_ORIGINS'], app.config['CORS_MAX_AGE'],
+                                   expose_headers=('Server-Timing', 'X-Request-ID')))
+
+# WebSocket (a message queue fans events out across worker processes)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet',
+                    message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+
+# Diagnostics hooks (installed before the repository opens connections)
+SlowQueryLog(app.config['SLOW_QUERY_THRESHOLD_MS']).install(app.config['DATABASE_TYPE'])
+RequestProfiler(app.config['PROFILE_SAMPLE_RATE'], app.config['PROFILE_TOKEN'],
+                app.config['PROFILE_DIR']).init_app(app)
+
+# Client IPs come from X-Forwarded-For when running behind this many proxies
+if app.config['PROXY_COUNT']:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'])
+
+# Auth endpoint throttling, checked before any Argon2 or database work
+auth_limiter = RateLimiter({
+    'login_ip': Limit.parse(app.config['RATE_LIMIT_LOGIN_PER_IP']),
+    'login_user': Limit.parse(app.config['RATE_LIMIT_LOGIN_PER_USER']),
+    'register_ip': Limit.parse(app.config['RATE_LIMIT_REGISTER_PER_IP']),
+}, create_backend(app.config['RATE_LIMIT_STORAGE_URI']))
+
+# Argon2 runs on eventlet's native thread pool so one hash doesn't stall every request in the worker
+tpool.set_num_threads(app.config['ARGON2_EXECUTOR_WORKERS'])
+argon2_queue = InFlight()
+
+def run_argon2(func, *args):
+    """Run an Argon2 hash/verify call on the thread pool, counted while queued or running"""
+    # The span is opened here: pool threads have no request context, so one opened there is dropped
+    name = 'argon2.verify' if func is verify_master_password else 'argon2.hash'
+    with argon2_queue, tracing.span(name, 'argon2'):
+        return tpool.execute(func, *args)
+
+def rate_limited(*keys):
+    """Return a 429 response if any (limit, key) bucket is empty, else None"""
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return None
+    retry_after = auth_limiter.check(keys)
+    if retry_after:
+        return jsonify({'error': 'Too many attempts, try again later'}), 429, {'Retry-After': str(retry_after)}
+    return None
+
+# Database repository, connected lazily in each worker process
+db_repo = tracing.TracedRepository(LazyRepository(get_config(config_name)))
+
+# Encrypted attachment bytes, kept outside the database rows
+blob_store = create_blob_store(get_config(config_name))
+
+def release_blob(blob_id):
+    """Delete a blob once no attachment references it"""
+    if db_repo.count_blob_references(blob_id) == 0:
+        blob_store.delete(blob_id)
+
+# Per-user typeahead indexes, built from the vault on first lookup
+typeahead = TypeaheadCache(lambda user_id: db_repo.get_passwords(user_id),
+                           app.config['TYPEAHEAD_MAX_USERS'], app.config['TYPEAHEAD_TTL_SECONDS'])
+
+# Breached password index, memory-mapped in the master so workers share its pages
+breached_passwords = BreachedPasswordFilter(app.config['BREACHED_PASSWORDS_PATH'])
+
+# Username/email existence filter; answers "maybe" until warmed and whenever a sync is overdue
+user_filter = UserExistenceFilter(app.config['USER_FILTER_CAPACITY'], app.config['USER_FILTER_ERROR_RATE'],
+                                  app.config['USER_FILTER_SYNC_SECONDS'])
+
+def warm_user_filter():
+    """Build the existence filter from a streamed scan of users, or add those created since the last one"""
+    user_filter.load(db_repo.iter_user_identities(since=user_filter.since()))
+
+def sync_user_filter(sleep=time.sleep):
+    """Background loop: add users registered through other workers"""
+    while True:
+        try:
+            warm_user_filter()
+        except Exception:
+            logger.exception("User filter sync failed")
+        sleep(user_filter.sync_interval)
+
+# JWT revocation list, checked in memory and synced from the repository in the background
+revocations = RevocationList(db_repo, app.config['JWT_EXPIRATION_HOURS'] * 3600,
+                             app.config['TOKEN_REVOCATION_SYNC_SECONDS'])
+
+# Master password changes: chunked, resumable re-encryption committed atomically
+rotations = VaultRotations(db_repo, app.config['ROTATION_TTL_SECONDS'],
+                           app.config['ROTATION_CHUNK_MAX_ENTRIES'], app.config['ROTATION_PURGE_SECONDS'])
+# Attachments are encrypted under the master password but are not part of a rotation
+ATTACHMENTS_BLOCK_ROTATION = 'Download and delete attachments before changing the master password'
+
+# Previous versions of entries, kept outside the entries table and pruned in the background
+history = PasswordHistory(db_repo, app.config['PASSWORD_HISTORY_LIMIT'],
+                          app.config['PASSWORD_HISTORY_PRUNE_SECONDS'], app.config['PASSWORD_HISTORY_PRUNE_BATCH'])
+
+# Security audit trail: events are buffered in memory and written in bulk in the background
+audit = AuditLog(db_repo, app.config['AUDIT_BUFFER_SIZE'], app.config['AUDIT_BACKPRESSURE'],
+                 app.config['AUDIT_BLOCK_TIMEOUT_MS'] / 1000, app.config['AUDIT_BATCH_SIZE'],
+                 app.config['AUDIT_FLUSH_SECONDS'], app.config['AUDIT_RETENTION_DAYS'],
+                 app.config['AUDIT_ENABLED'], app.config['AUDIT_TOKEN_USE'], app.config['AUDIT_MAX_ATTEMPTS'])
+
+# Readiness from cached database probes, pool usage and the Argon2 queue
+readiness = Readiness(db_repo, argon2_queue, app.config['READINESS_PROBE_SECONDS'],
+                      app.config['READINESS_MAX_DB_LATENCY_MS'], app.config['READINESS_MAX_POOL_SATURATION'],
+                      app.config['READINESS_MAX_ARGON2_QUEUE'])
+
+def start_draining():
+    """Report unready, then keep serving long enough for load balancers to notice"""
+    readiness.draining = True
+    logger.info(f"Draining: unready for {app.config['DRAIN_DELAY_SECONDS']}s before closing the listener")
+    socketio.sleep(app.config['DRAIN_DELAY_SECONDS'])
+
+def disconnect_clients():
+    """Close every Socket.IO connection held by this worker"""
+    socketio.server.eio.disconnect()
+
+def shutdown():
+    """Flush buffered audit events, logs and spans and close database connections (worker exit)"""
+    try:
+        audit.flush()
+    except Exception:
+        logger.exception("Lost %d audit events at shutdown", audit.pending())
+    if span_exporter is not None:
+        span_exporter.flush()
+    db_repo.release()
+    logger.info("Worker shut down")
+    structured_logging.flush()
 
-# WebSocket
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+_startup_reported = False
 
-# Initialize database repository
-db_repo = get_repository(get_config(config_name))
+@app.after_request
+def report_startup_timing(response):
+    global _startup_reported
+    if not _startup_reported:
+        _startup_reported = True
+        startup_timing.mark('first_request')
+        logger.info("Startup timing", extra={'startup_ms': startup_timing.report()})
+    return response
 
 @app.after_request
-def add_cors_headers(response):
-    origin = request.headers.get('Origin')
-    if origin:
-        response.headers['Access-Control-Allow-Origin'] = origin
-    else:
-        response.headers['Access-Control-Allow-Origin'] = '*'
-
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
-    response.headers['Access-Control-Allow-Credentials'] = 'true'
+def compress_response(response):
+    if (response.direct_passthrough or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')
+            or response.mimetype != 'application/json'):
+        return response
+
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_BYTES']:
+        return response
+
+    with tracing.span('gzip', 'compress'):
+        response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
     return response
 
 # Health check
@@ -49,10 +213,30 @@ def add_cors_headers(response):
 def health():
     return jsonify({'status': 'healthy', 'database': app.config['DATABASE_TYPE']}), 200
 
+# Liveness: the process is serving requests (restart it if not)
+@app.route('/health/live', methods=['GET'])
+def liveness():
+    return jsonify({'status': 'alive'}), 200
+
+# Readiness: whether this worker should receive traffic; never queries the database itself
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    ready, report = readiness.status()
+    return jsonify(report), 200 if ready else 503
+
+# Rate limiter counters for this worker process
+@app.route('/metrics/rate-limits', methods=['GET'])
+def rate_limit_metrics():
+    return jsonify({'pid': os.getpid(), 'limits': auth_limiter.stats}), 200
+
 # Register
 @app.route('/api/auth/register', methods=['POST'])
 def register():
     try:
+        limited = rate_limited(('register_ip', request.remote_addr))
+        if limited:
+            return limited
+
         data = request.json
         username = sanitize_input(data.get('username', ''))
         email = sanitize_input(data.get('email', ''))
@@ -61,22 +245,21 @@ def register():
         if not username or not email or not master_password:
             return jsonify({'error': 'All fields are required'}), 400
 
-        is_valid, message = validate_password_strength(master_password)
+        is_valid, message = validate_password_strength(master_password, breached_passwords)
         if not is_valid:
             return jsonify({'error': message}), 400
 
-        # Check if user exists
-        if db_repo.get_user_by_username(username):
-            return jsonify({'error': 'Username already exists'}), 409
-
-        if db_repo.get_user_by_email(email):
-            return jsonify({'error': 'Email already exists'}), 409
-
-        # Create user
+        # Create user, relying on unique constraints for duplicates
         salt = generate_salt()
-        password_hash = hash_master_password(master_password, salt)
+        password_hash = run_argon2(hash_master_password, master_password, salt)
+
+        try:
+            user = db_repo.create_user(username, email, password_hash, salt)
+        except DuplicateUserError as e:
+            return jsonify({'error': str(e)}), 409
 
-        user = db_repo.create_user(username, email, password_hash, salt)
+        user_filter.add(user['username'], user['email'])
+        audit.record('auth.register', user['id'])
 
         # Generate token
         token = generate_jwt_token(
@@ -100,6 +283,23 @@ def register():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Username availability
+@app.route('/api/auth/username-available', methods=['GET'])
+def username_available():
+    try:
+        username = sanitize_input(request.args.get('username', ''))
+        if not username:
+            return jsonify({'error': 'Username is required'}), 400
+
+        # Definite negative from a recently synced filter skips the database
+        available = (not user_filter.might_have_username(username)
+                     or db_repo.get_user_by_username(username) is None)
+
+        return jsonify({'username': username, 'available': available}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Login
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -111,13 +311,22 @@ def login():
         if not username or not master_password:
             return jsonify({'error': 'Username and password are required'}), 400
 
+        limited = rate_limited(('login_ip', request.remote_addr), ('login_user', username.lower()))
+        if limited:
+            audit.record('auth.login_throttled', username=username)
+            return limited
+
         user = db_repo.get_user_by_username(username)
         if not user:
+            audit.record('auth.login_failed', username=username, reason='unknown user')
             return jsonify({'error': 'Invalid credentials'}), 401
 
-        if not verify_master_password(master_password, user['salt'], user['master_password_hash']):
+        if not run_argon2(verify_master_password, master_password, user['salt'], user['master_password_hash']):
+            audit.record('auth.login_failed', user['id'], username=username, reason='wrong password')
             return jsonify({'error': 'Invalid credentials'}), 401
 
+        audit.record('auth.login', user['id'])
+
         token = generate_jwt_token(
             user['id'],
             user['username'],
@@ -138,23 +347,85 @@ def login():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Logout (revoke the presented token)
+@app.route('/api/auth/logout', methods=['POST'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def logout():
+    try:
+        revocations.revoke(request.current_user)
+        audit.record('auth.logout', request.current_user['user_id'], jti=request.current_user.get('jti'))
+        return jsonify({'message': 'Logged out'}), 200
+
+    except Exception as e:
+        logger.exception('Logout error')
+        return jsonify({'error': str(e)}), 500
+
+# Sign out all devices (revoke every token issued to the user so far)
+@app.route('/api/auth/logout-all', methods=['POST'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def logout_all():
+    try:
+        revocations.revoke_all(request.current_user['user_id'])
+        audit.record('auth.logout_all', request.current_user['user_id'])
+        return jsonify({'message': 'Signed out on all devices'}), 200
+
+    except Exception as e:
+        logger.exception('Logout all error')
+        return jsonify({'error': str(e)}), 500
+
+# The signed-in user's security audit trail, newest first
+@app.route('/api/audit', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def get_audit_events():
+    try:
+        args = request.args
+        try:
+            page = audit.query(
+                request.current_user['user_id'],
+                since=parse_timestamp(args.get('since')),
+                until=parse_timestamp(args.get('until')),
+                event=args.get('event') or None,
+                limit=min(max(args.get('limit', 100, type=int), 1), 500),
+                before=args.get('before') or None
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        return jsonify(page), 200
+
+    except Exception as e:
+        logger.exception('Get audit events error')
+        return jsonify({'error': str(e)}), 500
+
 # Get all passwords
 @app.route('/api/passwords', methods=['GET'])
-@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
 def get_passwords():
     try:
         user_id = request.current_user['user_id']
-        passwords = db_repo.get_passwords(user_id)
+        args = request.args
+        if not any(key in args for key in ('folder', 'tag', 'limit', 'after')):
+            return jsonify({'passwords': db_repo.get_passwords(user_id)}), 200
 
-        return jsonify({'passwords': passwords}), 200
+        # Filtered and paginated in the database; pass next_after back as after
+        limit = min(max(args.get('limit', 100, type=int), 1), app.config['MAX_PASSWORD_ENTRIES'])
+        passwords = db_repo.list_passwords(
+            user_id,
+            folder=sanitize_input(args.get('folder'), max_length=100) or None,
+            tag=sanitize_input(args.get('tag'), max_length=50).lower() or None,
+            limit=limit,
+            after=args.get('after') or None
+        )
+        next_after = passwords[-1]['id'] if len(passwords) == limit else None
+        return jsonify({'passwords': passwords, 'next_after': next_after}), 200
 
     except Exception as e:
-        print(f"❌ Get passwords error: {e}")
+        logger.exception('Get passwords error')
         return jsonify({'error': str(e)}), 500
 
 # Create password
 @app.route('/api/passwords', methods=['POST'])
-@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
 def create_password():
     try:
         user_id = request.current_user['user_id']
@@ -171,10 +442,20 @@ def create_password():
         encrypted_password = data.get('encrypted_password', '')
         iv = data.get('iv', '')
         notes = data.get('notes', '')
+        fingerprint = data.get('fingerprint') or None
+        folder = sanitize_input(data.get('folder'), max_length=100) or None
 
         if not website_url or not encrypted_password:
             return jsonify({'error': 'Website URL and password are required'}), 400
 
+        try:
+            tags = normalize_tags(data.get('tags'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if fingerprint is not None and not is_valid_fingerprint(fingerprint):
+            return jsonify({'error': 'Invalid password fingerprint'}), 400
+
         password = db_repo.create_password(
             user_id,
             website_url,
@@ -182,8 +463,13 @@ def create_password():
             username,
             encrypted_password,
             iv,
-            notes
+            notes,
+            fingerprint,
+            folder,
+            tags
         )
+        typeahead.on_upsert(user_id, password)
+        audit.record('vault.entry_created', user_id, password_id=password['id'])
 
         return jsonify({
             'message': 'Password created successfully',
@@ -191,12 +477,12 @@ def create_password():
         }), 201
 
     except Exception as e:
-        print(f"❌ Create password error: {e}")
+        logger.exception('Create password error')
         return jsonify({'error': str(e)}), 500
 
 # Get specific password
 @app.route('/api/passwords/<password_id>', methods=['GET'])
-@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
 def get_password(password_id):
     try:
         user_id = request.current_user['user_id']
@@ -205,15 +491,17 @@ def get_password(password_id):
         if not password:
             return jsonify({'error': 'Password not found'}), 404
 
+        typeahead.on_used(user_id, password_id, password['last_used'])
+
         return jsonify({'password': password}), 200
 
     except Exception as e:
-        print(f"❌ Get password error: {e}")
+        logger.exception('Get password error')
         return jsonify({'error': str(e)}), 500
 
 # Update password
 @app.route('/api/passwords/<password_id>', methods=['PUT'])
-@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
 def update_password(password_id):
     try:
         user_id = request.current_user['user_id']
@@ -232,38 +520,183 @@ def update_password(password_id):
             update_data['iv'] = data['iv']
         if 'notes' in data:
             update_data['notes'] = data['notes']
+        if 'fingerprint' in data:
+            if data['fingerprint'] and not is_valid_fingerprint(data['fingerprint']):
+                return jsonify({'error': 'Invalid password fingerprint'}), 400
+            update_data['fingerprint'] = data['fingerprint'] or None
+        if 'folder' in data:
+            update_data['folder'] = sanitize_input(data['folder'], max_length=100) or None
+        if 'tags' in data:
+            try:
+                update_data['tags'] = normalize_tags(data['tags'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
 
         success = db_repo.update_password(password_id, user_id, update_data)
 
         if not success:
             return jsonify({'error': 'Password not found'}), 404
 
-        return jsonify({'message': 'Password updated successfully'}), 200
+        if 'website_url' in update_data or 'website_name' in update_data:
+            typeahead.invalidate(user_id)
+        audit.record('vault.entry_updated', user_id, password_id=password_id, fields=sorted(update_data))
+
+        return jsonify({
+            'message': 'Password updated successfully',
+            'password': db_repo.get_password_by_id(password_id, user_id)
+        }), 200
+
+    except Exception as e:
+        logger.exception('Update password error')
+        return jsonify({'error': str(e)}), 500
+
+# Previous versions of a password entry, newest first
+@app.route('/api/passwords/<password_id>/history', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def get_password_history(password_id):
+    try:
+        user_id = request.current_user['user_id']
+        page = history.page(password_id, user_id, request.args.get('limit', 20, type=int),
+                            request.args.get('before', type=int))
+        return jsonify(page), 200
 
     except Exception as e:
-        print(f"❌ Update password error: {e}")
+        logger.exception('Get password history error')
         return jsonify({'error': str(e)}), 500
 
 # Delete password
 @app.route('/api/passwords/<password_id>', methods=['DELETE'])
-@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
 def delete_password(password_id):
     try:
         user_id = request.current_user['user_id']
+        for attachment in db_repo.get_attachments(password_id, user_id):
+            if db_repo.delete_attachment(attachment['id'], user_id):
+                release_blob(attachment['blob_id'])
+
         success = db_repo.delete_password(password_id, user_id)
 
         if not success:
             return jsonify({'error': 'Password not found'}), 404
 
+        typeahead.on_delete(user_id, password_id)
+        audit.record('vault.entry_deleted', user_id, password_id=password_id)
+
         return jsonify({'message': 'Password deleted successfully'}), 200
 
     except Exception as e:
-        print(f"❌ Delete password error: {e}")
+        logger.exception('Delete password error')
+        return jsonify({'error': str(e)}), 500
+
+# Upload an attachment (raw encrypted bytes, streamed in chunks)
+@app.route('/api/passwords/<password_id>/attachments', methods=['POST'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def upload_attachment(password_id):
+    try:
+        user_id = request.current_user['user_id']
+        filename = sanitize_input(request.args.get('filename', ''), max_length=255)
+        if not filename:
+            return jsonify({'error': 'Filename is required'}), 400
+
+        # Largest upload allowed by both the per-file limit and the remaining quota
+        remaining = app.config['ATTACHMENT_QUOTA_BYTES'] - db_repo.get_storage_usage(user_id)
+        limit = min(app.config['MAX_ATTACHMENT_BYTES'], remaining)
+        if request.content_length is not None and request.content_length > limit:
+            return jsonify({'error': 'Attachment too large or storage quota exceeded'}), 413
+
+        chunk_size = app.config['ATTACHMENT_CHUNK_BYTES']
+        chunks = iter(lambda: request.stream.read(chunk_size), b'')
+        try:
+            blob_id, size = blob_store.put(chunks, max_bytes=limit)
+        except BlobTooLarge:
+            return jsonify({'error': 'Attachment too large or storage quota exceeded'}), 413
+
+        attachment = db_repo.create_attachment(user_id, password_id, filename, blob_id, size)
+        if not attachment:
+            release_blob(blob_id)
+            return jsonify({'error': 'Password not found'}), 404
+
+        audit.record('vault.attachment_added', user_id, password_id=password_id, attachment_id=attachment['id'],
+                     size=size)
+        return jsonify({
+            'message': 'Attachment uploaded successfully',
+            'attachment': attachment
+        }), 201
+
+    except Exception as e:
+        logger.exception('Upload attachment error')
+        return jsonify({'error': str(e)}), 500
+
+# List a password entry's attachments
+@app.route('/api/passwords/<password_id>/attachments', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def list_attachments(password_id):
+    try:
+        user_id = request.current_user['user_id']
+        attachments = db_repo.get_attachments(password_id, user_id)
+
+        return jsonify({
+            'attachments': attachments,
+            'storage_used': db_repo.get_storage_usage(user_id),
+            'storage_quota': app.config['ATTACHMENT_QUOTA_BYTES']
+        }), 200
+
+    except Exception as e:
+        logger.exception('List attachments error')
+        return jsonify({'error': str(e)}), 500
+
+# Download an attachment (sendfile for local blobs; Range requests supported)
+@app.route('/api/attachments/<attachment_id>', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def download_attachment(attachment_id):
+    try:
+        user_id = request.current_user['user_id']
+        attachment = db_repo.get_attachment(attachment_id, user_id)
+        if not attachment:
+            return jsonify({'error': 'Attachment not found'}), 404
+
+        blob = blob_store.open(attachment['blob_id'])
+        if blob is None:
+            return jsonify({'error': 'Attachment data is missing'}), 404
+
+        if blob.path:
+            return send_file(blob.path, mimetype='application/octet-stream', as_attachment=True,
+                             download_name=attachment['filename'], conditional=True,
+                             etag=blob.blob_id, max_age=0)
+
+        response = Response(wrap_file(request.environ, blob.fileobj),
+                            mimetype='application/octet-stream', direct_passthrough=True)
+        response.headers.set('Content-Disposition', 'attachment', filename=attachment['filename'])
+        response.set_etag(blob.blob_id)
+        return response.make_conditional(request, accept_ranges=True, complete_length=blob.length)
+
+    except Exception as e:
+        logger.exception('Download attachment error')
+        return jsonify({'error': str(e)}), 500
+
+# Delete an attachment
+@app.route('/api/attachments/<attachment_id>', methods=['DELETE'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def delete_attachment(attachment_id):
+    try:
+        user_id = request.current_user['user_id']
+        attachment = db_repo.delete_attachment(attachment_id, user_id)
+        if not attachment:
+            return jsonify({'error': 'Attachment not found'}), 404
+
+        release_blob(attachment['blob_id'])
+        audit.record('vault.attachment_deleted', user_id, password_id=attachment['password_id'],
+                     attachment_id=attachment_id)
+
+        return jsonify({'message': 'Attachment deleted successfully'}), 200
+
+    except Exception as e:
+        logger.exception('Delete attachment error')
         return jsonify({'error': str(e)}), 500
 
 # Search passwords
 @app.route('/api/passwords/search', methods=['POST'])
-@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
 def search_passwords():
     try:
         user_id = request.current_user['user_id']
@@ -275,9 +708,184 @@ def search_passwords():
         return jsonify({'passwords': passwords}), 200
 
     except Exception as e:
-        print(f"❌ Search passwords error: {e}")
+        logger.exception('Search passwords error')
+        return jsonify({'error': str(e)}), 500
+
+# Typeahead over site names and hosts, most recently used first
+@app.route('/api/passwords/typeahead', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def typeahead_search():
+    try:
+        user_id = request.current_user['user_id']
+        query = request.args.get('q', '')
+        limit = min(request.args.get('limit', 10, type=int), 50)
+
+        results = typeahead.search(user_id, query, limit)
+
+        return jsonify({'results': results}), 200
+
+    except Exception as e:
+        logger.exception('Typeahead error')
+        return jsonify({'error': str(e)}), 500
+
+# Vault health: reused and stale passwords
+@app.route('/api/passwords/health', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def password_health():
+    try:
+        user_id = request.current_user['user_id']
+        stale_days = request.args.get('stale_days', app.config['PASSWORD_STALE_DAYS'], type=int)
+        stale_before = datetime.utcnow() - timedelta(days=stale_days)
+
+        health = db_repo.get_password_health(user_id, stale_before)
+
+        return jsonify({**health, 'stale_days': stale_days}), 200
+
+    except Exception as e:
+        logger.exception('Password health error')
+        return jsonify({'error': str(e)}), 500
+
+# Folder sidebar, from counters maintained on every write
+@app.route('/api/folders', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def get_folders():
+    try:
+        user_id = request.current_user['user_id']
+        counts = db_repo.get_folder_counts(user_id)
+
+        return jsonify({
+            'folders': [{'name': name, 'count': count} for name, count in counts.items()],
+            'total': db_repo.get_password_count(user_id)
+        }), 200
+
+    except Exception as e:
+        logger.exception('Get folders error')
+        return jsonify({'error': str(e)}), 500
+
+# Start a master password change; the client then uploads re-encrypted entries in chunks
+@app.route('/api/vault/rotations', methods=['POST'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def open_rotation():
+    try:
+        user_id = request.current_user['user_id']
+        limited = rate_limited(('login_ip', request.remote_addr), ('login_user', user_id))
+        if limited:
+            return limited
+
+        data = request.json
+        current_password = data.get('current_master_password', '')
+        new_password = data.get('new_master_password', '')
+        if not current_password or not new_password:
+            return jsonify({'error': 'Current and new master passwords are required'}), 400
+
+        is_valid, message = validate_password_strength(new_password, breached_passwords)
+        if not is_valid:
+            return jsonify({'error': message}), 400
+
+        user = db_repo.get_user_by_id(user_id)
+        if not user or not run_argon2(verify_master_password, current_password, user['salt'],
+                                      user['master_password_hash']):
+            audit.record('vault.rotation_denied', user_id, reason='wrong password')
+            return jsonify({'error': 'Invalid credentials'}), 401
+        if db_repo.get_user_attachments(user_id):
+            return jsonify({'error': ATTACHMENTS_BLOCK_ROTATION}), 409
+
+        salt = generate_salt()
+        rotation = rotations.open(user_id, run_argon2(hash_master_password, new_password, salt), salt)
+        audit.record('vault.rotation_opened', user_id, rotation_id=rotation['rotation_id'])
+
+        return jsonify({**rotation, 'entries': db_repo.get_password_count(user_id)}), 201
+
+    except Exception as e:
+        logger.exception('Open rotation error')
+        return jsonify({'error': str(e)}), 500
+
+# Rotation progress, for resuming after a disconnect
+@app.route('/api/vault/rotations/<rotation_id>', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def get_rotation(rotation_id):
+    try:
+        status = rotations.status(rotation_id, request.current_user['user_id'])
+        if status is None:
+            return jsonify({'error': 'Rotation not found or expired'}), 404
+
+        return jsonify(status), 200
+
+    except Exception as e:
+        logger.exception('Get rotation error')
+        return jsonify({'error': str(e)}), 500
+
+# Stage one chunk of re-encrypted entries; re-sending a chunk overwrites it
+@app.route('/api/vault/rotations/<rotation_id>/chunks/<int:seq>', methods=['PUT'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def put_rotation_chunk(rotation_id, seq):
+    try:
+        try:
+            ack = rotations.put_chunk(rotation_id, request.current_user['user_id'], seq,
+                                      (request.json or {}).get('entries'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if ack is None:
+            return jsonify({'error': 'Rotation not found or expired'}), 404
+
+        return jsonify(ack), 200
+
+    except Exception as e:
+        logger.exception('Rotation chunk error')
+        return jsonify({'error': str(e)}), 500
+
+# Swap in every staged entry and the new master password at once
+@app.route('/api/vault/rotations/<rotation_id>/commit', methods=['POST'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def commit_rotation(rotation_id):
+    try:
+        user_id = request.current_user['user_id']
+
+        if db_repo.get_user_attachments(user_id):
+            return jsonify({'error': ATTACHMENTS_BLOCK_ROTATION}), 409
+        result = rotations.commit(rotation_id, user_id)
+
+        if result is None:
+            return jsonify({'error': 'Rotation not found or expired'}), 404
+        if not result['committed']:
+            return jsonify({
+                'error': 'Staged entries do not match the vault',
+                'missing': result['missing'],
+                'unexpected': result['unexpected'],
+                'changed': result['changed']
+            }), 409
+
+        # Tokens issued under the old master password, including this one, stop working
+        revocations.revoke_all(user_id)
+        audit.record('vault.rotation_committed', user_id, rotation_id=rotation_id, updated=result['updated'])
+
+        return jsonify({'message': 'Master password changed; sign in again', 'updated': result['updated']}), 200
+
+    except Exception as e:
+        logger.exception('Commit rotation error')
+        return jsonify({'error': str(e)}), 500
+
+# Abandon a rotation and its staged entries
+@app.route('/api/vault/rotations/<rotation_id>', methods=['DELETE'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'], revocations, audit)
+def abort_rotation(rotation_id):
+    try:
+        if not rotations.abort(rotation_id, request.current_user['user_id']):
+            return jsonify({'error': 'Rotation not found'}), 404
+
+        return jsonify({'message': 'Rotation cancelled'}), 200
+
+    except Exception as e:
+        logger.exception('Abort rotation error')
         return jsonify({'error': str(e)}), 500
 
 
 if __name__ == '__main__':
+    socketio.start_background_task(sync_user_filter, socketio.sleep)
+    socketio.start_background_task(revocations.run, socketio.sleep)
+    socketio.start_background_task(rotations.run, socketio.sleep)
+    socketio.start_background_task(history.run, socketio.sleep)
+    socketio.start_background_task(audit.run, socketio.sleep)
+    socketio.start_background_task(readiness.run, socketio.sleep)
     socketio.run(app, debug=app.config['DEBUG'], host='0.0.0.0', port=5000)
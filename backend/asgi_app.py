@@ -0,0 +1,496 @@
+"""
+Async (ASGI) serving mode for the Password Manager backend
+
+Serves the core of app.py's REST contract (register, login, username
+availability and password entry CRUD/search) with Quart and asyncio
+repositories. Argon2 hashing runs in a thread pool so it never blocks the
+event loop. Routes only app.py implements answer 501 here, and list
+filters/pagination (folder, tag, limit, after) answer 400.
+
+Run with: hypercorn asgi_app:app --bind 0.0.0.0:5000
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import wraps
+
+from quart import Quart, request, jsonify
+
+from blob_store import create_blob_store
+from config import get_config
+from database.db_factory import get_async_repository
+from database.base_repository import DuplicateUserError
+from existence_filter import UserExistenceFilter
+from auth import (
+    generate_salt,
+    hash_master_password,
+    verify_master_password,
+    generate_jwt_token,
+    decode_jwt_token
+)
+from cors import CorsPolicy
+from crypto_utils import sanitize_input, validate_password_strength, is_valid_fingerprint, normalize_tags
+from breach_filter import BreachedPasswordFilter
+from rate_limit import Limit, MemoryBackend, RateLimiter, create_backend
+from structured_logging import setup_logging
+from token_revocation import RevocationList
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+config_name = os.getenv('FLASK_ENV', 'development')
+app.config.from_object(get_config(config_name))
+setup_logging(app.config['LOG_LEVEL'], app.config['LOG_FORMAT'], app.config['LOG_ERROR_RATE'],
+              app.config['LOG_ERROR_BURST'], app.config['LOG_QUEUE_SIZE'])
+
+cors_policy = CorsPolicy(app.config['CORS_ORIGINS'], app.config['CORS_MAX_AGE'])
+breached_passwords = BreachedPasswordFilter(app.config['BREACHED_PASSWORDS_PATH'])
+
+# Client IPs come from X-Forwarded-For when running behind this many proxies
+if app.config['PROXY_COUNT']:
+    from hypercorn.middleware import ProxyFixMiddleware
+    app.asgi_app = ProxyFixMiddleware(app.asgi_app, mode='legacy', trusted_hops=app.config['PROXY_COUNT'])
+
+# Auth endpoint throttling with the same limits and keys as app.py, checked before any Argon2 work
+auth_limiter = RateLimiter({
+    'login_ip': Limit.parse(app.config['RATE_LIMIT_LOGIN_PER_IP']),
+    'login_user': Limit.parse(app.config['RATE_LIMIT_LOGIN_PER_USER']),
+    'register_ip': Limit.parse(app.config['RATE_LIMIT_REGISTER_PER_IP']),
+}, create_backend(app.config['RATE_LIMIT_STORAGE_URI']))
+
+argon2_executor = ThreadPoolExecutor(max_workers=app.config['ARGON2_EXECUTOR_WORKERS'],
+                                     thread_name_prefix='argon2')
+# Blobs of attachments deleted along with their entry
+blob_store = create_blob_store(get_config(config_name))
+db_repo = None
+user_filter = None
+revocations = None
+
+
+async def run_argon2(func, *args):
+    """Run an Argon2 hash/verify call on the executor"""
+    return await asyncio.get_running_loop().run_in_executor(argon2_executor, func, *args)
+
+
+async def release_blob(blob_id):
+    """Delete a blob once no attachment references it"""
+    if await db_repo.count_blob_references(blob_id) == 0:
+        await asyncio.to_thread(blob_store.delete, blob_id)
+
+
+async def rate_limited(*keys):
+    """Return a 429 response if any (limit, key) bucket is empty, else None"""
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return None
+    if isinstance(auth_limiter.backend, MemoryBackend):
+        retry_after = auth_limiter.check(keys)
+    else:
+        # The Redis round trip would block the event loop
+        retry_after = await asyncio.to_thread(auth_limiter.check, keys)
+    if retry_after:
+        return jsonify({'error': 'Too many attempts, try again later'}), 429, {'Retry-After': str(retry_after)}
+    return None
+
+
+async def warm_user_filter():
+    """Build the existence filter from a streamed scan of users, or add those created since the last one"""
+    started = datetime.utcnow()
+    async for username, email in db_repo.iter_user_identities(since=user_filter.since()):
+        user_filter.add(username, email)
+    user_filter.mark_synced(started)
+
+
+async def sync_user_filter():
+    """Background loop: add users registered through other workers"""
+    while True:
+        try:
+            await warm_user_filter()
+        except Exception:
+            logger.exception("User filter sync failed")
+        await asyncio.sleep(user_filter.sync_interval)
+
+
+@app.before_serving
+async def startup():
+    global db_repo, user_filter, revocations
+    db_repo = await get_async_repository(get_config(config_name))
+    user_filter = UserExistenceFilter(app.config['USER_FILTER_CAPACITY'], app.config['USER_FILTER_ERROR_RATE'],
+                                      app.config['USER_FILTER_SYNC_SECONDS'])
+    app.add_background_task(sync_user_filter)
+    # Logouts recorded by any worker (either serving mode) are loaded before the first request
+    revocations = RevocationList(db_repo, app.config['JWT_EXPIRATION_HOURS'] * 3600,
+                                 app.config['TOKEN_REVOCATION_SYNC_SECONDS'])
+    await revocations.sync_async()
+    app.add_background_task(revocations.run_async)
+
+
+@app.after_serving
+async def shutdown():
+    if db_repo:
+        await db_repo.close()
+    argon2_executor.shutdown(wait=False)
+
+
+@app.before_request
+async def answer_preflight():
+    if request.method == 'OPTIONS' and 'Access-Control-Request-Method' in request.headers:
+        origin = request.headers.get('Origin')
+        if not cors_policy.allows(origin):
+            return '', 403
+        return '', 204, cors_policy.preflight_headers(origin)
+
+
+@app.after_request
+async def add_cors_headers(response):
+    origin = request.headers.get('Origin')
+    response.vary.add('Origin')
+    if cors_policy.allows(origin):
+        response.headers.update(cors_policy.response_headers(origin))
+    return response
+
+
+def token_required(secret_key, algorithm='HS256'):
+    """
+    Async counterpart of auth.token_required for Quart routes,
+    checking the worker's revocation list the same way
+    """
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(*args, **kwargs):
+            token = None
+
+            if 'Authorization' in request.headers:
+                try:
+                    token = request.headers['Authorization'].split(' ')[1]  # Bearer <token>
+                except IndexError:
+                    return jsonify({'error': 'Invalid authorization header format'}), 401
+
+            if not token:
+                return jsonify({'error': 'Authentication token is missing'}), 401
+
+            payload = decode_jwt_token(token, secret_key, algorithm)
+            if not payload:
+                return jsonify({'error': 'Invalid or expired token'}), 401
+
+            if revocations.is_revoked(payload):
+                return jsonify({'error': 'Token has been revoked'}), 401
+
+            request.current_user = payload
+            return await f(*args, **kwargs)
+
+        return decorated_function
+    return decorator
+
+
+def issue_token(user):
+    return generate_jwt_token(
+        user['id'],
+        user['username'],
+        app.config['JWT_SECRET_KEY'],
+        app.config['JWT_ALGORITHM'],
+        app.config['JWT_EXPIRATION_HOURS']
+    )
+
+
+# Health check
+@app.route('/health', methods=['GET'])
+async def health():
+    return jsonify({'status': 'healthy', 'database': app.config['DATABASE_TYPE']}), 200
+
+# Liveness: the process is serving requests (restart it if not)
+@app.route('/health/live', methods=['GET'])
+async def liveness():
+    return jsonify({'status': 'alive'}), 200
+
+# Register
+@app.route('/api/auth/register', methods=['POST'])
+async def register():
+    try:
+        limited = await rate_limited(('register_ip', request.remote_addr))
+        if limited:
+            return limited
+
+        data = await request.get_json()
+        username = sanitize_input(data.get('username', ''))
+        email = sanitize_input(data.get('email', ''))
+        master_password = data.get('master_password', '')
+
+        if not username or not email or not master_password:
+            return jsonify({'error': 'All fields are required'}), 400
+
+        is_valid, message = validate_password_strength(master_password, breached_passwords)
+        if not is_valid:
+            return jsonify({'error': message}), 400
+
+        salt = generate_salt()
+        password_hash = await run_argon2(hash_master_password, master_password, salt)
+
+        try:
+            user = await db_repo.create_user(username, email, password_hash, salt)
+        except DuplicateUserError as e:
+            return jsonify({'error': str(e)}), 409
+
+        user_filter.add(user['username'], user['email'])
+
+        return jsonify({
+            'message': 'User registered successfully',
+            'user': {
+                'id': user['id'],
+                'username': user['username'],
+                'email': user['email']
+            },
+            'token': issue_token(user)
+        }), 201
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Username availability
+@app.route('/api/auth/username-available', methods=['GET'])
+async def username_available():
+    try:
+        username = sanitize_input(request.args.get('username', ''))
+        if not username:
+            return jsonify({'error': 'Username is required'}), 400
+
+        available = (not user_filter.might_have_username(username)
+                     or await db_repo.get_user_by_username(username) is None)
+
+        return jsonify({'username': username, 'available': available}), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Login
+@app.route('/api/auth/login', methods=['POST'])
+async def login():
+    try:
+        data = await request.get_json()
+        username = sanitize_input(data.get('username', ''))
+        master_password = data.get('master_password', '')
+
+        if not username or not master_password:
+            return jsonify({'error': 'Username and password are required'}), 400
+
+        limited = await rate_limited(('login_ip', request.remote_addr), ('login_user', username.lower()))
+        if limited:
+            return limited
+
+        user = await db_repo.get_user_by_username(username)
+        if not user:
+            return jsonify({'error': 'Invalid credentials'}), 401
+
+        if not await run_argon2(verify_master_password, master_password, user['salt'],
+                                user['master_password_hash']):
+            return jsonify({'error': 'Invalid credentials'}), 401
+
+        return jsonify({
+            'message': 'Login successful',
+            'user': {
+                'id': user['id'],
+                'username': user['username']
+            },
+            'token': issue_token(user)
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Get all passwords
+@app.route('/api/passwords', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+async def get_passwords():
+    try:
+        if any(key in request.args for key in ('folder', 'tag', 'limit', 'after')):
+            return jsonify({'error': 'folder, tag, limit and after are not supported in async mode'}), 400
+
+        passwords = await db_repo.get_passwords(request.current_user['user_id'])
+        return jsonify({'passwords': passwords}), 200
+
+    except Exception as e:
+        logger.exception('Get passwords error')
+        return jsonify({'error': str(e)}), 500
+
+# Create password
+@app.route('/api/passwords', methods=['POST'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+async def create_password():
+    try:
+        user_id = request.current_user['user_id']
+        data = await request.get_json()
+
+        count = await db_repo.get_password_count(user_id)
+        if count >= app.config['MAX_PASSWORD_ENTRIES']:
+            return jsonify({'error': 'Maximum password entries reached'}), 400
+
+        website_url = sanitize_input(data.get('website_url', ''))
+        website_name = sanitize_input(data.get('website_name', ''))
+        encrypted_password = data.get('encrypted_password', '')
+        fingerprint = data.get('fingerprint') or None
+        folder = sanitize_input(data.get('folder'), max_length=100) or None
+
+        if not website_url or not encrypted_password:
+            return jsonify({'error': 'Website URL and password are required'}), 400
+
+        try:
+            tags = normalize_tags(data.get('tags'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if fingerprint is not None and not is_valid_fingerprint(fingerprint):
+            return jsonify({'error': 'Invalid password fingerprint'}), 400
+
+        password = await db_repo.create_password(
+            user_id,
+            website_url,
+            website_name or website_url,
+            data.get('username', ''),
+            encrypted_password,
+            data.get('iv', ''),
+            data.get('notes', ''),
+            fingerprint,
+            folder,
+            tags
+        )
+
+        return jsonify({
+            'message': 'Password created successfully',
+            'password': password
+        }), 201
+
+    except Exception as e:
+        logger.exception('Create password error')
+        return jsonify({'error': str(e)}), 500
+
+# Get specific password
+@app.route('/api/passwords/<password_id>', methods=['GET'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+async def get_password(password_id):
+    try:
+        password = await db_repo.get_password_by_id(password_id, request.current_user['user_id'])
+
+        if not password:
+            return jsonify({'error': 'Password not found'}), 404
+
+        return jsonify({'password': password}), 200
+
+    except Exception as e:
+        logger.exception('Get password error')
+        return jsonify({'error': str(e)}), 500
+
+# Update password
+@app.route('/api/passwords/<password_id>', methods=['PUT'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+async def update_password(password_id):
+    try:
+        data = await request.get_json()
+
+        update_data = {}
+        for field in ('website_url', 'website_name'):
+            if field in data:
+                update_data[field] = sanitize_input(data[field])
+        for field in ('username', 'encrypted_password', 'iv', 'notes'):
+            if field in data:
+                update_data[field] = data[field]
+        if 'fingerprint' in data:
+            if data['fingerprint'] and not is_valid_fingerprint(data['fingerprint']):
+                return jsonify({'error': 'Invalid password fingerprint'}), 400
+            update_data['fingerprint'] = data['fingerprint'] or None
+        if 'folder' in data:
+            update_data['folder'] = sanitize_input(data['folder'], max_length=100) or None
+        if 'tags' in data:
+            try:
+                update_data['tags'] = normalize_tags(data['tags'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
+        user_id = request.current_user['user_id']
+        success = await db_repo.update_password(password_id, user_id, update_data)
+
+        if not success:
+            return jsonify({'error': 'Password not found'}), 404
+
+        return jsonify({
+            'message': 'Password updated successfully',
+            'password': await db_repo.get_password_by_id(password_id, user_id)
+        }), 200
+
+    except Exception as e:
+        logger.exception('Update password error')
+        return jsonify({'error': str(e)}), 500
+
+# Delete password
+@app.route('/api/passwords/<password_id>', methods=['DELETE'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+async def delete_password(password_id):
+    try:
+        user_id = request.current_user['user_id']
+        for attachment in await db_repo.get_attachments(password_id, user_id):
+            if await db_repo.delete_attachment(attachment['id'], user_id):
+                await release_blob(attachment['blob_id'])
+
+        success = await db_repo.delete_password(password_id, user_id)
+
+        if not success:
+            return jsonify({'error': 'Password not found'}), 404
+
+        return jsonify({'message': 'Password deleted successfully'}), 200
+
+    except Exception as e:
+        logger.exception('Delete password error')
+        return jsonify({'error': str(e)}), 500
+
+# Search passwords
+@app.route('/api/passwords/search', methods=['POST'])
+@token_required(app.config['JWT_SECRET_KEY'], app.config['JWT_ALGORITHM'])
+async def search_passwords():
+    try:
+        data = await request.get_json()
+        query = sanitize_input(data.get('url', ''))
+
+        passwords = await db_repo.search_passwords(request.current_user['user_id'], query)
+
+        return jsonify({'passwords': passwords}), 200
+
+    except Exception as e:
+        logger.exception('Search passwords error')
+        return jsonify({'error': str(e)}), 500
+
+
+# Routes only app.py serves; 501 tells clients apart from a mistyped path
+FLASK_ONLY_ROUTES = [
+    ('/health/ready', ['GET']),
+    ('/metrics/rate-limits', ['GET']),
+    ('/api/auth/logout', ['POST']),
+    ('/api/auth/logout-all', ['POST']),
+    ('/api/audit', ['GET']),
+    ('/api/passwords/<password_id>/history', ['GET']),
+    ('/api/passwords/<password_id>/attachments', ['GET', 'POST']),
+    ('/api/attachments/<attachment_id>', ['GET', 'DELETE']),
+    ('/api/passwords/typeahead', ['GET']),
+    ('/api/passwords/health', ['GET']),
+    ('/api/folders', ['GET']),
+    ('/api/vault/rotations', ['POST']),
+    ('/api/vault/rotations/<rotation_id>', ['GET', 'DELETE']),
+    ('/api/vault/rotations/<rotation_id>/chunks/<int:seq>', ['PUT']),
+    ('/api/vault/rotations/<rotation_id>/commit', ['POST']),
+]
+
+
+async def not_in_async_mode(**kwargs):
+    return jsonify({'error': 'Not available in async mode; this route is served by app.py'}), 501
+
+
+for rule, methods in FLASK_ONLY_ROUTES:
+    app.add_url_rule(rule, f'flask_only:{rule}', not_in_async_mode, methods=methods)
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config as HypercornConfig
+
+    hypercorn_config = HypercornConfig()
+    hypercorn_config.bind = ['0.0.0.0:5000']
+    asyncio.run(serve(app, hypercorn_config))
@@ -0,0 +1,164 @@
+"""
+Security audit log
+
+Routes and token_required record events (sign-ins, failed sign-ins, token
+use, vault changes) into a bounded in-memory ring buffer. A background task
+writes them to the repository in bulk inserts, so a request pays an append
+instead of a database write. When the buffer is full the policy decides:
+"drop_oldest" overwrites the oldest unwritten event, "block" makes the
+request wait up to block_timeout for the writer and then drops the new
+event. Dropped events are counted and logged. A batch whose insert keeps
+failing is retried ahead of newer events up to max_attempts times, then
+dropped with an error, so one bad batch cannot stall the log for good.
+
+Events are kept for retention_days: PostgreSQL stores them in monthly
+partitions that are dropped whole, MongoDB expires them with a TTL index.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('drop_oldest', 'block')
+PURGE_INTERVAL_SECONDS = 3600
+
+
+def _request_context() -> Tuple[Optional[str], Optional[str]]:
+    """Client address and correlation ID of the Flask request being served, if any"""
+    try:
+        from flask import g, has_request_context, request
+    except ImportError:
+        return None, None
+    if not has_request_context():
+        return None, None
+    return request.remote_addr, g.get('request_id')
+
+
+def encode_cursor(event: Dict[str, Any]) -> str:
+    return f"{event['ts']}|{event['id']}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """(ts, id) of the last event on the previous page; raises ValueError if malformed"""
+    ts, separator, event_id = cursor.partition('|')
+    if not separator or not event_id:
+        raise ValueError('Invalid cursor')
+    return datetime.fromisoformat(ts), event_id
+
+
+class AuditLog:
+    def __init__(self, repo, capacity: int = 10000, policy: str = 'drop_oldest', block_timeout: float = 0.1,
+                 batch_size: int = 500, flush_interval: float = 1.0, retention_days: int = 90,
+                 enabled: bool = True, token_use: bool = True, max_attempts: int = 5):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown audit backpressure policy {policy!r}; use one of {', '.join(POLICIES)}")
+        self.repo = repo
+        self.capacity = capacity
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.enabled = enabled
+        self.token_use = token_use
+        self.max_attempts = max(max_attempts, 1)
+        self.dropped = 0
+        self._buffer = deque()
+        self._not_full = threading.Condition()
+        # A batch whose insert failed, written again before anything newer
+        self._retry: List[Dict[str, Any]] = []
+        self._attempts = 0
+
+    def record(self, event: str, user_id: Optional[str] = None, **details):
+        """Buffer an event; never touches the database"""
+        if not self.enabled:
+            return
+        ip, request_id = _request_context()
+        now = datetime.utcnow()
+        entry = {
+            'id': uuid.uuid4().hex,
+            'ts': now,
+            'event': event,
+            'user_id': user_id,
+            'ip': ip,
+            'request_id': request_id,
+            'details': details,
+            'expires_at': now + timedelta(days=self.retention_days)
+        }
+        with self._not_full:
+            if len(self._buffer) >= self.capacity:
+                if self.policy == 'drop_oldest':
+                    self._buffer.popleft()
+                    self.dropped += 1
+                elif not self._not_full.wait_for(lambda: len(self._buffer) < self.capacity, self.block_timeout):
+                    self.dropped += 1
+                    return
+            self._buffer.append(entry)
+
+    def pending(self) -> int:
+        return len(self._buffer) + len(self._retry)
+
+    def _take(self) -> List[Dict[str, Any]]:
+        with self._not_full:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            self._not_full.notify_all()
+        return batch
+
+    def flush(self) -> int:
+        """Write buffered events, batch_size per insert, until the buffer is empty"""
+        written = 0
+        while True:
+            batch = self._retry or self._take()
+            if not batch:
+                break
+            self._retry = batch
+            try:
+                # Inserts skip ids already written, so retrying a batch is safe
+                self.repo.insert_audit_events(batch)
+            except Exception:
+                self._attempts += 1
+                if self._attempts >= self.max_attempts:
+                    logger.error("Dropped %d audit events after %d failed inserts", len(batch), self._attempts)
+                    self._retry, self._attempts = [], 0
+                raise
+            self._retry, self._attempts = [], 0
+            written += len(batch)
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            logger.warning("Dropped %d audit events with the buffer full (%s)", dropped, self.policy)
+        return written
+
+    def purge(self) -> int:
+        removed = self.repo.purge_audit_events(datetime.utcnow() - timedelta(days=self.retention_days))
+        if removed:
+            logger.info(f"Purged {removed} expired audit partitions/events")
+        return removed
+
+    def run(self, sleep=time.sleep):
+        """Background loop: write buffered events every flush_interval and apply retention hourly"""
+        next_purge = time.monotonic()
+        while True:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit log flush failed")
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + PURGE_INTERVAL_SECONDS
+                try:
+                    self.purge()
+                except Exception:
+                    logger.exception("Audit log purge failed")
+            sleep(self.flush_interval)
+
+    def query(self, user_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              event: Optional[str] = None, limit: int = 100, before: Optional[str] = None) -> Dict[str, Any]:
+        """A user's events newest first; pass next_before back as before for the next page"""
+        cursor = decode_cursor(before) if before else None
+        events = self.repo.get_audit_events(user_id, since, until, event, limit, cursor)
+        next_before = encode_cursor(events[-1]) if len(events) == limit else None
+        return {'events': events, 'next_before': next_before}
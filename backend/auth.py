@@ -3,12 +3,15 @@ Authentication module with Argon2 password hashing and JWT tokens
 """
 import jwt
 import secrets
+import time
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify
 
+from tracing import span
+
 # Initialize Argon2 password hasher
 ph = PasswordHasher(
     time_cost=3,
@@ -49,7 +52,9 @@ def generate_jwt_token(user_id, username, secret_key, algorithm='HS256', expirat
     payload = {
         'user_id': user_id,
         'username': username,
-        'iat': datetime.utcnow(),
+        'jti': secrets.token_hex(16),
+        # Sub-second precision, so a token issued right after a sign-out-everywhere stays valid
+        'iat': time.time(),
         'exp': datetime.utcnow() + timedelta(hours=expiration_hours)
     }
     token = jwt.encode(payload, secret_key, algorithm=algorithm)
@@ -68,30 +73,46 @@ def decode_jwt_token(token, secret_key, algorithm='HS256'):
     except jwt.InvalidTokenError:
         return None
 
-def token_required(secret_key, algorithm='HS256'):
+def token_required(secret_key, algorithm='HS256', revocations=None, audit=None):
     """
     Decorator to protect routes with JWT authentication
+    (and, if a RevocationList is given, reject revoked tokens).
+    With an AuditLog, rejected tokens are recorded, and accepted ones too
+    if it records token use.
     """
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            token = None
-            
-            # Get token from Authorization header
-            if 'Authorization' in request.headers:
-                auth_header = request.headers['Authorization']
-                try:
-                    token = auth_header.split(' ')[1]  # Bearer <token>
-                except IndexError:
-                    return jsonify({'error': 'Invalid authorization header format'}), 401
-            
-            if not token:
-                return jsonify({'error': 'Authentication token is missing'}), 401
-            
-            # Decode token
-            payload = decode_jwt_token(token, secret_key, algorithm)
-            if not payload:
-                return jsonify({'error': 'Invalid or expired token'}), 401
+            with span('token_required', 'auth'):
+                token = None
+                
+                # Get token from Authorization header
+                if 'Authorization' in request.headers:
+                    auth_header = request.headers['Authorization']
+                    try:
+                        token = auth_header.split(' ')[1]  # Bearer <token>
+                    except IndexError:
+                        return jsonify({'error': 'Invalid authorization header format'}), 401
+                
+                if not token:
+                    return jsonify({'error': 'Authentication token is missing'}), 401
+                
+                # Decode token
+                payload = decode_jwt_token(token, secret_key, algorithm)
+                if not payload:
+                    if audit is not None:
+                        audit.record('token.rejected', reason='invalid', path=request.path)
+                    return jsonify({'error': 'Invalid or expired token'}), 401
+                
+                if revocations is not None and revocations.is_revoked(payload):
+                    if audit is not None:
+                        audit.record('token.rejected', payload['user_id'], reason='revoked', jti=payload.get('jti'),
+                                     path=request.path)
+                    return jsonify({'error': 'Token has been revoked'}), 401
+                
+                if audit is not None and audit.token_use:
+                    audit.record('token.used', payload['user_id'], jti=payload.get('jti'),
+                                 method=request.method, path=request.path)
             
             # Pass user info to the route
             request.current_user = payload
@@ -0,0 +1,108 @@
+"""
+Micro-benchmark of the PostgreSQL entry read path: ORM objects + to_dict()
+versus the Core select() path used by PostgresRepository.get_passwords
+
+    python benchmarks/bench_read_path.py --uri postgresql://localhost/password_manager \
+        --sizes 10,100,1000 --repeat 50
+
+For each vault size a throwaway user is created with that many entries and
+removed afterwards. Latency is the median wall time of one read; allocations
+are the blocks and peak bytes traced by tracemalloc during one read.
+"""
+import argparse
+import os
+import secrets
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config import get_config  # noqa: E402
+from database.postgres_repository import PostgresRepository  # noqa: E402
+from models.postgres_models import PasswordEntry  # noqa: E402
+
+
+def orm_read(repo, user_id):
+    """The previous read path"""
+    return [pwd.to_dict() for pwd in repo.session.query(PasswordEntry).filter_by(user_id=user_id).all()]
+
+
+def core_read(repo, user_id):
+    return repo.get_passwords(user_id)
+
+
+def measure(read, repo, user_id, repeat):
+    read(repo, user_id)  # warm statement caches
+    repo.session.rollback()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        read(repo, user_id)
+        timings.append(time.perf_counter() - started)
+        repo.session.rollback()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    rows = read(repo, user_id)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    repo.session.rollback()
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    return {
+        'rows': len(rows),
+        'p50_ms': round(statistics.median(timings) * 1000, 3),
+        'blocks': blocks,
+        'peak_kb': round(peak / 1024, 1)
+    }
+
+
+def seed_user(repo, entries):
+    name = f'bench_{secrets.token_hex(4)}'
+    user = repo.create_user(name, f'{name}@example.com', 'hash', 'salt')
+    repo.import_passwords([{
+        'id': str(uuid.uuid4()),
+        'user_id': user['id'],
+        'website_url': f'https://site{i}.example.com',
+        'website_name': f'Site {i}',
+        'username': f'user{i}@example.com',
+        'encrypted_password': secrets.token_urlsafe(48),
+        'iv': secrets.token_hex(12),
+        'notes': '',
+        'fingerprint': secrets.token_hex(32)
+    } for i in range(entries)])
+    return user['id']
+
+
+def main():
+    config = get_config(os.getenv('FLASK_ENV', 'development'))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uri', default=config.POSTGRES_URI)
+    parser.add_argument('--sizes', default=f'10,100,{config.MAX_PASSWORD_ENTRIES}')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    repo = PostgresRepository(args.uri)
+    repo.initialize()
+    print(f"{'path':<6}{'entries':>9}{'p50 ms':>10}{'blocks':>10}{'peak KB':>10}")
+    try:
+        for size in (int(s) for s in args.sizes.split(',')):
+            user_id = seed_user(repo, size)
+            try:
+                for name, read in (('orm', orm_read), ('core', core_read)):
+                    r = measure(read, repo, user_id, args.repeat)
+                    print(f"{name:<6}{r['rows']:>9}{r['p50_ms']:>10}{r['blocks']:>10}{r['peak_kb']:>10}")
+            finally:
+                repo.delete_user(user_id)
+    finally:
+        repo.close()
+
+
+if __name__ == '__main__':
+    main()
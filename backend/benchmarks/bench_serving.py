@@ -0,0 +1,160 @@
+"""
+Load benchmark comparing serving modes at high connection counts
+
+Start the servers to compare, e.g.
+    python app.py                                        # sync (eventlet), port 5000
+    hypercorn asgi_app:app --bind 0.0.0.0:5001           # async (ASGI), port 5001
+
+then run
+    python benchmarks/bench_serving.py \
+        --target sync=http://localhost:5000 --target async=http://localhost:5001 \
+        --connections 50,200,1000 --duration 10
+
+Each connection is a keep-alive HTTP/1.1 client issuing GET /api/passwords
+for an authenticated benchmark user. Only the standard library is used.
+"""
+import argparse
+import asyncio
+import json
+import secrets
+import statistics
+import time
+from urllib.parse import urlparse
+
+
+async def http_request(reader, writer, host, method, path, body=None, token=None):
+    """Send one request on an open connection and return (status, body)"""
+    payload = json.dumps(body).encode() if body is not None else b''
+    headers = [
+        f'{method} {path} HTTP/1.1',
+        f'Host: {host}',
+        'Connection: keep-alive',
+        'Content-Type: application/json',
+        f'Content-Length: {len(payload)}'
+    ]
+    if token:
+        headers.append(f'Authorization: Bearer {token}')
+    writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + payload)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    length = 0
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode().partition(':')
+        if name.lower() == 'content-length':
+            length = int(value.strip())
+        elif name.lower() == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+
+    if chunked:
+        data = b''
+        while True:
+            size = int((await reader.readline()).strip(), 16)
+            if size == 0:
+                await reader.readline()
+                break
+            data += await reader.readexactly(size)
+            await reader.readline()
+        return status, data
+    return status, await reader.readexactly(length)
+
+
+async def prepare_user(base_url, entries):
+    """Register a throwaway user with some entries and return its token"""
+    url = urlparse(base_url)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    name = f'bench_{secrets.token_hex(4)}'
+    status, data = await http_request(reader, writer, url.netloc, 'POST', '/api/auth/register', {
+        'username': name,
+        'email': f'{name}@example.com',
+        'master_password': 'BenchPass123!'
+    })
+    if status != 201:
+        raise RuntimeError(f'Registration failed ({status}): {data!r}')
+    token = json.loads(data)['token']
+
+    for i in range(entries):
+        await http_request(reader, writer, url.netloc, 'POST', '/api/passwords', {
+            'website_url': f'https://site{i}.example.com',
+            'website_name': f'Site {i}',
+            'encrypted_password': secrets.token_urlsafe(48),
+            'iv': secrets.token_hex(12)
+        }, token)
+
+    writer.close()
+    return token
+
+
+async def worker(base_url, token, deadline, latencies, errors):
+    url = urlparse(base_url)
+    try:
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    except OSError:
+        errors.append('connect')
+        return
+
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            status, _ = await http_request(reader, writer, url.netloc, 'GET', '/api/passwords', token=token)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            errors.append('io')
+            break
+        if status != 200:
+            errors.append(status)
+        latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def run_load(base_url, token, connections, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(worker(base_url, token, deadline, latencies, errors) for _ in range(connections)))
+    return latencies, errors
+
+
+def summarize(latencies, errors, duration):
+    if not latencies:
+        return {'rps': 0.0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'errors': len(errors)}
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)] * 1000, 2)
+
+    return {
+        'rps': round(len(latencies) / duration, 1),
+        'p50_ms': round(statistics.median(ordered) * 1000, 2),
+        'p95_ms': pct(0.95),
+        'p99_ms': pct(0.99),
+        'errors': len(errors)
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', required=True, help='name=http://host:port')
+    parser.add_argument('--connections', default='50,200,1000')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--entries', type=int, default=100)
+    args = parser.parse_args()
+
+    targets = [t.split('=', 1) for t in args.target]
+    levels = [int(c) for c in args.connections.split(',')]
+
+    print(f"{'mode':<10}{'conns':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, base_url in targets:
+        token = await prepare_user(base_url, args.entries)
+        for connections in levels:
+            latencies, errors = await run_load(base_url, token, connections, args.duration)
+            r = summarize(latencies, errors, args.duration)
+            print(f"{name:<10}{connections:>8}{r['rps']:>10}{str(r['p50_ms']):>10}"
+                  f"{str(r['p95_ms']):>10}{str(r['p99_ms']):>10}{r['errors']:>8}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+"""
+Content-addressed storage for encrypted attachment blobs
+
+Blobs are kept out of the database rows: attachment metadata points at a
+blob by the SHA-256 of its (already client-encrypted) bytes. Uploads are
+consumed chunk by chunk and hashed while they are written, so a request
+body is never held in memory.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Iterable, NamedTuple, Optional, Tuple
+
+
+class BlobTooLarge(ValueError):
+    """Raised when an upload exceeds the allowed size; the partial blob is discarded"""
+
+
+class BlobHandle(NamedTuple):
+    blob_id: str
+    length: int
+    path: Optional[str] = None          # local file, served with sendfile
+    fileobj: Optional[BinaryIO] = None  # seekable stream (GridFS)
+
+
+class LocalBlobStore:
+    """Blobs as files under root/<2 hex>/<2 hex>/<sha256>"""
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def _path(self, blob_id: str) -> str:
+        return os.path.join(self.root, blob_id[:2], blob_id[2:4], blob_id)
+
+    def put(self, chunks: Iterable[bytes], max_bytes: Optional[int] = None) -> Tuple[str, int]:
+        """Store a stream of chunks; returns (blob_id, size)"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if max_bytes is not None and size > max_bytes:
+                        raise BlobTooLarge(f"Attachment exceeds {max_bytes} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+            blob_id = digest.hexdigest()
+            path = self._path(blob_id)
+            if os.path.exists(path):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return blob_id, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def open(self, blob_id: str) -> Optional[BlobHandle]:
+        path = self._path(blob_id)
+        try:
+            return BlobHandle(blob_id, os.path.getsize(path), path=path)
+        except FileNotFoundError:
+            return None
+
+    def delete(self, blob_id: str):
+        try:
+            os.unlink(self._path(blob_id))
+        except FileNotFoundError:
+            pass
+
+
+class GridFSBlobStore:
+    """Blobs in a GridFS bucket, stored under their SHA-256 as filename"""
+
+    def __init__(self, mongodb_uri: str, bucket_name: str = 'attachments'):
+        self.mongodb_uri = mongodb_uri
+        self.bucket_name = bucket_name
+        self._bucket = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self):
+        # MongoClient is not fork-safe: connect lazily in each process
+        if self._bucket is None or self._pid != os.getpid():
+            with self._lock:
+                if self._bucket is None or self._pid != os.getpid():
+                    import gridfs
+                    from pymongo import MongoClient
+                    client = MongoClient(self.mongodb_uri)
+                    self._bucket = gridfs.GridFSBucket(client.get_default_database('password_manager'),
+                                                       bucket_name=self.bucket_name)
+                    self._pid = os.getpid()
+        return self._bucket
+
+    def _find(self, blob_id: str):
+        return next(iter(self.bucket.find({'filename': blob_id}).limit(1)), None)
+
+    def put(self, chunks: Iterable[bytes], max_bytes: Optional[int] = None) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        upload = self.bucket.open_upload_stream('pending')
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise BlobTooLarge(f"Attachment exceeds {max_bytes} bytes")
+                digest.update(chunk)
+                upload.write(chunk)
+            upload.close()
+        except BaseException:
+            upload.abort()
+            raise
+
+        blob_id = digest.hexdigest()
+        if self._find(blob_id) is not None:
+            self.bucket.delete(upload._id)
+        else:
+            self.bucket.rename(upload._id, blob_id)
+        return blob_id, size
+
+    def open(self, blob_id: str) -> Optional[BlobHandle]:
+        found = self._find(blob_id)
+        if found is None:
+            return None
+        stream = self.bucket.open_download_stream(found._id)
+        return BlobHandle(blob_id, stream.length, fileobj=stream)
+
+    def delete(self, blob_id: str):
+        for grid_file in self.bucket.find({'filename': blob_id}):
+            self.bucket.delete(grid_file._id)
+
+
+def create_blob_store(config):
+    """GridFS when ATTACHMENT_STORE is 'gridfs', otherwise files under ATTACHMENT_DIR"""
+    if config.ATTACHMENT_STORE == 'gridfs':
+        return GridFSBlobStore(config.MONGODB_URI)
+    return LocalBlobStore(config.ATTACHMENT_DIR)
@@ -0,0 +1,231 @@
+"""
+Offline check of master passwords against a breach corpus
+
+The index file holds the sorted first 8 bytes of the SHA-1 of every
+breached password (the hashes the Pwned Passwords downloads list), after a
+table of where each 16-bit prefix bucket starts. It is memory-mapped
+read-only, so workers forked from the master share one copy in the page
+cache. A lookup reads two table slots and binary-searches one bucket: a few
+microseconds, no network. With 64-bit keys a false positive needs a
+collision with one of n stored hashes, about n / 2^64.
+
+Build or update it with `python manage.py build-breach-index`; the file is
+replaced atomically and running workers pick up the new one.
+"""
+import hashlib
+import heapq
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from typing import Iterable, Iterator, List, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PMBREACH'
+VERSION = 1
+BUCKET_BITS = 16
+_BUCKETS = 1 << BUCKET_BITS
+_HEADER = struct.Struct('>8sIIQQ')          # magic, version, key bytes, key count, built at
+_TABLE = struct.Struct(f'>{_BUCKETS + 1}Q')  # first key index of each bucket, then the count
+_SLOT = struct.Struct('>QQ')
+_KEY = struct.Struct('>Q')
+_KEYS_OFFSET = _HEADER.size + _TABLE.size
+_READ_ITEMS = 1 << 16
+
+
+class BreachIndexError(ValueError):
+    """Raised when a file is not a complete breach index"""
+
+
+def password_key(password: str) -> int:
+    """First 8 bytes of the password's SHA-1, as an integer"""
+    return int.from_bytes(hashlib.sha1(password.encode('utf-8')).digest()[:8], 'big')
+
+
+class BreachIndex:
+    """Read-only, memory-mapped view of an index file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            if stat.st_size < _KEYS_OFFSET:
+                raise BreachIndexError(f"{path} is not a breach index")
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, key_bytes, self.count, self.built_at = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or key_bytes != _KEY.size:
+            raise BreachIndexError(f"{path} is not a version {VERSION} breach index")
+        if len(self._mm) != _KEYS_OFFSET + self.count * _KEY.size:
+            raise BreachIndexError(f"{path} is truncated")
+
+    def __contains__(self, key: int) -> bool:
+        mm = self._mm
+        lo, hi = _SLOT.unpack_from(mm, _HEADER.size + (key >> (64 - BUCKET_BITS)) * 8)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = _KEY.unpack_from(mm, _KEYS_OFFSET + mid * _KEY.size)[0]
+            if value < key:
+                lo = mid + 1
+            elif value > key:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def __len__(self):
+        return self.count
+
+    def keys(self) -> Iterator[int]:
+        """Every key in ascending order"""
+        for start in range(0, self.count, _READ_ITEMS):
+            chunk = array('Q', self._mm[_KEYS_OFFSET + start * 8:_KEYS_OFFSET + (start + _READ_ITEMS) * 8])
+            if sys.byteorder == 'little':
+                chunk.byteswap()
+            yield from chunk
+
+
+class BreachedPasswordFilter:
+    """The index at path (disabled when path is empty), reopened when the file is replaced"""
+
+    def __init__(self, path: Optional[str], reload_interval: float = 60.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._index: Optional[BreachIndex] = None
+        self._checked = time.monotonic()
+        if path:
+            self._load()
+
+    def _load(self):
+        try:
+            self._index = BreachIndex(self.path)
+            logger.info(f"Breached password index loaded: {self._index.count} hashes")
+        except (FileNotFoundError, BreachIndexError) as e:
+            logger.warning(f"Breached password check disabled: {e}")
+            self._index = None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if self._index is None or self._index.identity != (stat.st_ino, stat.st_mtime_ns):
+            # The old mapping is unmapped once no lookup references it
+            self._load()
+
+    def is_breached(self, password: str) -> bool:
+        if not self.path:
+            return False
+        self._maybe_reload()
+        index = self._index
+        return index is not None and password_key(password) in index
+
+
+# Building
+
+def hibp_keys(lines: TextIO, min_count: int = 1) -> Iterator[int]:
+    """Keys from "SHA1HEX[:count]" lines (Pwned Passwords SHA-1 downloads)"""
+    for line in lines:
+        digest, _, count = line.strip().partition(':')
+        if not digest:
+            continue
+        if min_count > 1 and int(count or 0) < min_count:
+            continue
+        yield int(digest[:16], 16)
+
+
+def plaintext_keys(lines: TextIO) -> Iterator[int]:
+    """Keys from a wordlist, one password per line"""
+    for line in lines:
+        password = line.rstrip('\r\n')
+        if password:
+            yield password_key(password)
+
+
+def _write_run(keys: array, tmp_dir: str) -> str:
+    fd, path = tempfile.mkstemp(dir=tmp_dir, suffix='.run')
+    with os.fdopen(fd, 'wb') as f:
+        array('Q', sorted(set(keys))).tofile(f)
+    return path
+
+
+def _read_run(path: str) -> Iterator[int]:
+    with open(path, 'rb') as f:
+        while True:
+            chunk = array('Q')
+            try:
+                chunk.fromfile(f, _READ_ITEMS)
+            except EOFError:
+                yield from chunk
+                return
+            yield from chunk
+
+
+def _flush(f, keys: array):
+    if sys.byteorder == 'little':
+        keys.byteswap()
+    f.write(keys.tobytes())
+    del keys[:]
+
+
+def _write_index(sorted_keys: Iterable[int], output_path: str) -> int:
+    """Write deduplicated ascending keys with header and bucket table, then swap the file in"""
+    table = [0] * (_BUCKETS + 1)
+    count = 0
+    previous = None
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(bytes(_KEYS_OFFSET))
+        pending = array('Q')
+        for key in sorted_keys:
+            if key == previous:
+                continue
+            previous = key
+            table[(key >> (64 - BUCKET_BITS)) + 1] += 1
+            pending.append(key)
+            count += 1
+            if len(pending) >= _READ_ITEMS:
+                _flush(f, pending)
+        _flush(f, pending)
+
+        for bucket in range(_BUCKETS):
+            table[bucket + 1] += table[bucket]
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, _KEY.size, count, int(time.time())))
+        f.write(_TABLE.pack(*table))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    return count
+
+
+def build_index(keys: Iterable[int], output_path: str, run_size: int = 2_000_000,
+                tmp_dir: Optional[str] = None) -> int:
+    """
+    External sort: sorted runs of at most run_size keys are spilled to
+    temporary files and merged into the index. Returns the number of keys.
+    """
+    tmp_dir = tmp_dir or os.path.dirname(os.path.abspath(output_path))
+    runs: List[str] = []
+    try:
+        pending = array('Q')
+        for key in keys:
+            pending.append(key)
+            if len(pending) >= run_size:
+                runs.append(_write_run(pending, tmp_dir))
+                del pending[:]
+        if pending:
+            runs.append(_write_run(pending, tmp_dir))
+        return _write_index(heapq.merge(*(_read_run(run) for run in runs)), output_path)
+    finally:
+        for run in runs:
+            os.unlink(run)
@@ -9,33 +9,157 @@ class Config:
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key-change-in-production')
     JWT_ALGORITHM = 'HS256'
     JWT_EXPIRATION_HOURS = 24
+    # How often each worker pulls revocations recorded by other workers
+    TOKEN_REVOCATION_SYNC_SECONDS = float(os.getenv('TOKEN_REVOCATION_SYNC_SECONDS', '5'))
     
     # Database selection
     DATABASE_TYPE = os.getenv('DATABASE_TYPE', 'postgresql').lower()
     
+    # Apply migrations at startup instead of only verifying the schema version
+    SCHEMA_AUTO_MIGRATE = os.getenv('SCHEMA_AUTO_MIGRATE', 'false').lower() == 'true'
+    
     # PostgreSQL
     POSTGRES_URI = os.getenv('POSTGRES_URI', 'postgresql://localhost:5432/password_manager')
+    POSTGRES_REPLICA_URIS = [u for u in os.getenv('POSTGRES_REPLICA_URIS', '').split(',') if u]
     
     # MongoDB
     MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/password_manager')
+    MONGODB_REPLICA_URIS = [u for u in os.getenv('MONGODB_REPLICA_URIS', '').split(',') if u]
+    
+    # Sharding of password entries by user_id (directory stays on the primary URI)
+    SHARD_URIS = [u for u in os.getenv('SHARD_URIS', '').split(',') if u]
+    SHARD_PREVIOUS_URIS = [u for u in os.getenv('SHARD_PREVIOUS_URIS', '').split(',') if u]
+    SHARD_VIRTUAL_NODES = int(os.getenv('SHARD_VIRTUAL_NODES', '100'))
+    # Resharding fences a batch of users' writes, waits this long for writes already past the
+    # check, then copies; a fence older than SHARD_MOVE_FENCE_SECONDS lapses (e.g. after a crash)
+    SHARD_MOVE_GRACE_SECONDS = float(os.getenv('SHARD_MOVE_GRACE_SECONDS', '2'))
+    SHARD_MOVE_FENCE_SECONDS = float(os.getenv('SHARD_MOVE_FENCE_SECONDS', '300'))
+    
+    # Read replica routing
+    REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+    REPLICA_HEALTH_CHECK_SECONDS = float(os.getenv('REPLICA_HEALTH_CHECK_SECONDS', '10'))
+    READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+    # memory:// tracks recent writers per worker; redis://... shares them across workers
+    READ_YOUR_WRITES_STORAGE_URI = os.getenv('READ_YOUR_WRITES_STORAGE_URI', 'memory://')
+    
+    # Multi-worker deployment (e.g. redis://localhost:6379/0)
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE') or None
     
     # CORS
+    # Comma-separated exact origins, "chrome-extension://*" for any extension, or "*"
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', '*').split(',')
+    # Browsers cache preflights up to this long (Chromium caps it at 7200)
+    CORS_MAX_AGE = int(os.getenv('CORS_MAX_AGE', '86400'))
+    
+    # Threads used to run Argon2 off the event loop (eventlet's tpool, or the ASGI executor)
+    ARGON2_EXECUTOR_WORKERS = int(os.getenv('ARGON2_EXECUTOR_WORKERS', '4'))
+    
+    # Readiness: database probe interval and the thresholds above which a worker reports unready
+    READINESS_PROBE_SECONDS = float(os.getenv('READINESS_PROBE_SECONDS', '5'))
+    READINESS_MAX_DB_LATENCY_MS = float(os.getenv('READINESS_MAX_DB_LATENCY_MS', '500'))
+    READINESS_MAX_POOL_SATURATION = float(os.getenv('READINESS_MAX_POOL_SATURATION', '0.9'))
+    READINESS_MAX_ARGON2_QUEUE = int(os.getenv('READINESS_MAX_ARGON2_QUEUE', '32'))
+    # On SIGTERM, keep serving (reporting unready) this long before closing the listener
+    DRAIN_DELAY_SECONDS = float(os.getenv('DRAIN_DELAY_SECONDS', '5'))
+    
+    # Diagnostics: slow-query log (negative threshold disables) and request profiling
+    SLOW_QUERY_THRESHOLD_MS = float(os.getenv('SLOW_QUERY_THRESHOLD_MS', '200'))
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_TOKEN = os.getenv('PROFILE_TOKEN') or None
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    
+    # Logging: JSON lines through a bounded queue; errors rate limited per message
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    LOG_ERROR_RATE = float(os.getenv('LOG_ERROR_RATE', '1'))      # per second, per message
+    LOG_ERROR_BURST = int(os.getenv('LOG_ERROR_BURST', '10'))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    
+    # Tracing: Server-Timing response headers, optional JSON-lines span export
+    SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'true').lower() == 'true'
+    TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH') or None
+    
+    # Gzip JSON responses at least this large when the client accepts it
+    COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+    
+    # Auth rate limits ("<attempts>/<period>"); memory:// per worker or redis://... shared
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_STORAGE_URI = os.getenv('RATE_LIMIT_STORAGE_URI', 'memory://')
+    RATE_LIMIT_LOGIN_PER_IP = os.getenv('RATE_LIMIT_LOGIN_PER_IP', '30/minute')
+    RATE_LIMIT_LOGIN_PER_USER = os.getenv('RATE_LIMIT_LOGIN_PER_USER', '10/minute')
+    RATE_LIMIT_REGISTER_PER_IP = os.getenv('RATE_LIMIT_REGISTER_PER_IP', '20/hour')
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted
+    PROXY_COUNT = int(os.getenv('PROXY_COUNT', '0'))
     
     # Password limits
     MAX_PASSWORD_ENTRIES = 1000
+    # Attachments: "local" files under ATTACHMENT_DIR, or "gridfs" on MONGODB_URI
+    ATTACHMENT_STORE = os.getenv('ATTACHMENT_STORE', 'local').lower()
+    ATTACHMENT_DIR = os.getenv('ATTACHMENT_DIR', 'attachments')
+    ATTACHMENT_CHUNK_BYTES = int(os.getenv('ATTACHMENT_CHUNK_BYTES', str(64 * 1024)))
+    MAX_ATTACHMENT_BYTES = int(os.getenv('MAX_ATTACHMENT_BYTES', str(10 * 1024 * 1024)))
+    ATTACHMENT_QUOTA_BYTES = int(os.getenv('ATTACHMENT_QUOTA_BYTES', str(100 * 1024 * 1024)))
+    
+    # Typeahead: per-user indexes kept in an LRU, rebuilt after the TTL
+    TYPEAHEAD_MAX_USERS = int(os.getenv('TYPEAHEAD_MAX_USERS', '1000'))
+    TYPEAHEAD_TTL_SECONDS = float(os.getenv('TYPEAHEAD_TTL_SECONDS', '60'))
+    
+    # Master password rotation: staged re-encrypted entries expire after the TTL
+    ROTATION_TTL_SECONDS = float(os.getenv('ROTATION_TTL_SECONDS', '3600'))
+    ROTATION_CHUNK_MAX_ENTRIES = int(os.getenv('ROTATION_CHUNK_MAX_ENTRIES', '200'))
+    ROTATION_PURGE_SECONDS = float(os.getenv('ROTATION_PURGE_SECONDS', '300'))
+    
+    # Password history: versions kept per entry, trimmed by a background job
+    PASSWORD_HISTORY_LIMIT = int(os.getenv('PASSWORD_HISTORY_LIMIT', '20'))
+    PASSWORD_HISTORY_PRUNE_SECONDS = float(os.getenv('PASSWORD_HISTORY_PRUNE_SECONDS', '600'))
+    PASSWORD_HISTORY_PRUNE_BATCH = int(os.getenv('PASSWORD_HISTORY_PRUNE_BATCH', '500'))
+    
+    # Security audit log: buffered in memory, written in bulk by a background task
+    AUDIT_ENABLED = os.getenv('AUDIT_ENABLED', 'true').lower() == 'true'
+    AUDIT_TOKEN_USE = os.getenv('AUDIT_TOKEN_USE', 'true').lower() == 'true'
+    AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', '10000'))
+    AUDIT_BACKPRESSURE = os.getenv('AUDIT_BACKPRESSURE', 'drop_oldest').lower()  # or "block"
+    AUDIT_BLOCK_TIMEOUT_MS = float(os.getenv('AUDIT_BLOCK_TIMEOUT_MS', '100'))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', '500'))
+    AUDIT_FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', '1'))
+    AUDIT_MAX_ATTEMPTS = int(os.getenv('AUDIT_MAX_ATTEMPTS', '5'))  # inserts of one batch before dropping it
+    AUDIT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', '90'))
+    
+    # Reject master passwords found in this breach index (manage.py build-breach-index); empty disables
+    BREACHED_PASSWORDS_PATH = os.getenv('BREACHED_PASSWORDS_PATH', '')
+    
+    # Vault health report flags entries not updated for this long
+    PASSWORD_STALE_DAYS = int(os.getenv('PASSWORD_STALE_DAYS', '365'))
+    
+    # Username/email existence filter
+    USER_FILTER_CAPACITY = int(os.getenv('USER_FILTER_CAPACITY', '100000'))
+    USER_FILTER_ERROR_RATE = float(os.getenv('USER_FILTER_ERROR_RATE', '0.01'))
+    USER_FILTER_SYNC_SECONDS = float(os.getenv('USER_FILTER_SYNC_SECONDS', '30'))
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    SCHEMA_AUTO_MIGRATE = os.getenv('SCHEMA_AUTO_MIGRATE', 'true').lower() == 'true'
+
+class TestingConfig(Config):
+    """Test suite configuration (point POSTGRES_URI/MONGODB_URI at a throwaway database)"""
+    TESTING = True
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    SCHEMA_AUTO_MIGRATE = True
+    # Every test client connects from 127.0.0.1; the limiter test turns it back on
+    RATE_LIMIT_ENABLED = False
+    BREACHED_PASSWORDS_PATH = ''
 
 class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
+    SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'false').lower() == 'true'
 
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
+    'testing': TestingConfig,
     'default': DevelopmentConfig
 }
 
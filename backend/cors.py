@@ -0,0 +1,101 @@
+"""
+CORS handling with a compiled origin allowlist
+
+Preflight (OPTIONS) requests are answered by WSGI middleware before Flask
+routes the request or runs auth, and carry Access-Control-Max-Age so the
+browser caches them instead of preflighting every API call.
+"""
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+from flask import request
+
+
+class CorsPolicy:
+    """
+    Origin allowlist compiled for O(1) matching.
+
+    Entries are exact origins ("https://vault.example.com",
+    "chrome-extension://<extension id>"), a scheme wildcard such as
+    "chrome-extension://*", or "*" to allow any origin.
+    """
+
+    def __init__(self, origins: Iterable[str], max_age: int = 86400,
+                 allow_headers: Iterable[str] = ('Content-Type', 'Authorization'),
+                 methods: Iterable[str] = ('GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'),
+                 expose_headers: Iterable[str] = ()):
+        self.allow_all = False
+        self.exact = set()
+        self.any_of_scheme = set()
+        for origin in origins:
+            origin = origin.strip().rstrip('/').lower()
+            if not origin:
+                continue
+            if origin == '*':
+                self.allow_all = True
+            elif origin.endswith('://*'):
+                self.any_of_scheme.add(origin[:-4])
+            else:
+                self.exact.add(origin)
+
+        allow_headers = ', '.join(allow_headers)
+        self._preflight = {
+            'Access-Control-Allow-Methods': ', '.join(methods),
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Allow-Credentials': 'true',
+            'Access-Control-Max-Age': str(max_age),
+            'Vary': 'Origin',
+        }
+        self._actual = {
+            'Access-Control-Allow-Credentials': 'true',
+        }
+        if expose_headers:
+            self._actual['Access-Control-Expose-Headers'] = ', '.join(expose_headers)
+
+    def allows(self, origin: Optional[str]) -> bool:
+        if not origin:
+            return False
+        if self.allow_all:
+            return True
+        origin = origin.lower()
+        return origin in self.exact or urlsplit(origin).scheme in self.any_of_scheme
+
+    def preflight_headers(self, origin: str) -> Dict[str, str]:
+        """Headers for an allowed preflight response"""
+        return {'Access-Control-Allow-Origin': origin, **self._preflight}
+
+    def response_headers(self, origin: str) -> Dict[str, str]:
+        """Headers for an allowed actual (non-preflight) response"""
+        return {'Access-Control-Allow-Origin': origin, **self._actual}
+
+
+class CorsMiddleware:
+    """WSGI middleware answering preflights without entering the Flask app"""
+
+    def __init__(self, wsgi_app, policy: CorsPolicy):
+        self.wsgi_app = wsgi_app
+        self.policy = policy
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] == 'OPTIONS' and 'HTTP_ACCESS_CONTROL_REQUEST_METHOD' in environ:
+            origin = environ.get('HTTP_ORIGIN')
+            if not self.policy.allows(origin):
+                start_response('403 Forbidden', [('Content-Length', '0'), ('Vary', 'Origin')])
+                return [b'']
+            headers = list(self.policy.preflight_headers(origin).items())
+            start_response('204 No Content', headers + [('Content-Length', '0')])
+            return [b'']
+        return self.wsgi_app(environ, start_response)
+
+
+def init_app(app, policy: CorsPolicy):
+    """Answer preflights in front of the app and decorate allowed responses"""
+    app.wsgi_app = CorsMiddleware(app.wsgi_app, policy)
+
+    @app.after_request
+    def add_cors_headers(response):
+        origin = request.headers.get('Origin')
+        response.vary.add('Origin')
+        if policy.allows(origin):
+            response.headers.update(policy.response_headers(origin))
+        return response
@@ -17,9 +17,10 @@ def generate_session_id():
     """Generate unique session ID"""
     return secrets.token_hex(32)
 
-def validate_password_strength(password):
+def validate_password_strength(password, breached=None):
     """
-    Validate password strength
+    Validate password strength, and if a BreachedPasswordFilter is given,
+    reject passwords found in its breach corpus
     Returns: (is_valid, message)
     """
     if len(password) < 8:
@@ -33,8 +34,15 @@ def validate_password_strength(password):
     if not (has_upper and has_lower and has_digit):
         return False, "Password must contain uppercase, lowercase, and digits"
     
+    if breached is not None and breached.is_breached(password):
+        return False, "This password has appeared in a data breach; choose another"
+    
     return True, "Password is strong"
 
+def is_valid_fingerprint(value):
+    """A password fingerprint is a hex-encoded HMAC-SHA256 computed by the client"""
+    return isinstance(value, str) and len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
 def sanitize_input(input_string, max_length=500):
     """Sanitize user input to prevent injection attacks"""
     if not input_string:
@@ -47,3 +55,13 @@ def sanitize_input(input_string, max_length=500):
     sanitized = sanitized[:max_length]
     
     return sanitized.strip()
+
+MAX_TAGS = 20
+
+def normalize_tags(tags):
+    """Sanitized, lowercased, de-duplicated tag list; raises ValueError for anything but a list of strings"""
+    if tags is None:
+        return []
+    if not isinstance(tags, list) or len(tags) > MAX_TAGS or not all(isinstance(t, str) for t in tags):
+        raise ValueError(f"Tags must be a list of at most {MAX_TAGS} strings")
+    return sorted({tag for tag in (sanitize_input(t, max_length=50).lower() for t in tags) if tag})
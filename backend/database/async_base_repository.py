@@ -0,0 +1,143 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+
+from database.base_repository import SCHEMA_VERSION, SchemaVersionError
+
+class AsyncBaseRepository(ABC):
+    """Abstract base class for asyncio database repositories, mirroring BaseRepository"""
+    
+    @abstractmethod
+    async def initialize(self):
+        """Initialize database connection"""
+        pass
+    
+    @abstractmethod
+    async def close(self):
+        """Close database connection"""
+        pass
+    
+    @abstractmethod
+    async def migrate(self):
+        """Create tables/collections and indexes and record SCHEMA_VERSION"""
+        pass
+    
+    @abstractmethod
+    async def get_schema_version(self) -> int:
+        """Return the recorded schema version (0 if never migrated)"""
+        pass
+    
+    async def verify_schema(self):
+        """Fast startup check that migrations have been applied"""
+        found = await self.get_schema_version()
+        if found < SCHEMA_VERSION:
+            raise SchemaVersionError(found, SCHEMA_VERSION)
+    
+    # User operations
+    @abstractmethod
+    async def create_user(self, username: str, email: str, password_hash: str, salt: str,
+                    user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Create a new user, raising DuplicateUserError on a unique violation"""
+        pass
+    
+    @abstractmethod
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get user by username"""
+        pass
+    
+    @abstractmethod
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Get user by email"""
+        pass
+    
+    @abstractmethod
+    async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get user by ID"""
+        pass
+    
+    @abstractmethod
+    def iter_user_identities(self, batch_size: int = 1000,
+                             since: Optional[datetime] = None) -> AsyncIterator[Tuple[str, str]]:
+        """Stream (username, email) pairs for all users, or those created at or after since"""
+        pass
+    
+    @abstractmethod
+    def iter_users(self, batch_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """Stream all users"""
+        pass
+    
+    @abstractmethod
+    async def delete_user(self, user_id: str) -> bool:
+        """Delete a user and all of their password entries"""
+        pass
+    
+    # Password operations
+    @abstractmethod
+    async def create_password(self, user_id: str, website_url: str, website_name: str, 
+                       username: str, encrypted_password: str, iv: str, notes: str = '',
+                       fingerprint: Optional[str] = None, folder: Optional[str] = None,
+                       tags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Create a new password entry, keeping its folder's counter and tags in step"""
+        pass
+    
+    @abstractmethod
+    async def get_passwords(self, user_id: str) -> List[Dict[str, Any]]:
+        """Get all passwords for a user"""
+        pass
+    
+    @abstractmethod
+    async def get_password_by_id(self, password_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a specific password entry"""
+        pass
+    
+    @abstractmethod
+    async def update_password(self, password_id: str, user_id: str, data: Dict[str, Any]) -> bool:
+        """Update a password entry"""
+        pass
+    
+    @abstractmethod
+    async def delete_password(self, password_id: str, user_id: str) -> bool:
+        """Delete a password entry"""
+        pass
+    
+    @abstractmethod
+    async def search_passwords(self, user_id: str, query: str) -> List[Dict[str, Any]]:
+        """Search passwords by URL"""
+        pass
+    
+    @abstractmethod
+    async def get_password_count(self, user_id: str) -> int:
+        """Get count of password entries for a user"""
+        pass
+    
+    @abstractmethod
+    async def import_passwords(self, entries: List[Dict[str, Any]]) -> int:
+        """Upsert password entries as returned by get_passwords, preserving ids and timestamps"""
+        pass
+    
+    # Attachments (uploaded through the Flask app; removed here with their entry)
+    @abstractmethod
+    async def get_attachments(self, password_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """Attachments of a password entry"""
+        pass
+    
+    @abstractmethod
+    async def delete_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Delete an attachment and subtract its size from the user's total"""
+        pass
+    
+    @abstractmethod
+    async def count_blob_references(self, blob_id: str) -> int:
+        """Number of attachments pointing at a blob"""
+        pass
+    
+    # Token revocations (written by the Flask app's logout routes)
+    @abstractmethod
+    async def get_token_revocations(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Unexpired revocations, optionally only those recorded after since"""
+        pass
+    
+    @abstractmethod
+    async def purge_token_revocations(self, now: datetime) -> int:
+        """Delete revocations whose tokens have expired"""
+        pass
@@ -0,0 +1,315 @@
+import logging
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+from datetime import datetime
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError, ConnectionFailure, OperationFailure
+
+from database.async_base_repository import AsyncBaseRepository
+from database.base_repository import DuplicateUserError, HISTORY_FIELDS
+from database.migrations import pending_migrations, indexes_for, mongo_index_spec
+from database.mongodb_repository import MongoRepository
+
+logger = logging.getLogger(__name__)
+
+class AsyncMongoRepository(AsyncBaseRepository):
+    """MongoDB implementation of the async repository (Motor)"""
+
+    # Document conversion is shared with the synchronous repository
+    _extract_database_name = MongoRepository._extract_database_name
+    _format_user = MongoRepository._format_user
+    _format_password = MongoRepository._format_password
+    _password_document = MongoRepository._password_document
+    _format_attachment = MongoRepository._format_attachment
+
+    def __init__(self, database_uri: str):
+        self.database_uri = database_uri
+        self.client = None
+        self.db = None
+        self.users = None
+        self.passwords = None
+
+    async def initialize(self):
+        """Initialize MongoDB connection"""
+        try:
+            self.client = AsyncIOMotorClient(
+                self.database_uri,
+                maxPoolSize=200,
+                minPoolSize=10,
+                connectTimeoutMS=10000,
+                socketTimeoutMS=45000,
+                serverSelectionTimeoutMS=10000,
+                retryWrites=True
+            )
+
+            self.db = self.client[self._extract_database_name(self.database_uri)]
+            self.users = self.db.users
+            self.passwords = self.db.password_entries
+
+            logger.info(f"MongoDB database initialized: {self.db.name}")
+
+        except ConnectionFailure as e:
+            logger.error("Failed to connect to MongoDB: %s", e)
+            raise
+
+    async def close(self):
+        """Close MongoDB connection"""
+        if self.client:
+            self.client.close()
+            logger.info("MongoDB connection closed")
+
+    async def migrate(self, batch_size: int = 1000):
+        """Apply pending migrations in version order"""
+        for migration in pending_migrations(await self.get_schema_version()):
+            for spec in indexes_for(migration, 'mongodb'):
+                keys, options = mongo_index_spec(spec)
+                try:
+                    await self.db[spec.table].create_index(keys, **options)
+                except OperationFailure as e:
+                    # 85: the same keys are already indexed under another name
+                    if e.code != 85:
+                        raise
+
+            for backfill in migration.backfills:
+                if backfill.collection:
+                    collection = self.db[backfill.collection]
+                    while True:
+                        cursor = collection.find(backfill.mongo_filter, {'_id': 1}).limit(batch_size)
+                        ids = [doc['_id'] async for doc in cursor]
+                        if not ids:
+                            break
+                        await collection.update_many({'_id': {'$in': ids}}, backfill.mongo_update)
+
+            await self.db.schema_version.update_one(
+                {'_id': 'schema'},
+                {'$max': {'version': migration.version}, '$set': {'applied_at': datetime.utcnow()}},
+                upsert=True
+            )
+            logger.info(f"MongoDB migration {migration.version}: {migration.description}")
+
+    async def get_schema_version(self) -> int:
+        """Return the recorded schema version (0 if never migrated)"""
+        doc = await self.db.schema_version.find_one({'_id': 'schema'})
+        return doc['version'] if doc else 0
+
+    async def create_user(self, username: str, email: str, password_hash: str, salt: str,
+                          user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Create a new user"""
+        user_doc = {
+            '_id': user_id or str(uuid.uuid4()),
+            'username': username,
+            'email': email,
+            'master_password_hash': password_hash,
+            'salt': salt,
+            'created_at': datetime.utcnow(),
+            'updated_at': datetime.utcnow()
+        }
+
+        try:
+            await self.users.insert_one(user_doc)
+            return self._format_user(user_doc)
+        except DuplicateKeyError as e:
+            key_pattern = (e.details or {}).get('keyPattern', {})
+            raise DuplicateUserError('email' if 'email' in key_pattern else 'username')
+
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get user by username"""
+        return self._format_user(await self.users.find_one({'username': username}))
+
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Get user by email"""
+        return self._format_user(await self.users.find_one({'email': email}))
+
+    async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get user by ID"""
+        return self._format_user(await self.users.find_one({'_id': user_id}))
+
+    async def iter_user_identities(self, batch_size: int = 1000,
+                                   since: Optional[datetime] = None) -> AsyncIterator[Tuple[str, str]]:
+        """Stream (username, email) pairs for all users, or those created at or after since"""
+        spec = {'created_at': {'$gte': since}} if since is not None else {}
+        cursor = self.users.find(spec, {'username': 1, 'email': 1, '_id': 0}).batch_size(batch_size)
+        async for user in cursor:
+            yield user['username'], user['email']
+
+    async def iter_users(self, batch_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """Stream all users"""
+        async for user in self.users.find({}).sort('_id', ASCENDING).batch_size(batch_size):
+            yield self._format_user(user)
+
+    async def delete_user(self, user_id: str) -> bool:
+        """Delete a user and all of their password entries"""
+        await self.db.attachments.delete_many({'user_id': user_id})
+        await self.db.folder_counts.delete_many({'user_id': user_id})
+        rotation_ids = [doc['_id'] async for doc in self.db.vault_rotations.find({'user_id': user_id}, {'_id': 1})]
+        if rotation_ids:
+            await self.db.vault_rotation_entries.delete_many({'rotation_id': {'$in': rotation_ids}})
+            await self.db.vault_rotations.delete_many({'_id': {'$in': rotation_ids}})
+        await self.db.password_history.delete_many({'user_id': user_id})
+        await self.passwords.delete_many({'user_id': user_id})
+        result = await self.users.delete_one({'_id': user_id})
+        return result.deleted_count > 0
+
+    async def _bump_folder(self, user_id: str, folder: Optional[str], delta: int):
+        if folder:
+            await self.db.folder_counts.update_one({'user_id': user_id, 'folder': folder},
+                                                   {'$inc': {'entries': delta}}, upsert=True)
+
+    async def _recount_folders(self, user_ids):
+        """Rebuild folder counters from the entries, after bulk writes"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        counts = self.passwords.aggregate([
+            {'$match': {'user_id': {'$in': user_ids}, 'folder': {'$nin': [None, '']}}},
+            {'$group': {'_id': {'user_id': '$user_id', 'folder': '$folder'}, 'entries': {'$sum': 1}}}
+        ])
+        documents = [{'user_id': c['_id']['user_id'], 'folder': c['_id']['folder'], 'entries': c['entries']}
+                     async for c in counts]
+        await self.db.folder_counts.delete_many({'user_id': {'$in': user_ids}})
+        if documents:
+            await self.db.folder_counts.insert_many(documents)
+
+    async def create_password(self, user_id: str, website_url: str, website_name: str,
+                              username: str, encrypted_password: str, iv: str, notes: str = '',
+                              fingerprint: Optional[str] = None, folder: Optional[str] = None,
+                              tags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Create a new password entry"""
+        password_doc = {
+            '_id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'website_url': website_url,
+            'website_name': website_name,
+            'username': username,
+            'encrypted_password': encrypted_password,
+            'iv': iv,
+            'notes': notes,
+            'fingerprint': fingerprint,
+            'folder': folder,
+            'tags': sorted(set(tags or [])),
+            'created_at': datetime.utcnow(),
+            'updated_at': datetime.utcnow(),
+            'last_used': None
+        }
+
+        await self.passwords.insert_one(password_doc)
+        await self._bump_folder(user_id, folder, 1)
+        return self._format_password(password_doc)
+
+    async def get_passwords(self, user_id: str) -> List[Dict[str, Any]]:
+        """Get all passwords for a user"""
+        return [self._format_password(pwd) async for pwd in self.passwords.find({'user_id': user_id})]
+
+    async def get_password_by_id(self, password_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a specific password entry"""
+        password = await self.passwords.find_one_and_update(
+            {'_id': password_id, 'user_id': user_id},
+            {'$set': {'last_used': datetime.utcnow()}},
+            return_document=True
+        )
+        return self._format_password(password) if password else None
+
+    async def update_password(self, password_id: str, user_id: str, data: Dict[str, Any]) -> bool:
+        """Update a password entry, archiving changed encrypted fields to its history"""
+        data['updated_at'] = datetime.utcnow()
+        if 'tags' in data:
+            data['tags'] = sorted(set(data['tags'] or []))
+        update = {'$set': data}
+        archive = any(field in data for field in HISTORY_FIELDS)
+        if archive:
+            # The entry keeps its history counter, so the update hands out version numbers atomically
+            update['$inc'] = {'history_version': 1}
+        previous = await self.passwords.find_one_and_update(
+            {'_id': password_id, 'user_id': user_id},
+            update,
+            projection={'folder': 1, 'history_version': 1, **dict.fromkeys(HISTORY_FIELDS, 1)}
+        )
+        if previous is None:
+            return False
+
+        if archive and any(field in data and data[field] != previous.get(field) for field in HISTORY_FIELDS):
+            version = previous.get('history_version', 0) + 1
+            await self.db.password_history.insert_one({
+                '_id': f"{password_id}:{version}",
+                'user_id': user_id,
+                'password_id': password_id,
+                'version': version,
+                **{field: previous.get(field) for field in HISTORY_FIELDS},
+                'replaced_at': data['updated_at']
+            })
+
+        if 'folder' in data and data['folder'] != previous.get('folder'):
+            await self._bump_folder(user_id, previous.get('folder'), -1)
+            await self._bump_folder(user_id, data['folder'], 1)
+        return True
+
+    async def delete_password(self, password_id: str, user_id: str) -> bool:
+        """Delete a password entry and its history"""
+        deleted = await self.passwords.find_one_and_delete({'_id': password_id, 'user_id': user_id},
+                                                           projection={'folder': 1})
+        if deleted is None:
+            return False
+        await self._bump_folder(user_id, deleted.get('folder'), -1)
+        await self.db.password_history.delete_many({'user_id': user_id, 'password_id': password_id})
+        return True
+
+    async def search_passwords(self, user_id: str, query: str) -> List[Dict[str, Any]]:
+        """Search passwords by URL"""
+        cursor = self.passwords.find({
+            'user_id': user_id,
+            'website_url': {'$regex': query, '$options': 'i'}
+        })
+        return [self._format_password(pwd) async for pwd in cursor]
+
+    async def get_password_count(self, user_id: str) -> int:
+        """Get count of password entries for a user"""
+        return await self.passwords.count_documents({'user_id': user_id})
+
+    async def get_attachments(self, password_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """Attachments of a password entry"""
+        cursor = self.db.attachments.find({'user_id': user_id, 'password_id': password_id}).sort('created_at', ASCENDING)
+        return [self._format_attachment(doc) async for doc in cursor]
+
+    async def delete_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Delete an attachment and subtract its size from the user's total"""
+        doc = await self.db.attachments.find_one_and_delete({'_id': attachment_id, 'user_id': user_id})
+        if not doc:
+            return None
+        await self.users.update_one({'_id': user_id}, {'$inc': {'storage_bytes': -doc['size']}})
+        return self._format_attachment(doc)
+
+    async def count_blob_references(self, blob_id: str) -> int:
+        """Number of attachments pointing at a blob"""
+        return await self.db.attachments.count_documents({'blob_id': blob_id})
+
+    async def import_passwords(self, entries: List[Dict[str, Any]]) -> int:
+        """Upsert password entries as returned by get_passwords, preserving ids and timestamps"""
+        if not entries:
+            return 0
+        # $set rather than a replacement keeps each entry's history counter
+        operations = []
+        for entry in entries:
+            document = self._password_document(entry)
+            operations.append(UpdateOne({'_id': document.pop('_id')}, {'$set': document}, upsert=True))
+        await self.passwords.bulk_write(operations, ordered=False)
+        await self._recount_folders({entry['user_id'] for entry in entries})
+        return len(operations)
+
+    async def get_token_revocations(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Unexpired revocations, optionally only those recorded after since"""
+        spec = {'expires_at': {'$gt': datetime.utcnow()}}
+        if since is not None:
+            spec['revoked_at'] = {'$gt': since}
+        return [{
+            'key': doc['_id'],
+            'user_id': doc['user_id'],
+            'revoked_at': doc['revoked_at'].isoformat(),
+            'expires_at': doc['expires_at'].isoformat()
+        } async for doc in self.db.token_revocations.find(spec)]
+
+    async def purge_token_revocations(self, now: datetime) -> int:
+        """Delete revocations whose tokens have expired"""
+        result = await self.db.token_revocations.delete_many({'expires_at': {'$lte': now}})
+        return result.deleted_count
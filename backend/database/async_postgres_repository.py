@@ -0,0 +1,381 @@
+import logging
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+from datetime import datetime
+import uuid
+
+from sqlalchemy import select, delete, update, func, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError, ProgrammingError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.async_base_repository import AsyncBaseRepository
+from database.base_repository import DuplicateUserError, HISTORY_FIELDS, parse_timestamp
+from database.migrations import pending_migrations, indexes_for, postgres_index_ddl
+from database.postgres_repository import _ARCHIVE_VERSION, _duplicate_field
+from models.postgres_models import (Base, User, PasswordEntry, SchemaVersion, TokenRevocation, PasswordTag,
+                                    FolderCount, Attachment, VaultRotation, PasswordHistory)
+
+logger = logging.getLogger(__name__)
+
+class AsyncPostgresRepository(AsyncBaseRepository):
+    """PostgreSQL implementation of the async repository (SQLAlchemy asyncio + asyncpg)"""
+
+    def __init__(self, database_uri: str):
+        self.database_uri = self._async_uri(database_uri)
+        self.engine = None
+        self.Session = None
+
+    @staticmethod
+    def _async_uri(uri: str) -> str:
+        """Switch a postgresql:// URI to the asyncpg driver"""
+        for prefix in ('postgresql+psycopg2://', 'postgresql://', 'postgres://'):
+            if uri.startswith(prefix):
+                return 'postgresql+asyncpg://' + uri[len(prefix):]
+        return uri
+
+    async def initialize(self):
+        """Initialize PostgreSQL connection"""
+        self.engine = create_async_engine(self.database_uri, pool_pre_ping=True, pool_size=20, max_overflow=20)
+        self.Session = async_sessionmaker(self.engine, expire_on_commit=False)
+        logger.info("PostgreSQL (asyncpg) database initialized")
+
+    async def close(self):
+        """Close PostgreSQL connection"""
+        if self.engine:
+            await self.engine.dispose()
+
+    async def migrate(self, batch_size: int = 1000):
+        """Apply pending migrations in version order"""
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        for migration in pending_migrations(await self.get_schema_version()):
+            async with self.engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+                for sql in migration.postgres_sql:
+                    await conn.execute(text(sql))
+                for spec in indexes_for(migration, 'postgresql'):
+                    await conn.execute(text(postgres_index_ddl(spec)))
+
+            for backfill in migration.backfills:
+                if backfill.postgres_sql:
+                    while True:
+                        async with self.engine.begin() as conn:
+                            result = await conn.execute(text(backfill.postgres_sql), {'batch_size': batch_size})
+                        if not result.rowcount:
+                            break
+
+            async with self.Session() as session:
+                session.add(SchemaVersion(version=migration.version))
+                await session.commit()
+            logger.info(f"PostgreSQL migration {migration.version}: {migration.description}")
+
+    async def get_schema_version(self) -> int:
+        """Return the recorded schema version (0 if never migrated)"""
+        async with self.Session() as session:
+            try:
+                return await session.scalar(select(func.max(SchemaVersion.version))) or 0
+            except ProgrammingError:
+                return 0
+
+    async def create_user(self, username: str, email: str, password_hash: str, salt: str,
+                          user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Create a new user"""
+        user = User(
+            id=user_id or str(uuid.uuid4()),
+            username=username,
+            email=email,
+            master_password_hash=password_hash,
+            salt=salt
+        )
+        async with self.Session() as session:
+            session.add(user)
+            try:
+                await session.commit()
+            except IntegrityError as e:
+                await session.rollback()
+                # The asyncpg error carrying constraint_name is the adapted exception's cause
+                raise DuplicateUserError(_duplicate_field(getattr(e.orig.__cause__, 'constraint_name', None)))
+            return user.to_dict()
+
+    async def _get_user(self, **criteria) -> Optional[Dict[str, Any]]:
+        async with self.Session() as session:
+            user = (await session.execute(select(User).filter_by(**criteria).limit(1))).scalar_one_or_none()
+            return user.to_dict() if user else None
+
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get user by username"""
+        return await self._get_user(username=username)
+
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Get user by email"""
+        return await self._get_user(email=email)
+
+    async def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get user by ID"""
+        return await self._get_user(id=user_id)
+
+    async def iter_user_identities(self, batch_size: int = 1000,
+                                   since: Optional[datetime] = None) -> AsyncIterator[Tuple[str, str]]:
+        """Stream (username, email) pairs for all users, or those created at or after since"""
+        query = select(User.username, User.email)
+        if since is not None:
+            query = query.where(User.created_at >= since)
+        async with self.Session() as session:
+            result = await session.stream(query.execution_options(yield_per=batch_size))
+            async for username, email in result:
+                yield username, email
+
+    async def iter_users(self, batch_size: int = 1000) -> AsyncIterator[Dict[str, Any]]:
+        """Stream all users"""
+        async with self.Session() as session:
+            result = await session.stream_scalars(
+                select(User).order_by(User.id).execution_options(yield_per=batch_size)
+            )
+            async for user in result:
+                yield user.to_dict()
+
+    async def delete_user(self, user_id: str) -> bool:
+        """Delete a user and all of their password entries"""
+        async with self.Session() as session:
+            for model in (Attachment, PasswordTag, FolderCount, VaultRotation, PasswordHistory, PasswordEntry):
+                await session.execute(delete(model).where(model.user_id == user_id))
+            result = await session.execute(delete(User).where(User.id == user_id))
+            await session.commit()
+            return result.rowcount > 0
+
+    @staticmethod
+    async def _with_tags(session, entries: List[Dict[str, Any]], *condition) -> List[Dict[str, Any]]:
+        """Add each entry's sorted tag list, fetched with one query over password_tags"""
+        tags: Dict[str, List[str]] = {}
+        if entries:
+            rows = await session.execute(select(PasswordTag.password_id, PasswordTag.tag)
+                                         .where(*condition).order_by(PasswordTag.tag))
+            for password_id, tag in rows:
+                tags.setdefault(password_id, []).append(tag)
+        for entry in entries:
+            entry['tags'] = tags.get(entry['id'], [])
+        return entries
+
+    @staticmethod
+    async def _set_tags(session, user_id: str, password_id: str, tags: List[str]) -> List[str]:
+        """Replace an entry's tag rows (within the session's transaction)"""
+        tags = sorted(set(tags))
+        await session.execute(delete(PasswordTag).where(PasswordTag.password_id == password_id))
+        session.add_all(PasswordTag(password_id=password_id, tag=tag, user_id=user_id) for tag in tags)
+        return tags
+
+    @staticmethod
+    async def _bump_folder(session, user_id: str, folder: Optional[str], delta: int):
+        """Adjust a folder's entry counter (within the session's transaction)"""
+        if not folder:
+            return
+        stmt = insert(FolderCount.__table__).values(user_id=user_id, folder=folder, entries=delta)
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id', 'folder'],
+            set_={'entries': FolderCount.entries + delta}
+        ))
+
+    @staticmethod
+    async def _recount_folders(session, user_ids: List[str]):
+        """Rebuild folder counters from the entries, after bulk writes"""
+        await session.execute(delete(FolderCount).where(FolderCount.user_id.in_(user_ids)))
+        counts = select(PasswordEntry.user_id, PasswordEntry.folder, func.count()).where(
+            PasswordEntry.user_id.in_(user_ids), PasswordEntry.folder.isnot(None)
+        ).group_by(PasswordEntry.user_id, PasswordEntry.folder)
+        await session.execute(insert(FolderCount.__table__).from_select(['user_id', 'folder', 'entries'], counts))
+
+    async def create_password(self, user_id: str, website_url: str, website_name: str,
+                              username: str, encrypted_password: str, iv: str, notes: str = '',
+                              fingerprint: Optional[str] = None, folder: Optional[str] = None,
+                              tags: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Create a new password entry"""
+        password_entry = PasswordEntry(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            website_url=website_url,
+            website_name=website_name,
+            username=username,
+            encrypted_password=encrypted_password,
+            iv=iv,
+            notes=notes,
+            fingerprint=fingerprint,
+            folder=folder
+        )
+        async with self.Session() as session:
+            session.add(password_entry)
+            await session.flush()
+            tags = await self._set_tags(session, user_id, password_entry.id, tags or [])
+            await self._bump_folder(session, user_id, folder, 1)
+            await session.commit()
+            return {**password_entry.to_dict(), 'tags': tags}
+
+    async def get_passwords(self, user_id: str) -> List[Dict[str, Any]]:
+        """Get all passwords for a user"""
+        async with self.Session() as session:
+            result = await session.scalars(select(PasswordEntry).filter_by(user_id=user_id))
+            return await self._with_tags(session, [pwd.to_dict() for pwd in result], PasswordTag.user_id == user_id)
+
+    async def get_password_by_id(self, password_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a specific password entry"""
+        async with self.Session() as session:
+            password = (await session.execute(
+                select(PasswordEntry).filter_by(id=password_id, user_id=user_id)
+            )).scalar_one_or_none()
+
+            if password:
+                # updated_at set to itself, so its onupdate default does not count a read as an edit
+                entries = PasswordEntry.__table__
+                await session.execute(
+                    entries.update()
+                    .where(entries.c.id == password_id, entries.c.user_id == user_id)
+                    .values(last_used=datetime.utcnow(), updated_at=entries.c.updated_at)
+                )
+                await session.commit()
+                await session.refresh(password)
+                return (await self._with_tags(session, [password.to_dict()],
+                                              PasswordTag.password_id == password_id))[0]
+            return None
+
+    async def update_password(self, password_id: str, user_id: str, data: Dict[str, Any]) -> bool:
+        """Update a password entry, archiving changed encrypted fields to its history"""
+        async with self.Session() as session:
+            # The row lock serializes updates, so each archived version number is taken once
+            password = (await session.execute(
+                select(PasswordEntry).filter_by(id=password_id, user_id=user_id).with_for_update()
+            )).scalar_one_or_none()
+
+            if not password:
+                return False
+
+            previous = {field: getattr(password, field) for field in HISTORY_FIELDS}
+            if any(field in data and data[field] != previous[field] for field in HISTORY_FIELDS):
+                await session.execute(_ARCHIVE_VERSION, {'user_id': user_id, 'password_id': password_id,
+                                                         'replaced_at': datetime.utcnow(), **previous})
+
+            previous_folder = password.folder
+            for key, value in data.items():
+                if key != 'tags' and hasattr(password, key):
+                    setattr(password, key, value)
+
+            if password.folder != previous_folder:
+                await self._bump_folder(session, user_id, previous_folder, -1)
+                await self._bump_folder(session, user_id, password.folder, 1)
+            if 'tags' in data:
+                await self._set_tags(session, user_id, password_id, data['tags'] or [])
+            password.updated_at = datetime.utcnow()
+            await session.commit()
+            return True
+
+    async def delete_password(self, password_id: str, user_id: str) -> bool:
+        """Delete a password entry (its tags and history go with it by ON DELETE CASCADE)"""
+        async with self.Session() as session:
+            folder = (await session.execute(
+                delete(PasswordEntry).where(PasswordEntry.id == password_id, PasswordEntry.user_id == user_id)
+                .returning(PasswordEntry.folder)
+            )).first()
+            if folder is None:
+                return False
+            await self._bump_folder(session, user_id, folder[0], -1)
+            await session.commit()
+            return True
+
+    async def search_passwords(self, user_id: str, query: str) -> List[Dict[str, Any]]:
+        """Search passwords by URL"""
+        async with self.Session() as session:
+            result = await session.scalars(select(PasswordEntry).where(
+                PasswordEntry.user_id == user_id,
+                PasswordEntry.website_url.ilike(f'%{query}%')
+            ))
+            entries = [pwd.to_dict() for pwd in result]
+            return await self._with_tags(session, entries, PasswordTag.user_id == user_id,
+                                         PasswordTag.password_id.in_([entry['id'] for entry in entries]))
+
+    async def get_password_count(self, user_id: str) -> int:
+        """Get count of password entries for a user"""
+        async with self.Session() as session:
+            return await session.scalar(
+                select(func.count()).select_from(PasswordEntry).where(PasswordEntry.user_id == user_id)
+            )
+
+    async def get_attachments(self, password_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """Attachments of a password entry"""
+        async with self.Session() as session:
+            result = await session.scalars(
+                select(Attachment).filter_by(user_id=user_id, password_id=password_id).order_by(Attachment.created_at)
+            )
+            return [row.to_dict() for row in result]
+
+    async def delete_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Delete an attachment and subtract its size from the user's total"""
+        async with self.Session() as session:
+            attachment = (await session.execute(
+                select(Attachment).filter_by(id=attachment_id, user_id=user_id)
+            )).scalar_one_or_none()
+            if not attachment:
+                return None
+
+            deleted = attachment.to_dict()
+            await session.delete(attachment)
+            await session.execute(
+                update(User).where(User.id == user_id).values(storage_bytes=User.storage_bytes - attachment.size)
+            )
+            await session.commit()
+            return deleted
+
+    async def count_blob_references(self, blob_id: str) -> int:
+        """Number of attachments pointing at a blob"""
+        async with self.Session() as session:
+            return await session.scalar(
+                select(func.count()).select_from(Attachment).where(Attachment.blob_id == blob_id)
+            )
+
+    async def import_passwords(self, entries: List[Dict[str, Any]]) -> int:
+        """Upsert password entries as returned by get_passwords, preserving ids and timestamps"""
+        if not entries:
+            return 0
+
+        rows = [{
+            'id': entry['id'],
+            'user_id': entry['user_id'],
+            'website_url': entry['website_url'],
+            'website_name': entry.get('website_name'),
+            'username': entry.get('username'),
+            'encrypted_password': entry['encrypted_password'],
+            'iv': entry.get('iv'),
+            'notes': entry.get('notes'),
+            'created_at': parse_timestamp(entry.get('created_at')),
+            'updated_at': parse_timestamp(entry.get('updated_at')),
+            'last_used': parse_timestamp(entry.get('last_used')),
+            'fingerprint': entry.get('fingerprint'),
+            'folder': entry.get('folder')
+        } for entry in entries]
+
+        stmt = insert(PasswordEntry.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={col: stmt.excluded[col] for col in rows[0] if col != 'id'}
+        )
+        async with self.Session() as session:
+            await session.execute(stmt)
+            for entry in entries:
+                if 'tags' in entry:
+                    await self._set_tags(session, entry['user_id'], entry['id'], entry['tags'] or [])
+            await self._recount_folders(session, sorted({row['user_id'] for row in rows}))
+            await session.commit()
+        return len(rows)
+
+    async def get_token_revocations(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Unexpired revocations, optionally only those recorded after since"""
+        query = select(TokenRevocation).where(TokenRevocation.expires_at > datetime.utcnow())
+        if since is not None:
+            query = query.where(TokenRevocation.revoked_at > since)
+        async with self.Session() as session:
+            return [row.to_dict() for row in await session.scalars(query)]
+
+    async def purge_token_revocations(self, now: datetime) -> int:
+        """Delete revocations whose tokens have expired"""
+        async with self.Session() as session:
+            result = await session.execute(delete(TokenRevocation).where(TokenRevocation.expires_at <= now))
+            await session.commit()
+            return result.rowcount
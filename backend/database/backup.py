@@ -0,0 +1,232 @@
+"""
+Online backup and restore of users, password entries, attachment metadata
+and password history
+
+A backup is a directory of gzip-compressed JSON-lines chunk files, one per
+user-id range, plus a manifest.json recording each chunk's row counts and
+SHA-256. Ranges are dumped by parallel workers that all read the same
+snapshot: the coordinating connection exports it (pg_export_snapshot on
+PostgreSQL, a cluster time on MongoDB) and every worker imports it, so the
+backup is consistent without locking writers out. Each line holds one batch
+of users with their entries, attachments and history, so memory use depends
+on the batch size only.
+
+Restore checks every chunk against the manifest, then loads chunks in
+parallel through bulk_load into either backend. Attachment blobs live in
+the blob store and are backed up separately.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict
+
+from database.transfer import TABLES, KeyRange, RepositoryFactory, batched, key_ranges
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+# Version 1 predates password history; its batches simply have none
+READABLE_FORMATS = (1, 2)
+MANIFEST = 'manifest.json'
+
+
+class BackupError(RuntimeError):
+    """Raised when a backup directory is incomplete or a chunk fails its checksum"""
+
+
+class Progress:
+    """Row and byte counters shared by workers, reported with throughput"""
+
+    def __init__(self, chunks: int):
+        self.chunks = chunks
+        self.counts = {'chunks_done': 0, 'bytes': 0, **dict.fromkeys(TABLES, 0)}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, **counts: int):
+        with self._lock:
+            for name, count in counts.items():
+                self.counts[name] += count
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            **counts,
+            'chunks': self.chunks,
+            'elapsed_seconds': round(elapsed, 1),
+            'users_per_second': round(counts['users'] / elapsed, 1),
+            'mb_per_second': round(counts['bytes'] / elapsed / 1e6, 2)
+        }
+
+    def log_every(self, interval: float, stop: threading.Event):
+        """Log progress until stop is set (run in a thread)"""
+        while not stop.wait(interval):
+            r = self.report()
+            logger.info("%d/%d chunks, %d users, %d entries (%s users/s, %s MB/s)",
+                        r['chunks_done'], r['chunks'], r['users'], r['password_entries'],
+                        r['users_per_second'], r['mb_per_second'])
+
+
+class _HashingWriter:
+    """File wrapper hashing and counting the (compressed) bytes written through it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def _chunk_name(index: int) -> str:
+    return f'chunk-{index:03d}.jsonl.gz'
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _run_parallel(workers: int, progress: Progress, report_interval: float, tasks):
+    stop = threading.Event()
+    reporter = threading.Thread(target=progress.log_every, args=(report_interval, stop), daemon=True)
+    reporter.start()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(task, *args) for task, *args in tasks]
+            return [future.result() for future in futures]
+    finally:
+        stop.set()
+
+
+def _dump_chunk(repo_factory: RepositoryFactory, token: str, output_dir: str, index: int,
+                key_range: KeyRange, batch_size: int, progress: Progress) -> Dict[str, Any]:
+    path = os.path.join(output_dir, _chunk_name(index))
+    counts = dict.fromkeys(TABLES, 0)
+    repo = repo_factory()
+    try:
+        repo.begin_snapshot(token)
+        with open(path + '.tmp', 'wb') as raw:
+            writer = _HashingWriter(raw)
+            with gzip.GzipFile(fileobj=writer, mode='wb') as out:
+                for users in batched(repo.iter_users(batch_size, *key_range), batch_size):
+                    user_ids = [user['id'] for user in users]
+                    batch = {'users': users, **repo.export_user_data(user_ids),
+                             'password_history': repo.export_password_history(user_ids)}
+                    out.write(json.dumps(batch, separators=(',', ':')).encode() + b'\n')
+                    batch_counts = {table: len(batch[table]) for table in TABLES}
+                    for table, count in batch_counts.items():
+                        counts[table] += count
+                    progress.add(**batch_counts)
+        os.replace(path + '.tmp', path)
+        repo.end_snapshot()
+    finally:
+        repo.close()
+    progress.add(chunks_done=1, bytes=writer.size)
+    return {'file': _chunk_name(index), 'range': list(key_range), 'bytes': writer.size,
+            'sha256': writer.sha256.hexdigest(), **counts}
+
+
+def backup(repo_factory: RepositoryFactory, output_dir: str, workers: int = 4, partitions: int = 16,
+           batch_size: int = 1000, report_interval: float = 10.0) -> Dict[str, Any]:
+    """Dump a consistent snapshot into output_dir; returns the final progress report"""
+    os.makedirs(output_dir, exist_ok=True)
+    if os.path.exists(os.path.join(output_dir, MANIFEST)):
+        raise BackupError(f"{output_dir} already contains a backup")
+
+    ranges = key_ranges(partitions)
+    progress = Progress(len(ranges))
+    coordinator = repo_factory()
+    try:
+        # Held open until every worker has finished reading the exported snapshot
+        token = coordinator.begin_snapshot()
+        started_at = datetime.utcnow().isoformat()
+        chunks = _run_parallel(workers, progress, report_interval, [
+            (_dump_chunk, repo_factory, token, output_dir, index, key_range, batch_size, progress)
+            for index, key_range in enumerate(ranges)
+        ])
+        coordinator.end_snapshot()
+    finally:
+        coordinator.close()
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'snapshot_at': started_at,
+        'partitions': len(ranges),
+        'totals': {table: sum(chunk[table] for chunk in chunks) for table in TABLES},
+        'chunks': chunks
+    }
+    with open(os.path.join(output_dir, MANIFEST + '.tmp'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(output_dir, MANIFEST + '.tmp'), os.path.join(output_dir, MANIFEST))
+    return progress.report()
+
+
+def read_manifest(input_dir: str, verify_checksums: bool = True) -> Dict[str, Any]:
+    """Load the manifest and (by default) check every chunk's SHA-256"""
+    path = os.path.join(input_dir, MANIFEST)
+    if not os.path.exists(path):
+        raise BackupError(f"{input_dir} has no {MANIFEST}; the backup is incomplete")
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') not in READABLE_FORMATS:
+        raise BackupError(f"Unsupported backup format: {manifest.get('format')}")
+
+    if verify_checksums:
+        for chunk in manifest['chunks']:
+            chunk_path = os.path.join(input_dir, chunk['file'])
+            if not os.path.exists(chunk_path) or _file_sha256(chunk_path) != chunk['sha256']:
+                raise BackupError(f"Chunk {chunk['file']} is missing or corrupt")
+    return manifest
+
+
+def _load_chunk(repo_factory: RepositoryFactory, input_dir: str, chunk: Dict[str, Any],
+                progress: Progress) -> Dict[str, int]:
+    loaded = dict.fromkeys(TABLES, 0)
+    repo = repo_factory()
+    try:
+        with gzip.open(os.path.join(input_dir, chunk['file']), 'rt') as f:
+            for line in f:
+                batch = json.loads(line)
+                for table, count in repo.bulk_load(batch['users'], batch['password_entries'],
+                                                   batch['attachments']).items():
+                    loaded[table] += count
+                loaded['password_history'] += repo.import_password_history(batch.get('password_history', []))
+                progress.add(**{table: len(batch.get(table, [])) for table in TABLES})
+    finally:
+        repo.close()
+    progress.add(chunks_done=1, bytes=chunk['bytes'])
+    return loaded
+
+
+def restore(repo_factory: RepositoryFactory, input_dir: str, workers: int = 4,
+            report_interval: float = 10.0, verify_checksums: bool = True) -> Dict[str, Any]:
+    """
+    Load a backup into the (migrated, normally empty) target. Rows whose ids
+    already exist are skipped, so an interrupted restore can simply be rerun.
+    """
+    manifest = read_manifest(input_dir, verify_checksums)
+    progress = Progress(len(manifest['chunks']))
+    results = _run_parallel(workers, progress, report_interval, [
+        (_load_chunk, repo_factory, input_dir, chunk, progress) for chunk in manifest['chunks']
+    ])
+    report = progress.report()
+    report['inserted'] = {table: sum(result[table] for result in results) for table in TABLES}
+    return report
@@ -1,5 +1,41 @@
 from abc import ABC, abstractmethod
-from typing import Optional, List, Dict, Any
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+from database.migrations import SCHEMA_VERSION
+
+# Entry fields encrypted under the master password, replaced by a rotation
+ROTATED_FIELDS = ('username', 'encrypted_password', 'iv', 'notes', 'fingerprint')
+
+# The same fields are archived to password history when an update changes any of them
+HISTORY_FIELDS = ROTATED_FIELDS
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO timestamp produced by a repository back into a datetime"""
+    return datetime.fromisoformat(value) if value else None
+
+class DuplicateUserError(ValueError):
+    """Raised when a unique constraint on users is violated"""
+
+    def __init__(self, field: str):
+        self.field = field
+        super().__init__(f'{field.capitalize()} already exists')
+
+class UserMovingError(RuntimeError):
+    """Raised when a write gives up waiting for a user's entries to move between shards"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        super().__init__('Vault is being moved to another database, try again shortly')
+
+class SchemaVersionError(RuntimeError):
+    """Raised at startup when the database schema is older than the code expects"""
+
+    def __init__(self, found: int, expected: int):
+        self.found = found
+        self.expected = expected
+        super().__init__(f"Database schema version {found} is older than {expected}; "
+                         "run `python manage.py migrate`")
 
 class BaseRepository(ABC):
     """Abstract base class for database repositories"""
@@ -14,10 +50,42 @@ class BaseRepository(ABC):
         """Close database connection"""
         pass
     
+    @abstractmethod
+    def migrate(self):
+        """Create tables/collections and indexes and record SCHEMA_VERSION"""
+        pass
+    
+    @abstractmethod
+    def get_schema_version(self) -> int:
+        """Return the recorded schema version (0 if never migrated)"""
+        pass
+    
+    def verify_schema(self):
+        """Fast startup check that migrations have been applied"""
+        found = self.get_schema_version()
+        if found < SCHEMA_VERSION:
+            raise SchemaVersionError(found, SCHEMA_VERSION)
+    
+    @abstractmethod
+    def reset_after_fork(self):
+        """Drop connections inherited from a parent process without closing them"""
+        pass
+    
+    @abstractmethod
+    def ping(self):
+        """One round trip to the database on a pooled connection; raises if it fails"""
+        pass
+    
+    @abstractmethod
+    def pool_status(self) -> Dict[str, int]:
+        """Connections checked out of the pool ('in_use') and its capacity ('size')"""
+        pass
+    
     # User operations
     @abstractmethod
-    def create_user(self, username: str, email: str, password_hash: str, salt: str) -> Dict[str, Any]:
-        """Create a new user"""
+    def create_user(self, username: str, email: str, password_hash: str, salt: str,
+                    user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Create a new user, raising DuplicateUserError on a unique violation"""
         pass
     
     @abstractmethod
@@ -35,10 +103,44 @@ class BaseRepository(ABC):
         """Get user by ID"""
         pass
     
+    @abstractmethod
+    def iter_user_identities(self, batch_size: int = 1000,
+                             since: Optional[datetime] = None) -> Iterator[Tuple[str, str]]:
+        """Stream (username, email) pairs for all users, or those created at or after since"""
+        pass
+    
+    @abstractmethod
+    def iter_users(self, batch_size: int = 1000, start_after: Optional[str] = None,
+                   end_before: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream users in id order, optionally only ids strictly between start_after and end_before"""
+        pass
+    
+    @abstractmethod
+    def delete_user(self, user_id: str) -> bool:
+        """Delete a user and all of their password entries"""
+        pass
+    
+    @abstractmethod
+    def set_master_password(self, user_id: str, password_hash: str, salt: str) -> bool:
+        """Replace a user's master password hash and salt"""
+        pass
+    
+    @abstractmethod
+    def fence_users(self, user_ids: List[str], until: Optional[datetime]) -> int:
+        """Hold writes to users being moved between shards until `until` (None lifts the fence)"""
+        pass
+    
+    @abstractmethod
+    def get_user_fence(self, user_id: str) -> Optional[datetime]:
+        """When a user's write fence lapses, or None; always read from the primary"""
+        pass
+    
     # Password operations
     @abstractmethod
     def create_password(self, user_id: str, website_url: str, website_name: str, 
-                       username: str, encrypted_password: str, iv: str, notes: str = '') -> Dict[str, Any]:
+                       username: str, encrypted_password: str, iv: str, notes: str = '',
+                       fingerprint: Optional[str] = None, folder: Optional[str] = None,
+                       tags: Optional[List[str]] = None) -> Dict[str, Any]:
         """Create a new password entry"""
         pass
     
@@ -52,9 +154,24 @@ class BaseRepository(ABC):
         """Get a specific password entry"""
         pass
     
+    @abstractmethod
+    def list_passwords(self, user_id: str, folder: Optional[str] = None, tag: Optional[str] = None,
+                       limit: int = 100, after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A page of entries in id order, filtered by folder and/or tag; pass the last id as after"""
+        pass
+    
+    @abstractmethod
+    def get_folder_counts(self, user_id: str) -> Dict[str, int]:
+        """Number of entries in each non-empty folder, from the maintained counters"""
+        pass
+    
     @abstractmethod
     def update_password(self, password_id: str, user_id: str, data: Dict[str, Any]) -> bool:
-        """Update a password entry"""
+        """
+        Update a password entry ('tags' replaces the whole tag list). If any
+        HISTORY_FIELDS change, their previous values are appended to the
+        entry's history as the next version, in a single insert.
+        """
         pass
     
     @abstractmethod
@@ -71,3 +188,199 @@ class BaseRepository(ABC):
     def get_password_count(self, user_id: str) -> int:
         """Get count of password entries for a user"""
         pass
+    
+    @abstractmethod
+    def get_password_health(self, user_id: str, stale_before: datetime) -> Dict[str, Any]:
+        """
+        Reused passwords (entries sharing a fingerprint) and stale entries
+        (not updated since stale_before), from indexed queries
+        """
+        pass
+    
+    # Attachment operations (metadata only; bytes live in the blob store)
+    @abstractmethod
+    def create_attachment(self, user_id: str, password_id: str, filename: str,
+                          blob_id: str, size: int) -> Optional[Dict[str, Any]]:
+        """Attach a stored blob to a password entry and add its size to the
+        user's storage total; None if the entry does not belong to the user"""
+        pass
+    
+    @abstractmethod
+    def get_attachments(self, password_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """Attachments of a password entry"""
+        pass
+    
+    @abstractmethod
+    def get_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a specific attachment"""
+        pass
+    
+    @abstractmethod
+    def delete_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Delete an attachment, subtract its size from the user's total and return it"""
+        pass
+    
+    @abstractmethod
+    def count_blob_references(self, blob_id: str) -> int:
+        """Number of attachments pointing at a blob"""
+        pass
+    
+    @abstractmethod
+    def get_storage_usage(self, user_id: str) -> int:
+        """Attachment bytes stored by a user"""
+        pass
+    
+    @abstractmethod
+    def get_user_attachments(self, user_id: str) -> List[Dict[str, Any]]:
+        """All attachments of a user"""
+        pass
+    
+    @abstractmethod
+    def import_attachments(self, attachments: List[Dict[str, Any]]) -> int:
+        """Upsert attachments as returned by get_user_attachments and recount storage totals"""
+        pass
+    
+    # Token revocation operations
+    @abstractmethod
+    def revoke_token(self, key: str, user_id: str, revoked_at: datetime, expires_at: datetime):
+        """Record a revocation (a token jti or "user:<id>"); idempotent"""
+        pass
+    
+    @abstractmethod
+    def get_token_revocations(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Unexpired revocations, optionally only those recorded after since"""
+        pass
+    
+    @abstractmethod
+    def purge_token_revocations(self, now: datetime) -> int:
+        """Delete revocations whose tokens have expired; returns the number removed"""
+        pass
+    
+    # Password history
+    @abstractmethod
+    def get_password_history(self, password_id: str, user_id: str, limit: int = 20,
+                             before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Previous versions of an entry, newest first; pass the last version as before for the next page"""
+        pass
+    
+    @abstractmethod
+    def prune_password_history(self, keep: int, batch_size: int = 500) -> int:
+        """
+        Delete all but the newest keep versions of each entry, working through
+        batch_size entries per statement; returns the number of versions removed
+        """
+        pass
+    
+    @abstractmethod
+    def export_password_history(self, user_ids: List[str]) -> List[Dict[str, Any]]:
+        """Every stored version of a batch of users' entries, with user_id, for import_password_history"""
+        pass
+    
+    @abstractmethod
+    def import_password_history(self, versions: List[Dict[str, Any]]) -> int:
+        """Insert exported versions, skipping ones already present; returns the number inserted"""
+        pass
+    
+    # Security audit log
+    @abstractmethod
+    def insert_audit_events(self, events: List[Dict[str, Any]]) -> int:
+        """
+        Bulk insert audit events (id, ts, event, user_id, ip, request_id,
+        details, expires_at), skipping ids already stored; returns the number inserted
+        """
+        pass
+    
+    @abstractmethod
+    def get_audit_events(self, user_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         event: Optional[str] = None, limit: int = 100,
+                         before: Optional[Tuple[datetime, str]] = None) -> List[Dict[str, Any]]:
+        """
+        A user's events with since <= ts < until, newest first; before is the
+        (ts, id) of the last event of the previous page
+        """
+        pass
+    
+    @abstractmethod
+    def purge_audit_events(self, before: datetime) -> int:
+        """Delete events older than before; returns the number of partitions or events removed"""
+        pass
+    
+    # Vault rotation (re-encryption under a new master password)
+    @abstractmethod
+    def create_rotation(self, rotation_id: str, user_id: str, password_hash: str, salt: str,
+                        expires_at: datetime):
+        """Open a rotation holding the new master password hash, discarding any the user already had"""
+        pass
+    
+    @abstractmethod
+    def get_rotation(self, rotation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        An unexpired rotation with its acknowledged chunk numbers ('chunks',
+        ascending) and number of staged entries ('staged'), or None
+        """
+        pass
+    
+    @abstractmethod
+    def stage_rotation_chunk(self, rotation_id: str, user_id: str, seq: int,
+                             entries: List[Dict[str, Any]]) -> int:
+        """
+        Stage re-encrypted entries ('id' plus ROTATED_FIELDS) and acknowledge
+        chunk seq; re-sending a chunk overwrites it. Returns the entries staged.
+        """
+        pass
+    
+    @abstractmethod
+    def commit_rotation(self, rotation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Atomically replace every entry with its staged version and set the new
+        master password, then drop the rotation and the user's password
+        history, which the new master password cannot decrypt. Nothing is written unless the
+        staged ids are exactly the user's entries: the result is then
+        {'committed': False, 'missing': [...], 'unexpected': [...]}. On success
+        it is {'committed': True, 'updated': n, 'master_password_hash', 'salt'}.
+        None if the rotation does not exist or has expired.
+        """
+        pass
+    
+    @abstractmethod
+    def delete_rotation(self, rotation_id: str, user_id: str) -> bool:
+        """Abandon a rotation and its staged entries"""
+        pass
+    
+    @abstractmethod
+    def purge_rotations(self, now: datetime) -> int:
+        """Delete rotations that expired before now; returns the number removed"""
+        pass
+    
+    @abstractmethod
+    def export_user_data(self, user_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Password entries and attachments of a batch of users, keyed 'password_entries' and 'attachments'"""
+        pass
+    
+    @abstractmethod
+    def bulk_load(self, users: List[Dict[str, Any]], password_entries: List[Dict[str, Any]],
+                  attachments: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Insert users, entries and attachments as returned by the export methods,
+        skipping rows that already exist; returns the number inserted per table
+        """
+        pass
+    
+    @abstractmethod
+    def begin_snapshot(self, token: Optional[str] = None) -> str:
+        """
+        Pin iter_users and export_user_data to one consistent point in time.
+        Returns a token; passing it to another connection's begin_snapshot
+        makes that connection read the same snapshot.
+        """
+        pass
+    
+    @abstractmethod
+    def end_snapshot(self):
+        """Release the snapshot taken by begin_snapshot"""
+        pass
+    
+    @abstractmethod
+    def import_passwords(self, entries: List[Dict[str, Any]]) -> int:
+        """Upsert password entries as returned by get_passwords, preserving ids and timestamps"""
+        pass
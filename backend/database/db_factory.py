@@ -1,22 +1,103 @@
+import logging
+
 from database.base_repository import BaseRepository
-from database.postgres_repository import PostgresRepository
-from database.mongodb_repository import MongoRepository
 
-def get_repository(config) -> BaseRepository:
+logger = logging.getLogger(__name__)
+
+def _build_repository(db_type: str, uri: str, replica_uris=None, router_options=None) -> BaseRepository:
+    """
+    Construct an uninitialized repository for a single database.
+    Drivers are imported here so only the selected backend is loaded.
+    """
+    if db_type == 'postgresql':
+        from database.postgres_repository import PostgresRepository
+        return PostgresRepository(uri, replica_uris, router_options)
+    elif db_type == 'mongodb':
+        from database.mongodb_repository import MongoRepository
+        return MongoRepository(uri, replica_uris, router_options)
+    raise ValueError(f"Unsupported database type: {db_type}. Use 'postgresql' or 'mongodb'")
+
+def get_repository(config, verify_schema: bool = True) -> BaseRepository:
     """
     Factory function to get the appropriate database repository
-    based on configuration
+    based on configuration. Provisioning happens in `manage.py migrate`
+    (or here when SCHEMA_AUTO_MIGRATE is set); otherwise startup only
+    checks the recorded schema version.
     """
     db_type = config.DATABASE_TYPE.lower()
+    router_options = {
+        'max_lag': config.REPLICA_MAX_LAG_SECONDS,
+        'read_your_writes_window': config.READ_YOUR_WRITES_SECONDS,
+        'check_interval': config.REPLICA_HEALTH_CHECK_SECONDS,
+        'writes_storage_uri': config.READ_YOUR_WRITES_STORAGE_URI
+    }
     
     if db_type == 'postgresql':
-        repo = PostgresRepository(config.POSTGRES_URI)
-        print(f"Using PostgreSQL database")
+        repo = _build_repository(db_type, config.POSTGRES_URI, config.POSTGRES_REPLICA_URIS, router_options)
+        logger.info("Using PostgreSQL database")
+    else:
+        repo = _build_repository(db_type, config.MONGODB_URI, config.MONGODB_REPLICA_URIS, router_options)
+        logger.info("Using MongoDB database")
+    
+    if config.SHARD_URIS:
+        from database.sharded_repository import ShardedRepository
+        
+        # Shards appearing in both layouts share one repository instance
+        shards_by_uri = {}
+        for uri in config.SHARD_URIS + config.SHARD_PREVIOUS_URIS:
+            if uri not in shards_by_uri:
+                shards_by_uri[uri] = _build_repository(db_type, uri)
+        repo = ShardedRepository(
+            repo,
+            [shards_by_uri[uri] for uri in config.SHARD_URIS],
+            [shards_by_uri[uri] for uri in config.SHARD_PREVIOUS_URIS],
+            config.SHARD_VIRTUAL_NODES,
+            config.SHARD_MOVE_GRACE_SECONDS,
+            config.SHARD_MOVE_FENCE_SECONDS
+        )
+        logger.info(f"Sharding password entries across {len(config.SHARD_URIS)} databases")
+    
+    repo.initialize()
+    if config.SCHEMA_AUTO_MIGRATE:
+        repo.migrate()
+    elif verify_schema:
+        repo.verify_schema()
+    return repo
+
+def open_repository(db_type: str, uri: str) -> BaseRepository:
+    """Connect to a single database outside the app configuration (for manage.py tools)"""
+    repo = _build_repository(db_type.lower(), uri)
+    repo.initialize()
+    return repo
+
+async def get_async_repository(config):
+    """
+    Factory for the asyncio repositories used by the ASGI app.
+    Drivers are imported here so the synchronous app never needs them.
+    The async repositories talk to the primary database only: sharded
+    deployments are refused (entries on other shards would be invisible)
+    and read replicas go unused.
+    """
+    db_type = config.DATABASE_TYPE.lower()
+    if config.SHARD_URIS:
+        raise ValueError("SHARD_URIS is not supported in async (ASGI) mode; serve sharded deployments with app.py")
+    if config.POSTGRES_REPLICA_URIS if db_type == 'postgresql' else config.MONGODB_REPLICA_URIS:
+        logger.warning("Read replicas are not used in async (ASGI) mode; all reads go to the primary")
+    
+    if db_type == 'postgresql':
+        from database.async_postgres_repository import AsyncPostgresRepository
+        repo = AsyncPostgresRepository(config.POSTGRES_URI)
+        logger.info("Using PostgreSQL database (asyncpg)")
     elif db_type == 'mongodb':
-        repo = MongoRepository(config.MONGODB_URI)
-        print(f"Using MongoDB database")
+        from database.async_mongodb_repository import AsyncMongoRepository
+        repo = AsyncMongoRepository(config.MONGODB_URI)
+        logger.info("Using MongoDB database (Motor)")
     else:
         raise ValueError(f"Unsupported database type: {db_type}. Use 'postgresql' or 'mongodb'")
     
-    repo.initialize()
+    await repo.initialize()
+    if config.SCHEMA_AUTO_MIGRATE:
+        await repo.migrate()
+    else:
+        await repo.verify_schema()
     return repo
@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+
+import startup_timing
+from database.db_factory import get_repository
+
+class LazyRepository:
+    """
+    Proxy that builds the configured repository on first use, once per process.
+
+    Importing the app no longer opens connections, so a pre-fork server can
+    import it in the master. Connections opened in a parent process are
+    dropped in each child after fork and rebuilt there on first use.
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self._repo = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _get(self):
+        repo = self._repo
+        if repo is not None and self._pid == os.getpid():
+            return repo
+
+        with self._lock:
+            if self._repo is not None and self._pid != os.getpid():
+                self._repo.reset_after_fork()
+                self._repo = None
+            if self._repo is None:
+                started = time.perf_counter()
+                self._repo = get_repository(self._config)
+                self._pid = os.getpid()
+                startup_timing.record('connect', time.perf_counter() - started)
+            return self._repo
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def _after_fork(self):
+        if self._repo is not None:
+            self._repo.reset_after_fork()
+            self._repo = None
+        self._lock = threading.Lock()
+
+    def release(self):
+        """Close this process's connections; they are reopened on next use"""
+        with self._lock:
+            if self._repo is not None:
+                self._repo.close()
+                self._repo = None
@@ -0,0 +1,181 @@
+"""
+Declarative indexes and versioned schema migrations shared by both backends
+
+Each IndexSpec names the query pattern it serves and is rendered into
+PostgreSQL DDL or a MongoDB index specification. Migrations are applied in
+version order by each repository's migrate(); backfills run online in
+small batches so they never hold long locks.
+"""
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+ASC = 1
+DESC = -1
+
+
+class IndexSpec(NamedTuple):
+    name: str
+    table: str                          # Postgres table / Mongo collection
+    fields: Tuple[Tuple[str, int], ...]
+    unique: bool = False
+    serves: str = ''                    # repository methods relying on this index
+    backends: Tuple[str, ...] = ('postgresql', 'mongodb')
+    expire_after_seconds: Optional[int] = None  # MongoDB TTL index
+
+
+class Backfill(NamedTuple):
+    """
+    A batched data migration.
+    postgres_sql must update at most :batch_size rows per execution;
+    mongo_filter/mongo_update are applied to batches of matching _ids.
+    """
+    postgres_sql: Optional[str] = None
+    collection: Optional[str] = None
+    mongo_filter: Optional[Dict[str, Any]] = None
+    mongo_update: Optional[Dict[str, Any]] = None
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    indexes: Tuple[str, ...] = ()
+    postgres_sql: Tuple[str, ...] = ()  # run before indexes, outside a transaction
+    backfills: Tuple[Backfill, ...] = ()
+
+
+INDEXES = {spec.name: spec for spec in [
+    # Postgres already enforces these through the UNIQUE column constraints
+    IndexSpec('ux_users_username', 'users', (('username', ASC),), unique=True,
+              serves='get_user_by_username', backends=('mongodb',)),
+    IndexSpec('ux_users_email', 'users', (('email', ASC),), unique=True,
+              serves='get_user_by_email', backends=('mongodb',)),
+    IndexSpec('ix_password_entries_user_id', 'password_entries', (('user_id', ASC),),
+              serves='get_passwords, get_password_count'),
+    IndexSpec('ix_password_entries_user_id_website_url', 'password_entries',
+              (('user_id', ASC), ('website_url', ASC)),
+              serves='search_passwords'),
+    IndexSpec('ix_password_entries_user_id_fingerprint', 'password_entries',
+              (('user_id', ASC), ('fingerprint', ASC)),
+              serves='get_password_health (reused)'),
+    IndexSpec('ix_password_entries_user_id_updated_at', 'password_entries',
+              (('user_id', ASC), ('updated_at', ASC)),
+              serves='get_password_health (stale)'),
+    IndexSpec('ix_password_entries_user_id_folder', 'password_entries', (('user_id', ASC), ('folder', ASC)),
+              serves='list_passwords (folder)'),
+    IndexSpec('ix_password_tags_user_id_tag', 'password_tags', (('user_id', ASC), ('tag', ASC)),
+              serves='list_passwords (tag)', backends=('postgresql',)),
+    # Multikey: one index key per element of the tags array
+    IndexSpec('ix_password_entries_user_id_tags', 'password_entries', (('user_id', ASC), ('tags', ASC)),
+              serves='list_passwords (tag)', backends=('mongodb',)),
+    # Postgres uses the (user_id, folder) primary key
+    IndexSpec('ux_folder_counts_user_id_folder', 'folder_counts', (('user_id', ASC), ('folder', ASC)),
+              unique=True, serves='get_folder_counts', backends=('mongodb',)),
+    IndexSpec('ix_attachments_user_id_password_id', 'attachments', (('user_id', ASC), ('password_id', ASC)),
+              serves='get_attachments, get_user_attachments'),
+    IndexSpec('ix_attachments_blob_id', 'attachments', (('blob_id', ASC),),
+              serves='count_blob_references'),
+    IndexSpec('ix_token_revocations_revoked_at', 'token_revocations', (('revoked_at', ASC),),
+              serves='get_token_revocations'),
+    IndexSpec('ix_token_revocations_expires_at', 'token_revocations', (('expires_at', ASC),),
+              serves='purge_token_revocations'),
+    IndexSpec('ix_vault_rotations_user_id', 'vault_rotations', (('user_id', ASC),),
+              serves='create_rotation, delete_user'),
+    IndexSpec('ix_vault_rotations_expires_at', 'vault_rotations', (('expires_at', ASC),),
+              serves='purge_rotations'),
+    # Postgres uses the (rotation_id, password_id) primary key
+    IndexSpec('ix_vault_rotation_entries_rotation_id', 'vault_rotation_entries', (('rotation_id', ASC),),
+              serves='get_rotation, commit_rotation', backends=('mongodb',)),
+    # Postgres uses the (user_id, password_id, version) primary key
+    IndexSpec('ux_password_history_user_id_password_id_version', 'password_history',
+              (('user_id', ASC), ('password_id', ASC), ('version', DESC)), unique=True,
+              serves='get_password_history, prune_password_history', backends=('mongodb',)),
+    # Postgres creates this in migration 9: partitioned tables can't be indexed CONCURRENTLY
+    IndexSpec('ix_audit_events_user_id_ts', 'audit_events', (('user_id', ASC), ('ts', DESC)),
+              serves='get_audit_events', backends=('mongodb',)),
+    # Documents carry their own expiry time, so retention can change without rebuilding the index
+    IndexSpec('ix_audit_events_expires_at', 'audit_events', (('expires_at', ASC),),
+              serves='TTL expiry (purge_audit_events)', backends=('mongodb',), expire_after_seconds=0),
+]}
+
+
+MIGRATIONS = [
+    Migration(1, 'Baseline users and password_entries tables'),
+    Migration(2, 'Index password entries and users by their query patterns', indexes=(
+        'ux_users_username',
+        'ux_users_email',
+        'ix_password_entries_user_id',
+        'ix_password_entries_user_id_website_url',
+    )),
+    Migration(3, 'Token revocation list', indexes=(
+        'ix_token_revocations_revoked_at',
+        'ix_token_revocations_expires_at',
+    )),
+    Migration(4, 'Password fingerprints for vault health', indexes=(
+        'ix_password_entries_user_id_fingerprint',
+        'ix_password_entries_user_id_updated_at',
+    ), postgres_sql=(
+        'ALTER TABLE password_entries ADD COLUMN IF NOT EXISTS fingerprint VARCHAR(64)',
+    )),
+    Migration(5, 'Attachments and per-user storage accounting', indexes=(
+        'ix_attachments_user_id_password_id',
+        'ix_attachments_blob_id',
+    ), postgres_sql=(
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS storage_bytes BIGINT NOT NULL DEFAULT 0',
+    )),
+    Migration(6, 'Folders and tags with per-folder counts', indexes=(
+        'ix_password_entries_user_id_folder',
+        'ix_password_tags_user_id_tag',
+        'ix_password_entries_user_id_tags',
+        'ux_folder_counts_user_id_folder',
+    ), postgres_sql=(
+        'ALTER TABLE password_entries ADD COLUMN IF NOT EXISTS folder VARCHAR(100)',
+    )),
+    Migration(7, 'Staging tables for vault re-encryption', indexes=(
+        'ix_vault_rotations_user_id',
+        'ix_vault_rotations_expires_at',
+        'ix_vault_rotation_entries_rotation_id',
+    )),
+    Migration(8, 'Append-only password history', indexes=(
+        'ux_password_history_user_id_password_id_version',
+    )),
+    Migration(9, 'Security audit log', indexes=(
+        'ix_audit_events_user_id_ts',
+        'ix_audit_events_expires_at',
+    ), postgres_sql=(
+        # On the partitioned parent, so every monthly partition gets it
+        'CREATE INDEX IF NOT EXISTS ix_audit_events_user_id_ts ON audit_events (user_id, ts DESC)',
+    )),
+    Migration(10, 'Write fence for users moving between shards', postgres_sql=(
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS moving_until TIMESTAMP',
+    )),
+    Migration(11, 'Detect entries edited during a vault rotation', postgres_sql=(
+        'ALTER TABLE vault_rotation_entries ADD COLUMN IF NOT EXISTS entry_updated_at TIMESTAMP',
+    )),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def pending_migrations(current_version: int) -> List[Migration]:
+    """Migrations newer than the recorded version, oldest first"""
+    return [m for m in MIGRATIONS if m.version > current_version]
+
+
+def indexes_for(migration: Migration, backend: str) -> List[IndexSpec]:
+    """Index specs a migration creates on the given backend"""
+    return [INDEXES[name] for name in migration.indexes if backend in INDEXES[name].backends]
+
+
+def postgres_index_ddl(spec: IndexSpec, concurrently: bool = True) -> str:
+    """Render an index as PostgreSQL DDL"""
+    columns = ', '.join(f"{field}{' DESC' if direction == DESC else ''}" for field, direction in spec.fields)
+    return (f"CREATE {'UNIQUE ' if spec.unique else ''}INDEX "
+            f"{'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {spec.name} "
+            f"ON {spec.table} ({columns})")
+
+
+def mongo_index_spec(spec: IndexSpec) -> Tuple[List[Tuple[str, int]], Dict[str, Any]]:
+    """Render an index as (keys, options) for Collection.create_index"""
+    options = {'name': spec.name, 'unique': spec.unique}
+    if spec.expire_after_seconds is not None:
+        options['expireAfterSeconds'] = spec.expire_after_seconds
+    return list(spec.fields), options
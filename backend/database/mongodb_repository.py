@@ -1,22 +1,83 @@
-from typing import Optional, List, Dict, Any
+import logging
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Callable
 from datetime import datetime
+import threading
 import uuid
 from urllib.parse import urlparse
 
-from pymongo import MongoClient, ASCENDING
-from pymongo.errors import DuplicateKeyError, ConnectionFailure
+from bson.timestamp import Timestamp
+from pymongo import MongoClient, ASCENDING, DESCENDING, DeleteMany, ReplaceOne, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ConnectionFailure, OperationFailure
 
-from database.base_repository import BaseRepository
+from database.base_repository import (BaseRepository, DuplicateUserError, HISTORY_FIELDS, ROTATED_FIELDS,
+                                      parse_timestamp)
+from database.migrations import pending_migrations, indexes_for, mongo_index_spec
+from database.replica_router import ReplicaRouter
+
+logger = logging.getLogger(__name__)
+
+MAX_POOL_SIZE = 50
+
+class _PoolUsage(monitoring.ConnectionPoolListener):
+    """Counts connections checked out of the client's pools; events arrive on many threads"""
+    
+    def __init__(self):
+        self.in_use = 0
+        self._lock = threading.Lock()
+    
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.in_use += 1
+    
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+    
+    # The remaining pool events are not needed
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_created(self, event):
+        pass
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        pass
+    
+    def connection_check_out_started(self, event):
+        pass
+    
+    def connection_check_out_failed(self, event):
+        pass
 
 class MongoRepository(BaseRepository):
     """MongoDB implementation of the repository"""
     
-    def __init__(self, database_uri: str):
+    def __init__(self, database_uri: str, replica_uris: Optional[List[str]] = None,
+                 router_options: Optional[Dict[str, Any]] = None):
         self.database_uri = database_uri
+        self.replica_uris = replica_uris or []
+        self.router_options = router_options or {}
         self.client = None
         self.db = None
         self.users = None
         self.passwords = None
+        self.replicas = []
+        self.router = None
+        self._probe_uris = {}
+        self._snapshot_time = None
+        self._pool_usage = _PoolUsage()
     
     def initialize(self):
         """Initialize MongoDB connection"""
@@ -24,18 +85,15 @@ class MongoRepository(BaseRepository):
             # Connect to MongoDB
             self.client = MongoClient(
                 self.database_uri,
-                maxPoolSize=50,
+                maxPoolSize=MAX_POOL_SIZE,
                 minPoolSize=10,
                 connectTimeoutMS=10000,
                 socketTimeoutMS=45000,
                 serverSelectionTimeoutMS=10000,
-                retryWrites=True
+                retryWrites=True,
+                event_listeners=[self._pool_usage]
             )
             
-            # Test connection
-            self.client.admin.command('ping')
-            print("✓ MongoDB connection successful")
-            
             # Extract database name from URI
             db_name = self._extract_database_name(self.database_uri)
             
@@ -47,19 +105,22 @@ class MongoRepository(BaseRepository):
             self.users = self.db.users
             self.passwords = self.db.password_entries
             
-            # Create indexes
-            self.users.create_index([('username', ASCENDING)], unique=True)
-            self.users.create_index([('email', ASCENDING)], unique=True)
-            self.passwords.create_index([('user_id', ASCENDING)])
-            self.passwords.create_index([('user_id', ASCENDING), ('website_url', ASCENDING)])
+            if self.replica_uris:
+                self.replicas = [
+                    MongoClient(uri, connectTimeoutMS=5000, serverSelectionTimeoutMS=2000)[db_name]
+                    for uri in self.replica_uris
+                ]
+                self._probe_uris = {id(r): uri for r, uri in zip(self.replicas, self.replica_uris)}
+                self.router = ReplicaRouter(self.replicas, self._replica_lag, **self.router_options)
+                logger.info(f"MongoDB read replicas configured: {len(self.replicas)}")
             
-            print(f"✓ MongoDB database initialized: {self.db.name}")
+            logger.info(f"MongoDB database initialized: {self.db.name}")
             
         except ConnectionFailure as e:
-            print(f"❌ Failed to connect to MongoDB: {e}")
+            logger.error("Failed to connect to MongoDB: %s", e)
             raise
-        except Exception as e:
-            print(f"❌ MongoDB initialization error: {e}")
+        except Exception:
+            logger.exception("MongoDB initialization error")
             raise
     
     def _extract_database_name(self, uri: str) -> str:
@@ -76,27 +137,131 @@ class MongoRepository(BaseRepository):
             
             # If no database name found, use default
             if not db_name:
-                print("⚠️  No database name in URI, using default: 'password_manager'")
+                logger.warning("No database name in URI, using default: 'password_manager'")
                 return 'password_manager'
             
             return db_name
             
         except Exception as e:
-            print(f"⚠️  Error parsing URI, using default database: {e}")
+            logger.warning("Error parsing URI, using default database: %s", e)
             return 'password_manager'
     
     def close(self):
         """Close MongoDB connection"""
         if self.client:
             self.client.close()
-            print("✓ MongoDB connection closed")
+            logger.info("MongoDB connection closed")
+        for replica in self.replicas:
+            replica.client.close()
+    
+    def migrate(self, batch_size: int = 1000):
+        """Apply pending migrations in version order"""
+        for migration in pending_migrations(self.get_schema_version()):
+            for spec in indexes_for(migration, 'mongodb'):
+                keys, options = mongo_index_spec(spec)
+                try:
+                    self.db[spec.table].create_index(keys, **options)
+                except OperationFailure as e:
+                    # 85: the same keys are already indexed under another name
+                    if e.code != 85:
+                        raise
+            
+            for backfill in migration.backfills:
+                if backfill.collection:
+                    self._run_backfill(backfill, batch_size)
+            
+            self.db.schema_version.update_one(
+                {'_id': 'schema'},
+                {'$max': {'version': migration.version}, '$set': {'applied_at': datetime.utcnow()}},
+                upsert=True
+            )
+            logger.info(f"MongoDB migration {migration.version}: {migration.description}")
+    
+    def _run_backfill(self, backfill, batch_size: int) -> int:
+        """Apply a backfill update to batches of matching documents"""
+        collection = self.db[backfill.collection]
+        total = 0
+        while True:
+            ids = [doc['_id'] for doc in collection.find(backfill.mongo_filter, {'_id': 1}).limit(batch_size)]
+            if not ids:
+                return total
+            total += collection.update_many({'_id': {'$in': ids}}, backfill.mongo_update).modified_count
+    
+    def get_schema_version(self) -> int:
+        """Return the recorded schema version (0 if never migrated)"""
+        doc = self.db.schema_version.find_one({'_id': 'schema'})
+        return doc['version'] if doc else 0
+    
+    def reset_after_fork(self):
+        """Drop clients inherited from a parent process; MongoClient is not fork-safe"""
+        self.client = None
+        self.db = None
+        self.users = None
+        self.passwords = None
+        self.replicas = []
+        self.router = None
+        self._pool_usage = _PoolUsage()
+    
+    def ping(self):
+        """ping command on a pooled connection"""
+        self.client.admin.command('ping')
+    
+    def pool_status(self) -> Dict[str, int]:
+        """Checked-out connections against maxPoolSize"""
+        return {'in_use': self._pool_usage.in_use, 'size': MAX_POOL_SIZE}
+    
+    def _replica_lag(self, replica) -> float:
+        """
+        0 once the replica has applied the primary's last oplog entry,
+        otherwise seconds its last write trails the primary's (0 if not a
+        replica set)
+        """
+        primary_write = self._probe_hello(self.database_uri).get('lastWrite', {})
+        replica_write = self._probe_hello(self._probe_uris[id(replica)]).get('lastWrite', {})
+        if not primary_write.get('lastWriteDate') or not replica_write.get('lastWriteDate'):
+            return 0.0
+        if replica_write['opTime']['ts'] >= primary_write['opTime']['ts']:
+            return 0.0
+        return max((primary_write['lastWriteDate'] - replica_write['lastWriteDate']).total_seconds(), 0.0)
+    
+    @staticmethod
+    def _probe_hello(uri: str) -> Dict[str, Any]:
+        """
+        Run hello on a short-lived client; the router probes from a real OS
+        thread, where the request clients' green-locked pools must not be used
+        """
+        client = MongoClient(uri, connectTimeoutMS=5000, serverSelectionTimeoutMS=2000)
+        try:
+            return client.admin.command('hello')
+        finally:
+            client.close()
+    
+    def _read(self, query: Callable, user_id: Optional[str] = None, retry_miss: bool = False):
+        """
+        Run a read-only query on a replica database when one is eligible,
+        falling back to the primary on connection errors (and on a miss if retry_miss)
+        """
+        replica = self.router.choose(user_id) if self.router else None
+        if replica is not None:
+            try:
+                result = query(replica)
+                if result is not None or not retry_miss:
+                    return result
+            except ConnectionFailure:
+                self.router.mark_unhealthy(replica)
+        return query(self.db)
+    
+    def _mark_write(self, user_id: str):
+        if self.router:
+            self.router.mark_write(user_id)
     
     # ... rest of the methods remain the same ...
     
-    def create_user(self, username: str, email: str, password_hash: str, salt: str) -> Dict[str, Any]:
+    def create_user(self, username: str, email: str, password_hash: str, salt: str,
+                    user_id: Optional[str] = None) -> Dict[str, Any]:
         """Create a new user"""
         user_doc = {
-            '_id': str(uuid.uuid4()),
+            '_id': user_id or str(uuid.uuid4()),
             'username': username,
             'email': email,
             'master_password_hash': password_hash,
@@ -107,27 +272,81 @@ class MongoRepository(BaseRepository):
         
         try:
             self.users.insert_one(user_doc)
+            self._mark_write(user_doc['_id'])
             return self._format_user(user_doc)
-        except DuplicateKeyError:
-            raise ValueError('Username or email already exists')
+        except DuplicateKeyError as e:
+            key_pattern = (e.details or {}).get('keyPattern', {})
+            raise DuplicateUserError('email' if 'email' in key_pattern else 'username')
     
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """Get user by username"""
-        user = self.users.find_one({'username': username})
+        user = self._read(lambda db: db.users.find_one({'username': username}), retry_miss=True)
         return self._format_user(user) if user else None
     
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """Get user by email"""
-        user = self.users.find_one({'email': email})
+        user = self._read(lambda db: db.users.find_one({'email': email}), retry_miss=True)
         return self._format_user(user) if user else None
     
     def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
-        user = self.users.find_one({'_id': user_id})
+        user = self._read(lambda db: db.users.find_one({'_id': user_id}), user_id, retry_miss=True)
         return self._format_user(user) if user else None
     
+    def iter_user_identities(self, batch_size: int = 1000,
+                             since: Optional[datetime] = None) -> Iterator[Tuple[str, str]]:
+        """Stream (username, email) pairs for all users, or those created at or after since"""
+        spec = {'created_at': {'$gte': since}} if since is not None else {}
+        cursor = self.users.find(spec, {'username': 1, 'email': 1, '_id': 0}).batch_size(batch_size)
+        for user in cursor:
+            yield user['username'], user['email']
+    
+    def iter_users(self, batch_size: int = 1000, start_after: Optional[str] = None,
+                   end_before: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream users in id order, optionally only ids strictly between start_after and end_before"""
+        id_range = {}
+        if start_after is not None:
+            id_range['$gt'] = start_after
+        if end_before is not None:
+            id_range['$lt'] = end_before
+        spec = {'_id': id_range} if id_range else {}
+        for user in self._find_in_order(self.users, spec, batch_size):
+            yield self._format_user(user)
+    
+    def delete_user(self, user_id: str) -> bool:
+        """Delete a user and all of their password entries"""
+        self.db.attachments.delete_many({'user_id': user_id})
+        self.db.folder_counts.delete_many({'user_id': user_id})
+        self._delete_rotations({'user_id': user_id})
+        self.db.password_history.delete_many({'user_id': user_id})
+        self.passwords.delete_many({'user_id': user_id})
+        result = self.users.delete_one({'_id': user_id})
+        self._mark_write(user_id)
+        return result.deleted_count > 0
+    
+    def set_master_password(self, user_id: str, password_hash: str, salt: str) -> bool:
+        """Replace a user's master password hash and salt"""
+        result = self.users.update_one(
+            {'_id': user_id},
+            {'$set': {'master_password_hash': password_hash, 'salt': salt, 'updated_at': datetime.utcnow()}}
+        )
+        self._mark_write(user_id)
+        return result.matched_count > 0
+    
+    def fence_users(self, user_ids: List[str], until: Optional[datetime]) -> int:
+        """Hold writes to users being moved between shards until `until` (None lifts the fence)"""
+        update = {'$set': {'moving_until': until}} if until else {'$unset': {'moving_until': ''}}
+        return self.users.update_many({'_id': {'$in': user_ids}}, update).matched_count
+    
+    def get_user_fence(self, user_id: str) -> Optional[datetime]:
+        """When a user's write fence lapses, or None; always read from the primary"""
+        user = self.users.find_one({'_id': user_id}, {'moving_until': 1})
+        return user.get('moving_until') if user else None
+    
     def create_password(self, user_id: str, website_url: str, website_name: str,
-                       username: str, encrypted_password: str, iv: str, notes: str = '') -> Dict[str, Any]:
+                       username: str, encrypted_password: str, iv: str, notes: str = '',
+                       fingerprint: Optional[str] = None, folder: Optional[str] = None,
+                       tags: Optional[List[str]] = None) -> Dict[str, Any]:
         """Create a new password entry"""
         password_doc = {
             '_id': str(uuid.uuid4()),
@@ -138,18 +357,66 @@ class MongoRepository(BaseRepository):
             'encrypted_password': encrypted_password,
             'iv': iv,
             'notes': notes,
+            'fingerprint': fingerprint,
+            'folder': folder,
+            'tags': sorted(set(tags or [])),
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow(),
             'last_used': None
         }
         
         self.passwords.insert_one(password_doc)
+        self._bump_folder(user_id, folder, 1)
+        self._mark_write(user_id)
         return self._format_password(password_doc)
     
     def get_passwords(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all passwords for a user"""
-        passwords = self.passwords.find({'user_id': user_id})
-        return [self._format_password(pwd) for pwd in passwords]
+        return self._read(
+            lambda db: [self._format_password(pwd) for pwd in db.password_entries.find({'user_id': user_id})],
+            user_id
+        )
+    
+    def list_passwords(self, user_id: str, folder: Optional[str] = None, tag: Optional[str] = None,
+                       limit: int = 100, after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A page of entries in id order, filtered by folder and/or tag; pass the last id as after"""
+        spec = {'user_id': user_id}
+        if folder is not None:
+            spec['folder'] = folder
+        if tag is not None:
+            spec['tags'] = tag
+        if after is not None:
+            spec['_id'] = {'$gt': after}
+        return self._read(
+            lambda db: [self._format_password(pwd) for pwd in
+                        db.password_entries.find(spec).sort('_id', ASCENDING).limit(limit)],
+            user_id
+        )
+    
+    def get_folder_counts(self, user_id: str) -> Dict[str, int]:
+        """Number of entries in each non-empty folder, from the maintained counters"""
+        cursor = self.db.folder_counts.find({'user_id': user_id, 'entries': {'$gt': 0}}).sort('folder', ASCENDING)
+        return {doc['folder']: doc['entries'] for doc in cursor}
+    
+    def _bump_folder(self, user_id: str, folder: Optional[str], delta: int):
+        if folder:
+            self.db.folder_counts.update_one({'user_id': user_id, 'folder': folder},
+                                             {'$inc': {'entries': delta}}, upsert=True)
+    
+    def _recount_folders(self, user_ids):
+        """Rebuild folder counters from the entries, after bulk writes"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        counts = self.passwords.aggregate([
+            {'$match': {'user_id': {'$in': user_ids}, 'folder': {'$nin': [None, '']}}},
+            {'$group': {'_id': {'user_id': '$user_id', 'folder': '$folder'}, 'entries': {'$sum': 1}}}
+        ])
+        self.db.folder_counts.delete_many({'user_id': {'$in': user_ids}})
+        documents = [{'user_id': c['_id']['user_id'], 'folder': c['_id']['folder'], 'entries': c['entries']}
+                     for c in counts]
+        if documents:
+            self.db.folder_counts.insert_many(documents)
     
     def get_password_by_id(self, password_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific password entry"""
@@ -166,32 +433,565 @@ class MongoRepository(BaseRepository):
         return None
     
     def update_password(self, password_id: str, user_id: str, data: Dict[str, Any]) -> bool:
-        """Update a password entry"""
+        """Update a password entry, archiving changed encrypted fields to its history"""
         data['updated_at'] = datetime.utcnow()
+        if 'tags' in data:
+            data['tags'] = sorted(set(data['tags'] or []))
         
-        result = self.passwords.update_one(
+        update = {'$set': data}
+        archive = any(field in data for field in HISTORY_FIELDS)
+        if archive:
+            # The entry keeps its history counter, so the update hands out version numbers atomically
+            update['$inc'] = {'history_version': 1}
+        previous = self.passwords.find_one_and_update(
             {'_id': password_id, 'user_id': user_id},
-            {'$set': data}
+            update,
+            projection={'folder': 1, 'history_version': 1, **dict.fromkeys(HISTORY_FIELDS, 1)}
         )
+        self._mark_write(user_id)
+        if previous is None:
+            return False
         
-        return result.modified_count > 0
+        if archive and any(field in data and data[field] != previous.get(field) for field in HISTORY_FIELDS):
+            version = previous.get('history_version', 0) + 1
+            self.db.password_history.insert_one({
+                '_id': f"{password_id}:{version}",
+                'user_id': user_id,
+                'password_id': password_id,
+                'version': version,
+                **{field: previous.get(field) for field in HISTORY_FIELDS},
+                'replaced_at': data['updated_at']
+            })
+        
+        if 'folder' in data and data['folder'] != previous.get('folder'):
+            self._bump_folder(user_id, previous.get('folder'), -1)
+            self._bump_folder(user_id, data['folder'], 1)
+        return True
     
     def delete_password(self, password_id: str, user_id: str) -> bool:
         """Delete a password entry"""
-        result = self.passwords.delete_one({'_id': password_id, 'user_id': user_id})
-        return result.deleted_count > 0
+        deleted = self.passwords.find_one_and_delete({'_id': password_id, 'user_id': user_id},
+                                                     projection={'folder': 1})
+        self._mark_write(user_id)
+        if deleted is None:
+            return False
+        self._bump_folder(user_id, deleted.get('folder'), -1)
+        self.db.password_history.delete_many({'user_id': user_id, 'password_id': password_id})
+        return True
     
     def search_passwords(self, user_id: str, query: str) -> List[Dict[str, Any]]:
         """Search passwords by URL"""
-        passwords = self.passwords.find({
+        spec = {
             'user_id': user_id,
             'website_url': {'$regex': query, '$options': 'i'}
-        })
-        return [self._format_password(pwd) for pwd in passwords]
+        }
+        return self._read(
+            lambda db: [self._format_password(pwd) for pwd in db.password_entries.find(spec)],
+            user_id
+        )
     
     def get_password_count(self, user_id: str) -> int:
         """Get count of password entries for a user"""
-        return self.passwords.count_documents({'user_id': user_id})
+        return self._read(lambda db: db.password_entries.count_documents({'user_id': user_id}), user_id)
+    
+    def get_password_health(self, user_id: str, stale_before: datetime) -> Dict[str, Any]:
+        """Reused fingerprints and stale entries for a user"""
+        def query(db):
+            reused = db.password_entries.aggregate([
+                {'$match': {'user_id': user_id, 'fingerprint': {'$type': 'string'}}},
+                {'$group': {'_id': '$fingerprint', 'password_ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+                {'$match': {'count': {'$gt': 1}}}
+            ])
+            stale = db.password_entries.find(
+                {'user_id': user_id, 'updated_at': {'$lt': stale_before}},
+                {'website_name': 1, 'updated_at': 1, 'last_used': 1}
+            ).sort('updated_at', ASCENDING)
+            return {
+                'reused': [{'fingerprint': group['_id'], 'password_ids': sorted(group['password_ids'])}
+                           for group in reused],
+                'stale': [{
+                    'id': doc['_id'],
+                    'website_name': doc.get('website_name'),
+                    'updated_at': doc['updated_at'].isoformat() if doc.get('updated_at') else None,
+                    'last_used': doc['last_used'].isoformat() if doc.get('last_used') else None
+                } for doc in stale]
+            }
+        return self._read(query, user_id)
+    
+    def create_attachment(self, user_id: str, password_id: str, filename: str,
+                          blob_id: str, size: int) -> Optional[Dict[str, Any]]:
+        """Attach a stored blob to a password entry and add its size to the user's total"""
+        if not self.passwords.find_one({'_id': password_id, 'user_id': user_id}, {'_id': 1}):
+            return None
+        
+        attachment_doc = {
+            '_id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'password_id': password_id,
+            'filename': filename,
+            'blob_id': blob_id,
+            'size': size,
+            'created_at': datetime.utcnow()
+        }
+        self.db.attachments.insert_one(attachment_doc)
+        self.users.update_one({'_id': user_id}, {'$inc': {'storage_bytes': size}})
+        self._mark_write(user_id)
+        return self._format_attachment(attachment_doc)
+    
+    def get_attachments(self, password_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """Attachments of a password entry"""
+        return self._read(
+            lambda db: [self._format_attachment(doc) for doc in
+                        db.attachments.find({'user_id': user_id, 'password_id': password_id}).sort('created_at', ASCENDING)],
+            user_id
+        )
+    
+    def get_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a specific attachment"""
+        doc = self.db.attachments.find_one({'_id': attachment_id, 'user_id': user_id})
+        return self._format_attachment(doc) if doc else None
+    
+    def delete_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Delete an attachment and subtract its size from the user's total"""
+        doc = self.db.attachments.find_one_and_delete({'_id': attachment_id, 'user_id': user_id})
+        if not doc:
+            return None
+        self.users.update_one({'_id': user_id}, {'$inc': {'storage_bytes': -doc['size']}})
+        self._mark_write(user_id)
+        return self._format_attachment(doc)
+    
+    def count_blob_references(self, blob_id: str) -> int:
+        """Number of attachments pointing at a blob"""
+        return self.db.attachments.count_documents({'blob_id': blob_id})
+    
+    def get_storage_usage(self, user_id: str) -> int:
+        """Attachment bytes stored by a user"""
+        user = self.users.find_one({'_id': user_id}, {'storage_bytes': 1})
+        return user.get('storage_bytes', 0) if user else 0
+    
+    def get_user_attachments(self, user_id: str) -> List[Dict[str, Any]]:
+        """All attachments of a user"""
+        return [self._format_attachment(doc) for doc in self.db.attachments.find({'user_id': user_id})]
+    
+    def import_attachments(self, attachments: List[Dict[str, Any]]) -> int:
+        """Upsert attachments and recount the owners' storage totals"""
+        if not attachments:
+            return 0
+        
+        operations = [
+            ReplaceOne({'_id': a['id']}, self._attachment_document(a), upsert=True)
+            for a in attachments
+        ]
+        self.db.attachments.bulk_write(operations, ordered=False)
+        self._recount_storage({a['user_id'] for a in attachments})
+        return len(operations)
+    
+    def _recount_storage(self, user_ids):
+        for user_id in user_ids:
+            totals = list(self.db.attachments.aggregate([
+                {'$match': {'user_id': user_id}},
+                {'$group': {'_id': None, 'total': {'$sum': '$size'}}}
+            ]))
+            self.users.update_one({'_id': user_id},
+                                  {'$set': {'storage_bytes': totals[0]['total'] if totals else 0}})
+            self._mark_write(user_id)
+    
+    def _attachment_document(self, attachment: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a formatted attachment back into a MongoDB document"""
+        return {
+            '_id': attachment['id'],
+            'user_id': attachment['user_id'],
+            'password_id': attachment['password_id'],
+            'filename': attachment['filename'],
+            'blob_id': attachment['blob_id'],
+            'size': attachment['size'],
+            'created_at': parse_timestamp(attachment.get('created_at'))
+        }
+    
+    def _format_attachment(self, doc: Dict) -> Dict[str, Any]:
+        """Format MongoDB attachment document to standard format"""
+        return {
+            'id': doc['_id'],
+            'user_id': doc['user_id'],
+            'password_id': doc['password_id'],
+            'filename': doc['filename'],
+            'blob_id': doc['blob_id'],
+            'size': doc['size'],
+            'created_at': doc['created_at'].isoformat() if doc.get('created_at') else None
+        }
+    
+    def revoke_token(self, key: str, user_id: str, revoked_at: datetime, expires_at: datetime):
+        """Record a revocation (a token jti or "user:<id>"); idempotent"""
+        self.db.token_revocations.update_one(
+            {'_id': key},
+            {'$set': {'user_id': user_id, 'revoked_at': revoked_at, 'expires_at': expires_at}},
+            upsert=True
+        )
+    
+    def get_token_revocations(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Unexpired revocations, optionally only those recorded after since"""
+        spec = {'expires_at': {'$gt': datetime.utcnow()}}
+        if since is not None:
+            spec['revoked_at'] = {'$gt': since}
+        return [{
+            'key': doc['_id'],
+            'user_id': doc['user_id'],
+            'revoked_at': doc['revoked_at'].isoformat(),
+            'expires_at': doc['expires_at'].isoformat()
+        } for doc in self.db.token_revocations.find(spec)]
+    
+    def purge_token_revocations(self, now: datetime) -> int:
+        """Delete revocations whose tokens have expired"""
+        return self.db.token_revocations.delete_many({'expires_at': {'$lte': now}}).deleted_count
+    
+    def get_password_history(self, password_id: str, user_id: str, limit: int = 20,
+                             before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Previous versions of an entry, newest first, paged by version"""
+        spec = {'user_id': user_id, 'password_id': password_id}
+        if before is not None:
+            spec['version'] = {'$lt': before}
+        return self._read(
+            lambda db: [{
+                'password_id': doc['password_id'],
+                'version': doc['version'],
+                **{field: doc.get(field) for field in HISTORY_FIELDS},
+                'replaced_at': doc['replaced_at'].isoformat()
+            } for doc in db.password_history.find(spec).sort('version', DESCENDING).limit(limit)],
+            user_id
+        )
+    
+    def prune_password_history(self, keep: int, batch_size: int = 500) -> int:
+        """Find up to batch_size entries over the limit, then trim them in one bulk write"""
+        history = self.db.password_history
+        removed = 0
+        while True:
+            crowded = list(history.aggregate([
+                {'$group': {'_id': {'user_id': '$user_id', 'password_id': '$password_id'}, 'versions': {'$sum': 1}}},
+                {'$match': {'versions': {'$gt': keep}}},
+                {'$limit': batch_size}
+            ], allowDiskUse=True))
+            if not crowded:
+                return removed
+            deletes = []
+            for group in crowded:
+                spec = dict(group['_id'])
+                for cutoff in history.find(spec, {'version': 1}).sort('version', DESCENDING).skip(keep).limit(1):
+                    deletes.append(DeleteMany({**spec, 'version': {'$lte': cutoff['version']}}))
+            if not deletes:
+                return removed
+            removed += history.bulk_write(deletes, ordered=False).deleted_count
+    
+    def export_password_history(self, user_ids: List[str]) -> List[Dict[str, Any]]:
+        """Every stored version of a batch of users' entries, with user_id, for import_password_history"""
+        # Read at the pinned snapshot time during a backup
+        cursor = self._find_in_order(self.db.password_history, {'user_id': {'$in': user_ids}})
+        return [{
+            'user_id': doc['user_id'],
+            'password_id': doc['password_id'],
+            'version': doc['version'],
+            **{field: doc.get(field) for field in HISTORY_FIELDS},
+            'replaced_at': doc['replaced_at'].isoformat()
+        } for doc in cursor]
+    
+    def import_password_history(self, versions: List[Dict[str, Any]]) -> int:
+        """
+        Insert exported versions, skipping ones already present, and raise each
+        entry's history counter past them so later updates don't reuse a version
+        """
+        inserted = self._insert_new(self.db.password_history, [{
+            '_id': f"{version['password_id']}:{version['version']}",
+            'user_id': version['user_id'],
+            'password_id': version['password_id'],
+            'version': version['version'],
+            **{field: version.get(field) for field in HISTORY_FIELDS},
+            'replaced_at': parse_timestamp(version['replaced_at'])
+        } for version in versions])
+        latest: Dict[str, int] = {}
+        for version in versions:
+            latest[version['password_id']] = max(version['version'], latest.get(version['password_id'], 0))
+        if latest:
+            self.passwords.bulk_write([
+                UpdateOne({'_id': password_id}, {'$max': {'history_version': version}})
+                for password_id, version in latest.items()
+            ], ordered=False)
+        return inserted
+    
+    def insert_audit_events(self, events: List[Dict[str, Any]]) -> int:
+        """Unordered insert_many; the TTL index on expires_at removes events past retention"""
+        return self._insert_new(self.db.audit_events, [{
+            '_id': event['id'],
+            'ts': event['ts'],
+            'event': event['event'],
+            'user_id': event['user_id'],
+            'ip': event['ip'],
+            'request_id': event['request_id'],
+            'details': event['details'],
+            'expires_at': event['expires_at']
+        } for event in events])
+    
+    def get_audit_events(self, user_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         event: Optional[str] = None, limit: int = 100,
+                         before: Optional[Tuple[datetime, str]] = None) -> List[Dict[str, Any]]:
+        """A user's events newest first, served by the (user_id, ts) index"""
+        spec: Dict[str, Any] = {'user_id': user_id}
+        ts: Dict[str, datetime] = {}
+        if since is not None:
+            ts['$gte'] = since
+        if until is not None:
+            ts['$lt'] = until
+        if ts:
+            spec['ts'] = ts
+        if event is not None:
+            spec['event'] = event
+        if before is not None:
+            spec['$or'] = [{'ts': {'$lt': before[0]}}, {'ts': before[0], '_id': {'$lt': before[1]}}]
+        return self._read(
+            lambda db: [{
+                'id': doc['_id'],
+                'ts': doc['ts'].isoformat(),
+                'event': doc['event'],
+                'user_id': doc['user_id'],
+                'ip': doc.get('ip'),
+                'request_id': doc.get('request_id'),
+                'details': doc.get('details') or {}
+            } for doc in db.audit_events.find(spec).sort([('ts', DESCENDING), ('_id', DESCENDING)]).limit(limit)],
+            user_id
+        )
+    
+    def purge_audit_events(self, before: datetime) -> int:
+        """Nothing to do: the TTL monitor deletes events once expires_at passes"""
+        return 0
+    
+    def _delete_rotations(self, spec: Dict[str, Any], session=None) -> int:
+        """Delete matching rotations and their staged entries"""
+        ids = [doc['_id'] for doc in self.db.vault_rotations.find(spec, {'_id': 1}, session=session)]
+        if not ids:
+            return 0
+        self.db.vault_rotation_entries.delete_many({'rotation_id': {'$in': ids}}, session=session)
+        return self.db.vault_rotations.delete_many({'_id': {'$in': ids}}, session=session).deleted_count
+    
+    def create_rotation(self, rotation_id: str, user_id: str, password_hash: str, salt: str,
+                        expires_at: datetime):
+        """Open a rotation, discarding any the user already had"""
+        self._delete_rotations({'user_id': user_id})
+        self.db.vault_rotations.insert_one({
+            '_id': rotation_id,
+            'user_id': user_id,
+            'master_password_hash': password_hash,
+            'salt': salt,
+            'chunks': {},
+            'created_at': datetime.utcnow(),
+            'expires_at': expires_at
+        })
+    
+    def _live_rotation(self, rotation_id: str, user_id: str) -> Dict[str, Any]:
+        return {'_id': rotation_id, 'user_id': user_id, 'expires_at': {'$gt': datetime.utcnow()}}
+    
+    def get_rotation(self, rotation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """An unexpired rotation with its acknowledged chunks and staged entry count"""
+        doc = self.db.vault_rotations.find_one(self._live_rotation(rotation_id, user_id))
+        if not doc:
+            return None
+        return {
+            'id': doc['_id'],
+            'user_id': doc['user_id'],
+            'created_at': doc['created_at'].isoformat(),
+            'expires_at': doc['expires_at'].isoformat(),
+            'chunks': sorted(int(seq) for seq in doc['chunks']),
+            'staged': self.db.vault_rotation_entries.count_documents({'rotation_id': rotation_id})
+        }
+    
+    def stage_rotation_chunk(self, rotation_id: str, user_id: str, seq: int,
+                             entries: List[Dict[str, Any]]) -> int:
+        """Upsert a chunk's entries into the staging collection, then acknowledge it"""
+        if entries:
+            versions = {doc['_id']: doc.get('updated_at') for doc in self.passwords.find(
+                {'_id': {'$in': [entry['id'] for entry in entries]}, 'user_id': user_id}, {'updated_at': 1}
+            )}
+            self.db.vault_rotation_entries.bulk_write([
+                ReplaceOne({'_id': f"{rotation_id}:{entry['id']}"}, {
+                    'rotation_id': rotation_id,
+                    'password_id': entry['id'],
+                    # Commit refuses entries edited after they were staged
+                    'entry_updated_at': versions.get(entry['id']),
+                    **{field: entry.get(field) for field in ROTATED_FIELDS}
+                }, upsert=True)
+                for entry in entries
+            ], ordered=False)
+        # Acknowledged only after its entries are durable, so a resumed client never skips one
+        self.db.vault_rotations.update_one({'_id': rotation_id, 'user_id': user_id},
+                                           {'$set': {f'chunks.{seq}': len(entries)}})
+        return len(entries)
+    
+    def commit_rotation(self, rotation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Swap the staged entries and the new master password in, and drop the
+        history, inside one multi-document transaction (replica sets only)
+        """
+        def swap(session):
+            rotation = self.db.vault_rotations.find_one(self._live_rotation(rotation_id, user_id), session=session)
+            if not rotation:
+                return None
+            
+            current = {doc['_id']: doc.get('updated_at') for doc in
+                       self.passwords.find({'user_id': user_id}, {'updated_at': 1}, session=session)}
+            staged = list(self.db.vault_rotation_entries.find({'rotation_id': rotation_id}, session=session))
+            staged_ids = {doc['password_id'] for doc in staged}
+            if current.keys() != staged_ids:
+                return {'committed': False, 'missing': sorted(current.keys() - staged_ids),
+                        'unexpected': sorted(staged_ids - current.keys()), 'changed': []}
+            changed = sorted(doc['password_id'] for doc in staged
+                             if doc.get('entry_updated_at') != current[doc['password_id']])
+            if changed:
+                return {'committed': False, 'missing': [], 'unexpected': [], 'changed': changed}
+            
+            now = datetime.utcnow()
+            if staged:
+                self.passwords.bulk_write([
+                    UpdateOne({'_id': doc['password_id'], 'user_id': user_id},
+                              {'$set': {'updated_at': now, **{field: doc[field] for field in ROTATED_FIELDS}}})
+                    for doc in staged
+                ], ordered=False, session=session)
+            self.users.update_one({'_id': user_id}, {'$set': {
+                'master_password_hash': rotation['master_password_hash'],
+                'salt': rotation['salt'],
+                'updated_at': now
+            }}, session=session)
+            self._delete_rotations({'_id': rotation_id}, session=session)
+            # History is encrypted under the old master password
+            self.db.password_history.delete_many({'user_id': user_id}, session=session)
+            return {'committed': True, 'updated': len(staged),
+                    'master_password_hash': rotation['master_password_hash'], 'salt': rotation['salt']}
+        
+        with self.client.start_session() as session:
+            result = session.with_transaction(swap)
+        if result and result['committed']:
+            self._mark_write(user_id)
+        return result
+    
+    def delete_rotation(self, rotation_id: str, user_id: str) -> bool:
+        """Abandon a rotation and its staged entries"""
+        return self._delete_rotations({'_id': rotation_id, 'user_id': user_id}) > 0
+    
+    def purge_rotations(self, now: datetime) -> int:
+        """Delete expired rotations and their staged entries"""
+        return self._delete_rotations({'expires_at': {'$lte': now}})
+    
+    def export_user_data(self, user_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Password entries and attachments of a batch of users, keyed 'password_entries' and 'attachments'"""
+        spec = {'user_id': {'$in': user_ids}}
+        return {
+            'password_entries': [self._format_password(doc)
+                                 for doc in self._find_in_order(self.passwords, spec)],
+            'attachments': [self._format_attachment(doc)
+                            for doc in self._find_in_order(self.db.attachments, spec)]
+        }
+    
+    def begin_snapshot(self, token: Optional[str] = None) -> str:
+        """
+        Read at a fixed cluster time with snapshot read concern (replica sets
+        only). The server keeps history for minSnapshotHistoryWindowInSeconds,
+        300 by default, which bounds how long a snapshot stays readable.
+        """
+        if token:
+            seconds, increment = token.split(':')
+            self._snapshot_time = Timestamp(int(seconds), int(increment))
+        else:
+            self._snapshot_time = self.db.command('ping')['operationTime']
+        return f"{self._snapshot_time.time}:{self._snapshot_time.inc}"
+    
+    def end_snapshot(self):
+        self._snapshot_time = None
+    
+    def _find_in_order(self, collection, spec: Dict[str, Any], batch_size: Optional[int] = None):
+        """Documents matching spec in _id order, read at the pinned snapshot time if any"""
+        if self._snapshot_time is None:
+            cursor = collection.find(spec).sort('_id', ASCENDING)
+            return cursor.batch_size(batch_size) if batch_size else cursor
+        command = {
+            'find': collection.name,
+            'filter': spec,
+            'sort': {'_id': 1},
+            'readConcern': {'level': 'snapshot', 'atClusterTime': self._snapshot_time}
+        }
+        if batch_size:
+            command['batchSize'] = batch_size
+        return self.db.cursor_command(command)
+    
+    def bulk_load(self, users: List[Dict[str, Any]], password_entries: List[Dict[str, Any]],
+                  attachments: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        insert_many(ordered=False) per collection, ignoring duplicate keys, so
+        replaying a batch after an interrupted run is a no-op
+        """
+        loaded = {
+            'users': self._insert_new(self.users, [{
+                '_id': user['id'],
+                'username': user['username'],
+                'email': user['email'],
+                'master_password_hash': user['master_password_hash'],
+                'salt': user['salt'],
+                'created_at': parse_timestamp(user.get('created_at')),
+                'updated_at': parse_timestamp(user.get('updated_at'))
+            } for user in users]),
+            'password_entries': self._insert_new(self.passwords,
+                                                 [self._password_document(entry) for entry in password_entries]),
+            'attachments': self._insert_new(self.db.attachments,
+                                            [self._attachment_document(a) for a in attachments])
+        }
+        self._recount_storage({a['user_id'] for a in attachments})
+        self._recount_folders({entry['user_id'] for entry in password_entries if entry.get('folder')})
+        return loaded
+    
+    @staticmethod
+    def _insert_new(collection, documents: List[Dict[str, Any]]) -> int:
+        """Insert documents, skipping those that collide with an existing key"""
+        if not documents:
+            return 0
+        try:
+            return len(collection.insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            details = e.details
+            if details.get('writeConcernErrors') or any(
+                    error['code'] != 11000 for error in details.get('writeErrors', [])):
+                raise
+            return details['nInserted']
+    
+    def import_passwords(self, entries: List[Dict[str, Any]]) -> int:
+        """Upsert password entries as returned by get_passwords, preserving ids and timestamps"""
+        if not entries:
+            return 0
+        
+        # $set rather than a replacement keeps each entry's history counter
+        operations = []
+        for entry in entries:
+            document = self._password_document(entry)
+            operations.append(UpdateOne({'_id': document.pop('_id')}, {'$set': document}, upsert=True))
+        self.passwords.bulk_write(operations, ordered=False)
+        user_ids = {entry['user_id'] for entry in entries}
+        self._recount_folders(user_ids)
+        for user_id in user_ids:
+            self._mark_write(user_id)
+        return len(operations)
+    
+    def _password_document(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Convert a formatted password entry back into a MongoDB document"""
+        return {
+            '_id': entry['id'],
+            'user_id': entry['user_id'],
+            'website_url': entry['website_url'],
+            'website_name': entry.get('website_name'),
+            'username': entry.get('username'),
+            'encrypted_password': entry['encrypted_password'],
+            'iv': entry.get('iv'),
+            'notes': entry.get('notes'),
+            'created_at': parse_timestamp(entry.get('created_at')),
+            'updated_at': parse_timestamp(entry.get('updated_at')),
+            'last_used': parse_timestamp(entry.get('last_used')),
+            'fingerprint': entry.get('fingerprint'),
+            'folder': entry.get('folder'),
+            'tags': sorted(set(entry.get('tags') or []))
+        }
     
     def _format_user(self, user_doc: Dict) -> Dict[str, Any]:
         """Format MongoDB user document to standard format"""
@@ -224,5 +1024,8 @@ class MongoRepository(BaseRepository):
             'notes': pwd_doc.get('notes'),
             'created_at': pwd_doc['created_at'].isoformat() if pwd_doc.get('created_at') else None,
             'updated_at': pwd_doc['updated_at'].isoformat() if pwd_doc.get('updated_at') else None,
-            'last_used': pwd_doc['last_used'].isoformat() if pwd_doc.get('last_used') else None
+            'last_used': pwd_doc['last_used'].isoformat() if pwd_doc.get('last_used') else None,
+            'fingerprint': pwd_doc.get('fingerprint'),
+            'folder': pwd_doc.get('folder'),
+            'tags': pwd_doc.get('tags', [])
         }
@@ -1,60 +1,338 @@
-from typing import Optional, List, Dict, Any
+import io
+import json
+import logging
+import re
+from typing import Optional, List, Dict, Any, Iterator, Tuple, Callable
 from datetime import datetime
 import uuid
 
-from database.base_repository import BaseRepository
-from models.postgres_models import PostgresConnectionManager, User, PasswordEntry
+from sqlalchemy import create_engine, text, func, select, tuple_, bindparam, String, DateTime
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.pool import NullPool
+
+from database.base_repository import (BaseRepository, DuplicateUserError, HISTORY_FIELDS, ROTATED_FIELDS,
+                                      parse_timestamp)
+from database.migrations import pending_migrations, indexes_for, postgres_index_ddl
+from database.replica_router import ReplicaRouter
+from models.postgres_models import (PostgresConnectionManager, User, PasswordEntry, SchemaVersion,
+                                    TokenRevocation, Attachment, PasswordTag, FolderCount,
+                                    VaultRotation, VaultRotationChunk, VaultRotationEntry, PasswordHistory,
+                                    AuditEvent, POOL_SIZE, MAX_OVERFLOW)
+
+logger = logging.getLogger(__name__)
+
+# Columns written by bulk_load, in COPY order; storage_bytes is recomputed
+_COPY_COLUMNS = {
+    'users': ('id', 'username', 'email', 'master_password_hash', 'salt', 'created_at', 'updated_at'),
+    'password_entries': ('id', 'user_id', 'website_url', 'website_name', 'username', 'encrypted_password',
+                         'iv', 'notes', 'created_at', 'updated_at', 'last_used', 'fingerprint', 'folder'),
+    'password_tags': ('password_id', 'tag', 'user_id'),
+    'attachments': ('id', 'user_id', 'password_id', 'filename', 'blob_id', 'size', 'created_at'),
+}
+
+# Read path for entries: Core select() on explicit columns, rows go straight
+# to dicts without ORM objects or the session identity map
+_ENTRY_KEYS = _COPY_COLUMNS['password_entries']
+_ENTRY_COLUMNS = tuple(PasswordEntry.__table__.c[key] for key in _ENTRY_KEYS)
+_ENTRY_TIMESTAMPS = ('created_at', 'updated_at', 'last_used')
+
+# Unique constraint from create_all and the unique index from migration 2
+_EMAIL_CONSTRAINTS = ('users_email_key', 'ux_users_email')
+
+def _duplicate_field(constraint_name: Optional[str]) -> str:
+    """The users column a unique violation was on, by constraint name (not message text)"""
+    return 'email' if constraint_name in _EMAIL_CONSTRAINTS else 'username'
+
+def _entry_dict(row) -> Dict[str, Any]:
+    """Same shape as PasswordEntry.to_dict()"""
+    entry = dict(zip(_ENTRY_KEYS, row))
+    for key in _ENTRY_TIMESTAMPS:
+        if entry[key] is not None:
+            entry[key] = entry[key].isoformat()
+    return entry
+
+# Archive the previous encrypted fields as the entry's next version: one
+# INSERT ... SELECT, the version read from the primary key index
+_ARCHIVE_VERSION = text(f"""
+    INSERT INTO password_history (user_id, password_id, version, {', '.join(HISTORY_FIELDS)}, replaced_at)
+    SELECT :user_id, :password_id, COALESCE(MAX(version), 0) + 1, {', '.join(f':{f}' for f in HISTORY_FIELDS)},
+           :replaced_at
+    FROM password_history WHERE user_id = :user_id AND password_id = :password_id
+""").bindparams(
+    # Typed so asyncpg (the ASGI repository) can cast parameters used in both the SELECT list and WHERE
+    bindparam('user_id', type_=String), bindparam('password_id', type_=String),
+    *(bindparam(field, type_=String) for field in HISTORY_FIELDS), bindparam('replaced_at', type_=DateTime)
+)
+
+# Up to :batch_size entries holding more than :keep versions lose everything
+# older than their newest :keep
+_PRUNE_HISTORY = text("""
+    DELETE FROM password_history h
+    USING (
+        SELECT crowded.user_id, crowded.password_id, cutoff.version
+        FROM (SELECT user_id, password_id FROM password_history
+              GROUP BY user_id, password_id HAVING COUNT(*) > :keep LIMIT :batch_size) crowded
+        CROSS JOIN LATERAL (
+            SELECT version FROM password_history p
+            WHERE p.user_id = crowded.user_id AND p.password_id = crowded.password_id
+            ORDER BY version DESC OFFSET :keep LIMIT 1
+        ) cutoff
+    ) old
+    WHERE h.user_id = old.user_id AND h.password_id = old.password_id AND h.version <= old.version
+""")
+
+# Monthly audit_events partitions, named audit_events_YYYY_MM
+_AUDIT_PARTITION = re.compile(r'^audit_events_(\d{4})_(\d{2})$')
+_NO_PARTITION = '23514'  # check_violation: no partition of relation found for row
+
+def _month_bounds(year: int, month: int) -> Tuple[datetime, datetime]:
+    return datetime(year, month, 1), datetime(year + month // 12, month % 12 + 1, 1)
+
+def _copy_value(value: Any) -> str:
+    """Encode a value for COPY's text format"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
 
 class PostgresRepository(BaseRepository):
     """PostgreSQL implementation of the repository"""
     
-    def __init__(self, database_uri: str):
+    def __init__(self, database_uri: str, replica_uris: Optional[List[str]] = None,
+                 router_options: Optional[Dict[str, Any]] = None):
         self.database_uri = database_uri
+        self.replica_uris = replica_uris or []
+        self.router_options = router_options or {}
         self.manager = None
         self.session = None
+        self.replicas = []
+        self.router = None
+        self._probe_engines = {}
     
     def initialize(self):
         """Initialize PostgreSQL connection"""
         self.manager = PostgresConnectionManager(self.database_uri)
-        self.manager.create_tables()
         self.session = self.manager.get_session()
-        print("✓ PostgreSQL database initialized")
+        
+        if self.replica_uris:
+            self.replicas = [PostgresConnectionManager(uri) for uri in self.replica_uris]
+            # The router probes from a real OS thread; under eventlet the pooled
+            # engines are guarded by green locks, so it gets unpooled ones
+            self._probe_engines = {id(r): create_engine(uri, poolclass=NullPool)
+                                   for r, uri in zip(self.replicas, self.replica_uris)}
+            self._probe_engines['primary'] = create_engine(self.database_uri, poolclass=NullPool)
+            self.router = ReplicaRouter(self.replicas, self._replica_lag, **self.router_options)
+            logger.info(f"PostgreSQL read replicas configured: {len(self.replicas)}")
+        
+        logger.info("PostgreSQL database initialized")
     
     def close(self):
         """Close PostgreSQL connection"""
         if self.session:
             self.session.close()
+        for replica in self.replicas:
+            replica.engine.dispose()
+        for engine in self._probe_engines.values():
+            engine.dispose()
+    
+    def migrate(self, batch_size: int = 1000):
+        """Apply pending migrations in version order"""
+        self.manager.create_tables()
+        current = self.get_schema_version()
+        # End our read transaction; CREATE INDEX CONCURRENTLY waits on open ones
+        self.session.commit()
+        
+        for migration in pending_migrations(current):
+            with self.manager.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                for sql in migration.postgres_sql:
+                    conn.execute(text(sql))
+                for spec in indexes_for(migration, 'postgresql'):
+                    conn.execute(text(postgres_index_ddl(spec)))
+            
+            for backfill in migration.backfills:
+                if backfill.postgres_sql:
+                    self._run_backfill(backfill.postgres_sql, batch_size)
+            
+            self.session.add(SchemaVersion(version=migration.version))
+            self.session.commit()
+            logger.info(f"PostgreSQL migration {migration.version}: {migration.description}")
+    
+    def _run_backfill(self, sql: str, batch_size: int) -> int:
+        """Run a batched UPDATE until it touches no rows, one short transaction per batch"""
+        total = 0
+        while True:
+            with self.manager.engine.begin() as conn:
+                updated = conn.execute(text(sql), {'batch_size': batch_size}).rowcount
+            total += updated
+            if not updated:
+                return total
+    
+    def get_schema_version(self) -> int:
+        """Return the recorded schema version (0 if never migrated)"""
+        try:
+            return self.session.query(func.max(SchemaVersion.version)).scalar() or 0
+        except ProgrammingError:
+            self.session.rollback()
+            return 0
+    
+    def reset_after_fork(self):
+        """Drop connections inherited from a parent process without closing them"""
+        for manager in [self.manager] + self.replicas:
+            if manager:
+                manager.engine.dispose(close=False)
+        self.session = None
     
-    def create_user(self, username: str, email: str, password_hash: str, salt: str) -> Dict[str, Any]:
+    def ping(self):
+        """SELECT 1 on a pooled connection (waits for one if the pool is exhausted)"""
+        with self.manager.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+    
+    def pool_status(self) -> Dict[str, int]:
+        """Checked-out connections against pool_size + max_overflow"""
+        pool = self.manager.engine.pool
+        return {'in_use': pool.checkedout(), 'size': POOL_SIZE + MAX_OVERFLOW}
+    
+    def _replica_lag(self, replica: PostgresConnectionManager) -> float:
+        """
+        0 once the replica has replayed the primary's current WAL position,
+        otherwise seconds since it last replayed a transaction; an idle
+        primary writes no WAL, so it never reads as lag
+        """
+        with self._probe_engines['primary'].connect() as conn:
+            primary_lsn = conn.execute(text("SELECT pg_current_wal_lsn()")).scalar()
+        with self._probe_engines[id(replica)].connect() as conn:
+            caught_up, lag = conn.execute(text(
+                "SELECT COALESCE(pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn), true), "
+                "COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+            ), {'lsn': primary_lsn}).one()
+        return 0.0 if caught_up else float(lag)
+    
+    def _read(self, query: Callable, user_id: Optional[str] = None, retry_miss: bool = False):
+        """
+        Run a read-only query on a replica when one is eligible, falling back
+        to the primary on connection errors (and on a miss if retry_miss)
+        """
+        replica = self.router.choose(user_id) if self.router else None
+        if replica is not None:
+            session = replica.get_session()
+            try:
+                result = query(session)
+                if result is not None or not retry_miss:
+                    return result
+            except OperationalError:
+                self.router.mark_unhealthy(replica)
+            finally:
+                session.close()
+        return query(self.session)
+    
+    def _mark_write(self, user_id: str):
+        if self.router:
+            self.router.mark_write(user_id)
+    
+    def create_user(self, username: str, email: str, password_hash: str, salt: str,
+                    user_id: Optional[str] = None) -> Dict[str, Any]:
         """Create a new user"""
         user = User(
-            id=str(uuid.uuid4()),
+            id=user_id or str(uuid.uuid4()),
             username=username,
             email=email,
             master_password_hash=password_hash,
             salt=salt
         )
         self.session.add(user)
-        self.session.commit()
+        try:
+            self.session.commit()
+        except IntegrityError as e:
+            self.session.rollback()
+            raise DuplicateUserError(_duplicate_field(e.orig.diag.constraint_name))
+        self._mark_write(user.id)
         return user.to_dict()
     
     def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
         """Get user by username"""
-        user = self.session.query(User).filter_by(username=username).first()
-        return user.to_dict() if user else None
+        def query(session):
+            user = session.query(User).filter_by(username=username).first()
+            return user.to_dict() if user else None
+        return self._read(query, retry_miss=True)
     
     def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """Get user by email"""
-        user = self.session.query(User).filter_by(email=email).first()
-        return user.to_dict() if user else None
+        def query(session):
+            user = session.query(User).filter_by(email=email).first()
+            return user.to_dict() if user else None
+        return self._read(query, retry_miss=True)
     
     def get_user_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
-        user = self.session.query(User).filter_by(id=user_id).first()
-        return user.to_dict() if user else None
+        def query(session):
+            user = session.query(User).filter_by(id=user_id).first()
+            return user.to_dict() if user else None
+        return self._read(query, user_id, retry_miss=True)
+    
+    def iter_user_identities(self, batch_size: int = 1000,
+                             since: Optional[datetime] = None) -> Iterator[Tuple[str, str]]:
+        """Stream (username, email) pairs for all users, or those created at or after since"""
+        query = self.session.query(User.username, User.email)
+        if since is not None:
+            query = query.filter(User.created_at >= since)
+        rows = query.yield_per(batch_size)
+        for username, email in rows:
+            yield username, email
+    
+    def iter_users(self, batch_size: int = 1000, start_after: Optional[str] = None,
+                   end_before: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Stream users in id order, optionally only ids strictly between start_after and end_before"""
+        query = self.session.query(User).order_by(User.id)
+        if start_after is not None:
+            query = query.filter(User.id > start_after)
+        if end_before is not None:
+            query = query.filter(User.id < end_before)
+        for user in query.yield_per(batch_size):
+            yield user.to_dict()
+    
+    def delete_user(self, user_id: str) -> bool:
+        """Delete a user and all of their password entries"""
+        self.session.query(Attachment).filter_by(user_id=user_id).delete(synchronize_session=False)
+        self.session.query(PasswordTag).filter_by(user_id=user_id).delete(synchronize_session=False)
+        self.session.query(FolderCount).filter_by(user_id=user_id).delete(synchronize_session=False)
+        self.session.query(VaultRotation).filter_by(user_id=user_id).delete(synchronize_session=False)
+        self.session.query(PasswordHistory).filter_by(user_id=user_id).delete(synchronize_session=False)
+        self.session.query(PasswordEntry).filter_by(user_id=user_id).delete(synchronize_session=False)
+        deleted = self.session.query(User).filter_by(id=user_id).delete(synchronize_session=False)
+        self.session.commit()
+        self._mark_write(user_id)
+        return deleted > 0
+    
+    def set_master_password(self, user_id: str, password_hash: str, salt: str) -> bool:
+        """Replace a user's master password hash and salt"""
+        updated = self.session.query(User).filter_by(id=user_id).update(
+            {User.master_password_hash: password_hash, User.salt: salt, User.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+        self.session.commit()
+        self._mark_write(user_id)
+        return updated > 0
+    
+    def fence_users(self, user_ids: List[str], until: Optional[datetime]) -> int:
+        """Hold writes to users being moved between shards until `until` (None lifts the fence)"""
+        updated = self.session.query(User).filter(User.id.in_(user_ids)).update(
+            {User.moving_until: until}, synchronize_session=False
+        )
+        self.session.commit()
+        return updated
+    
+    def get_user_fence(self, user_id: str) -> Optional[datetime]:
+        """When a user's write fence lapses, or None; always read from the primary"""
+        until = self.session.query(User.moving_until).filter_by(id=user_id).scalar()
+        # End the read transaction so the next check sees the fence lifted
+        self.session.commit()
+        return until
     
     def create_password(self, user_id: str, website_url: str, website_name: str,
-                       username: str, encrypted_password: str, iv: str, notes: str = '') -> Dict[str, Any]:
+                       username: str, encrypted_password: str, iv: str, notes: str = '',
+                       fingerprint: Optional[str] = None, folder: Optional[str] = None,
+                       tags: Optional[List[str]] = None) -> Dict[str, Any]:
         """Create a new password entry"""
         password_entry = PasswordEntry(
             id=str(uuid.uuid4()),
@@ -64,16 +342,91 @@ class PostgresRepository(BaseRepository):
             username=username,
             encrypted_password=encrypted_password,
             iv=iv,
-            notes=notes
+            notes=notes,
+            fingerprint=fingerprint,
+            folder=folder
         )
         self.session.add(password_entry)
+        self.session.flush()
+        tags = self._set_tags(user_id, password_entry.id, tags or [])
+        self._bump_folder(user_id, folder, 1)
         self.session.commit()
-        return password_entry.to_dict()
+        self._mark_write(user_id)
+        return {**password_entry.to_dict(), 'tags': tags}
     
     def get_passwords(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all passwords for a user"""
-        passwords = self.session.query(PasswordEntry).filter_by(user_id=user_id).all()
-        return [pwd.to_dict() for pwd in passwords]
+        stmt = select(*_ENTRY_COLUMNS).where(PasswordEntry.user_id == user_id)
+        
+        def query(session):
+            entries = [_entry_dict(row) for row in session.execute(stmt)]
+            return self._with_tags(session, entries, PasswordTag.user_id == user_id)
+        return self._read(query, user_id)
+    
+    def list_passwords(self, user_id: str, folder: Optional[str] = None, tag: Optional[str] = None,
+                       limit: int = 100, after: Optional[str] = None) -> List[Dict[str, Any]]:
+        """A page of entries in id order, filtered by folder and/or tag; pass the last id as after"""
+        stmt = select(*_ENTRY_COLUMNS).where(PasswordEntry.user_id == user_id)
+        if folder is not None:
+            stmt = stmt.where(PasswordEntry.folder == folder)
+        if tag is not None:
+            stmt = stmt.where(PasswordEntry.id.in_(
+                select(PasswordTag.password_id).where(PasswordTag.user_id == user_id, PasswordTag.tag == tag)
+            ))
+        if after is not None:
+            stmt = stmt.where(PasswordEntry.id > after)
+        stmt = stmt.order_by(PasswordEntry.id).limit(limit)
+        
+        def query(session):
+            entries = [_entry_dict(row) for row in session.execute(stmt)]
+            return self._with_tags(session, entries, PasswordTag.user_id == user_id,
+                                   PasswordTag.password_id.in_([entry['id'] for entry in entries]))
+        return self._read(query, user_id)
+    
+    def get_folder_counts(self, user_id: str) -> Dict[str, int]:
+        """Number of entries in each non-empty folder, from the maintained counters"""
+        stmt = select(FolderCount.folder, FolderCount.entries).where(
+            FolderCount.user_id == user_id, FolderCount.entries > 0
+        ).order_by(FolderCount.folder)
+        return self._read(lambda session: {folder: n for folder, n in session.execute(stmt)}, user_id)
+    
+    @staticmethod
+    def _with_tags(session, entries: List[Dict[str, Any]], *condition) -> List[Dict[str, Any]]:
+        """Add each entry's sorted tag list, fetched with one query over password_tags"""
+        tags: Dict[str, List[str]] = {}
+        if entries:
+            rows = session.execute(select(PasswordTag.password_id, PasswordTag.tag)
+                                   .where(*condition).order_by(PasswordTag.tag))
+            for password_id, tag in rows:
+                tags.setdefault(password_id, []).append(tag)
+        for entry in entries:
+            entry['tags'] = tags.get(entry['id'], [])
+        return entries
+    
+    def _set_tags(self, user_id: str, password_id: str, tags: List[str]) -> List[str]:
+        """Replace an entry's tag rows (within the current transaction)"""
+        tags = sorted(set(tags))
+        self.session.query(PasswordTag).filter_by(password_id=password_id).delete(synchronize_session=False)
+        self.session.add_all(PasswordTag(password_id=password_id, tag=tag, user_id=user_id) for tag in tags)
+        return tags
+    
+    def _bump_folder(self, user_id: str, folder: Optional[str], delta: int):
+        """Adjust a folder's entry counter (within the current transaction)"""
+        if not folder:
+            return
+        stmt = insert(FolderCount.__table__).values(user_id=user_id, folder=folder, entries=delta)
+        self.session.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id', 'folder'],
+            set_={'entries': FolderCount.entries + delta}
+        ))
+    
+    def _recount_folders(self, user_ids: List[str]):
+        """Rebuild folder counters from the entries, after bulk writes"""
+        self.session.query(FolderCount).filter(FolderCount.user_id.in_(user_ids)).delete(synchronize_session=False)
+        counts = select(PasswordEntry.user_id, PasswordEntry.folder, func.count()).where(
+            PasswordEntry.user_id.in_(user_ids), PasswordEntry.folder.isnot(None)
+        ).group_by(PasswordEntry.user_id, PasswordEntry.folder)
+        self.session.execute(insert(FolderCount.__table__).from_select(['user_id', 'folder', 'entries'], counts))
     
     def get_password_by_id(self, password_id: str, user_id: str) -> Optional[Dict[str, Any]]:
         """Get a specific password entry"""
@@ -83,27 +436,46 @@ class PostgresRepository(BaseRepository):
         ).first()
         
         if password:
-            password.last_used = datetime.utcnow()
+            # updated_at set to itself, so its onupdate default does not count a read as an edit
+            entries = PasswordEntry.__table__
+            self.session.execute(
+                entries.update()
+                .where(entries.c.id == password_id, entries.c.user_id == user_id)
+                .values(last_used=datetime.utcnow(), updated_at=entries.c.updated_at)
+            )
             self.session.commit()
-            return password.to_dict()
+            return self._with_tags(self.session, [password.to_dict()], PasswordTag.password_id == password_id)[0]
         return None
     
     def update_password(self, password_id: str, user_id: str, data: Dict[str, Any]) -> bool:
-        """Update a password entry"""
+        """Update a password entry, archiving changed encrypted fields to its history"""
+        # The row lock serializes updates, so each archived version number is taken once
         password = self.session.query(PasswordEntry).filter_by(
             id=password_id,
             user_id=user_id
-        ).first()
+        ).with_for_update().first()
         
         if not password:
             return False
         
+        previous = {field: getattr(password, field) for field in HISTORY_FIELDS}
+        if any(field in data and data[field] != previous[field] for field in HISTORY_FIELDS):
+            self.session.execute(_ARCHIVE_VERSION, {'user_id': user_id, 'password_id': password_id,
+                                                    'replaced_at': datetime.utcnow(), **previous})
+        
+        previous_folder = password.folder
         for key, value in data.items():
-            if hasattr(password, key):
+            if key != 'tags' and hasattr(password, key):
                 setattr(password, key, value)
         
+        if password.folder != previous_folder:
+            self._bump_folder(user_id, previous_folder, -1)
+            self._bump_folder(user_id, password.folder, 1)
+        if 'tags' in data:
+            self._set_tags(user_id, password_id, data['tags'] or [])
         password.updated_at = datetime.utcnow()
         self.session.commit()
+        self._mark_write(user_id)
         return True
     
     def delete_password(self, password_id: str, user_id: str) -> bool:
@@ -116,18 +488,532 @@ class PostgresRepository(BaseRepository):
         if not password:
             return False
         
+        self._bump_folder(user_id, password.folder, -1)
         self.session.delete(password)
         self.session.commit()
+        self._mark_write(user_id)
         return True
     
     def search_passwords(self, user_id: str, query: str) -> List[Dict[str, Any]]:
         """Search passwords by URL"""
-        passwords = self.session.query(PasswordEntry).filter(
+        stmt = select(*_ENTRY_COLUMNS).where(
             PasswordEntry.user_id == user_id,
             PasswordEntry.website_url.ilike(f'%{query}%')
-        ).all()
-        return [pwd.to_dict() for pwd in passwords]
+        )
+        
+        def run(session):
+            entries = [_entry_dict(row) for row in session.execute(stmt)]
+            return self._with_tags(session, entries, PasswordTag.user_id == user_id,
+                                   PasswordTag.password_id.in_([entry['id'] for entry in entries]))
+        return self._read(run, user_id)
     
     def get_password_count(self, user_id: str) -> int:
         """Get count of password entries for a user"""
-        return self.session.query(PasswordEntry).filter_by(user_id=user_id).count()
+        return self._read(
+            lambda session: session.query(PasswordEntry).filter_by(user_id=user_id).count(),
+            user_id
+        )
+    
+    def get_password_health(self, user_id: str, stale_before: datetime) -> Dict[str, Any]:
+        """Reused fingerprints and stale entries for a user"""
+        def query(session):
+            reused = session.query(PasswordEntry.fingerprint, func.array_agg(PasswordEntry.id)).filter(
+                PasswordEntry.user_id == user_id,
+                PasswordEntry.fingerprint.isnot(None)
+            ).group_by(PasswordEntry.fingerprint).having(func.count() > 1).all()
+            stale = session.query(
+                PasswordEntry.id, PasswordEntry.website_name, PasswordEntry.updated_at, PasswordEntry.last_used
+            ).filter(
+                PasswordEntry.user_id == user_id,
+                PasswordEntry.updated_at < stale_before
+            ).order_by(PasswordEntry.updated_at).all()
+            return {
+                'reused': [{'fingerprint': fp, 'password_ids': sorted(ids)} for fp, ids in reused],
+                'stale': [{
+                    'id': row.id,
+                    'website_name': row.website_name,
+                    'updated_at': row.updated_at.isoformat() if row.updated_at else None,
+                    'last_used': row.last_used.isoformat() if row.last_used else None
+                } for row in stale]
+            }
+        return self._read(query, user_id)
+    
+    def create_attachment(self, user_id: str, password_id: str, filename: str,
+                          blob_id: str, size: int) -> Optional[Dict[str, Any]]:
+        """Attach a stored blob to a password entry and add its size to the user's total"""
+        owned = self.session.query(PasswordEntry.id).filter_by(id=password_id, user_id=user_id).first()
+        if not owned:
+            self.session.rollback()
+            return None
+        
+        attachment = Attachment(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            password_id=password_id,
+            filename=filename,
+            blob_id=blob_id,
+            size=size
+        )
+        self.session.add(attachment)
+        self.session.query(User).filter_by(id=user_id).update(
+            {User.storage_bytes: User.storage_bytes + size}, synchronize_session=False
+        )
+        self.session.commit()
+        self._mark_write(user_id)
+        return attachment.to_dict()
+    
+    def get_attachments(self, password_id: str, user_id: str) -> List[Dict[str, Any]]:
+        """Attachments of a password entry"""
+        def query(session):
+            rows = session.query(Attachment).filter_by(user_id=user_id, password_id=password_id)
+            return [row.to_dict() for row in rows.order_by(Attachment.created_at)]
+        return self._read(query, user_id)
+    
+    def get_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a specific attachment"""
+        attachment = self.session.query(Attachment).filter_by(id=attachment_id, user_id=user_id).first()
+        return attachment.to_dict() if attachment else None
+    
+    def delete_attachment(self, attachment_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """Delete an attachment and subtract its size from the user's total"""
+        attachment = self.session.query(Attachment).filter_by(id=attachment_id, user_id=user_id).first()
+        if not attachment:
+            return None
+        
+        deleted = attachment.to_dict()
+        self.session.delete(attachment)
+        self.session.query(User).filter_by(id=user_id).update(
+            {User.storage_bytes: User.storage_bytes - attachment.size}, synchronize_session=False
+        )
+        self.session.commit()
+        self._mark_write(user_id)
+        return deleted
+    
+    def count_blob_references(self, blob_id: str) -> int:
+        """Number of attachments pointing at a blob"""
+        return self.session.query(Attachment).filter_by(blob_id=blob_id).count()
+    
+    def get_storage_usage(self, user_id: str) -> int:
+        """Attachment bytes stored by a user"""
+        return self.session.query(User.storage_bytes).filter_by(id=user_id).scalar() or 0
+    
+    def get_user_attachments(self, user_id: str) -> List[Dict[str, Any]]:
+        """All attachments of a user"""
+        return [row.to_dict() for row in self.session.query(Attachment).filter_by(user_id=user_id)]
+    
+    def import_attachments(self, attachments: List[Dict[str, Any]]) -> int:
+        """Upsert attachments and recount the owners' storage totals"""
+        if not attachments:
+            return 0
+        
+        rows = [{
+            'id': a['id'],
+            'user_id': a['user_id'],
+            'password_id': a['password_id'],
+            'filename': a['filename'],
+            'blob_id': a['blob_id'],
+            'size': a['size'],
+            'created_at': parse_timestamp(a.get('created_at'))
+        } for a in attachments]
+        stmt = insert(Attachment.__table__).values(rows)
+        stmt = stmt.on_conflict_do_nothing(index_elements=['id'])
+        self.session.execute(stmt)
+        
+        for user_id in {row['user_id'] for row in rows}:
+            total = self.session.query(func.coalesce(func.sum(Attachment.size), 0)).filter_by(user_id=user_id)
+            self.session.query(User).filter_by(id=user_id).update(
+                {User.storage_bytes: total.scalar_subquery()}, synchronize_session=False
+            )
+            self._mark_write(user_id)
+        self.session.commit()
+        return len(rows)
+    
+    def revoke_token(self, key: str, user_id: str, revoked_at: datetime, expires_at: datetime):
+        """Record a revocation (a token jti or "user:<id>"); idempotent"""
+        stmt = insert(TokenRevocation.__table__).values(
+            key=key, user_id=user_id, revoked_at=revoked_at, expires_at=expires_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['key'],
+            set_={'revoked_at': stmt.excluded.revoked_at, 'expires_at': stmt.excluded.expires_at}
+        )
+        self.session.execute(stmt)
+        self.session.commit()
+    
+    def get_token_revocations(self, since: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Unexpired revocations, optionally only those recorded after since"""
+        query = self.session.query(TokenRevocation).filter(TokenRevocation.expires_at > datetime.utcnow())
+        if since is not None:
+            query = query.filter(TokenRevocation.revoked_at > since)
+        revocations = [row.to_dict() for row in query]
+        # End the read transaction so the next poll sees newly committed rows
+        self.session.commit()
+        return revocations
+    
+    def purge_token_revocations(self, now: datetime) -> int:
+        """Delete revocations whose tokens have expired"""
+        removed = self.session.query(TokenRevocation).filter(TokenRevocation.expires_at <= now).delete()
+        self.session.commit()
+        return removed
+    
+    def get_password_history(self, password_id: str, user_id: str, limit: int = 20,
+                             before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Previous versions of an entry, newest first, paged by version"""
+        def query(session):
+            versions = session.query(PasswordHistory).filter_by(user_id=user_id, password_id=password_id)
+            if before is not None:
+                versions = versions.filter(PasswordHistory.version < before)
+            return [version.to_dict() for version in
+                    versions.order_by(PasswordHistory.version.desc()).limit(limit)]
+        return self._read(query, user_id)
+    
+    def export_password_history(self, user_ids: List[str]) -> List[Dict[str, Any]]:
+        """Every stored version of a batch of users' entries, with user_id, for import_password_history"""
+        versions = self.session.query(PasswordHistory).filter(PasswordHistory.user_id.in_(user_ids))
+        return [{'user_id': version.user_id, **version.to_dict()}
+                for version in versions.order_by(PasswordHistory.user_id, PasswordHistory.password_id,
+                                                 PasswordHistory.version)]
+    
+    def import_password_history(self, versions: List[Dict[str, Any]]) -> int:
+        """Insert exported versions, skipping ones already present; returns the number inserted"""
+        if not versions:
+            return 0
+        stmt = insert(PasswordHistory.__table__).values([{
+            'user_id': version['user_id'],
+            'password_id': version['password_id'],
+            'version': version['version'],
+            **{field: version.get(field) for field in HISTORY_FIELDS},
+            'replaced_at': parse_timestamp(version['replaced_at'])
+        } for version in versions])
+        inserted = self.session.execute(stmt.on_conflict_do_nothing()).rowcount
+        self.session.commit()
+        return inserted
+    
+    def prune_password_history(self, keep: int, batch_size: int = 500) -> int:
+        """Trim entries over the limit, batch_size entries per transaction"""
+        removed = 0
+        while True:
+            deleted = self.session.execute(_PRUNE_HISTORY, {'keep': keep, 'batch_size': batch_size}).rowcount
+            self.session.commit()
+            if not deleted:
+                return removed
+            removed += deleted
+    
+    def _create_audit_partitions(self, months):
+        """Create the monthly partitions for the given (year, month)s if they are missing"""
+        with self.manager.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for year, month in sorted(months):
+                start, end = _month_bounds(year, month)
+                try:
+                    conn.execute(text(f"CREATE TABLE IF NOT EXISTS audit_events_{year}_{month:02d} "
+                                      f"PARTITION OF audit_events FOR VALUES FROM ('{start}') TO ('{end}')"))
+                except (IntegrityError, ProgrammingError):
+                    # Another worker created it between the check and the insert into pg_class
+                    pass
+    
+    def insert_audit_events(self, events: List[Dict[str, Any]]) -> int:
+        """One multi-row INSERT ... ON CONFLICT DO NOTHING; a missing month's partition is created on demand"""
+        if not events:
+            return 0
+        stmt = insert(AuditEvent.__table__).values([{
+            'ts': event['ts'],
+            'id': event['id'],
+            'event': event['event'],
+            'user_id': event['user_id'],
+            'ip': event['ip'],
+            'request_id': event['request_id'],
+            'details': json.dumps(event['details'], default=str)
+        } for event in events]).on_conflict_do_nothing()
+        try:
+            inserted = self.session.execute(stmt).rowcount
+        except IntegrityError as e:
+            self.session.rollback()
+            if getattr(e.orig, 'pgcode', None) != _NO_PARTITION:
+                raise
+            self._create_audit_partitions({(event['ts'].year, event['ts'].month) for event in events})
+            inserted = self.session.execute(stmt).rowcount
+        self.session.commit()
+        return inserted
+    
+    def get_audit_events(self, user_id: str, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                         event: Optional[str] = None, limit: int = 100,
+                         before: Optional[Tuple[datetime, str]] = None) -> List[Dict[str, Any]]:
+        """A user's events newest first; the ts bounds also prune partitions"""
+        def query(session):
+            events = session.query(AuditEvent).filter(AuditEvent.user_id == user_id)
+            if since is not None:
+                events = events.filter(AuditEvent.ts >= since)
+            if until is not None:
+                events = events.filter(AuditEvent.ts < until)
+            if event is not None:
+                events = events.filter(AuditEvent.event == event)
+            if before is not None:
+                events = events.filter(tuple_(AuditEvent.ts, AuditEvent.id) < tuple_(*before))
+            return [audit.to_dict() for audit in
+                    events.order_by(AuditEvent.ts.desc(), AuditEvent.id.desc()).limit(limit)]
+        return self._read(query, user_id)
+    
+    def purge_audit_events(self, before: datetime) -> int:
+        """
+        Drop monthly partitions that end before the cutoff, and create this
+        and next month's ahead of the first insert into them
+        """
+        now = datetime.utcnow()
+        self._create_audit_partitions({(now.year, now.month), (now.year + now.month // 12, now.month % 12 + 1)})
+        partitions = self.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'audit_events'::regclass"
+        )).scalars().all()
+        self.session.commit()
+        
+        dropped = 0
+        with self.manager.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for name in partitions:
+                match = _AUDIT_PARTITION.match(name)
+                if match and _month_bounds(int(match[1]), int(match[2]))[1] <= before:
+                    conn.execute(text(f'DROP TABLE IF EXISTS {name}'))
+                    dropped += 1
+        return dropped
+    
+    def create_rotation(self, rotation_id: str, user_id: str, password_hash: str, salt: str,
+                        expires_at: datetime):
+        """Open a rotation, discarding any the user already had (staged rows cascade)"""
+        self.session.query(VaultRotation).filter_by(user_id=user_id).delete(synchronize_session=False)
+        self.session.add(VaultRotation(id=rotation_id, user_id=user_id, master_password_hash=password_hash,
+                                       salt=salt, expires_at=expires_at))
+        self.session.commit()
+    
+    def _live_rotation(self, rotation_id: str, user_id: str):
+        return self.session.query(VaultRotation).filter(
+            VaultRotation.id == rotation_id,
+            VaultRotation.user_id == user_id,
+            VaultRotation.expires_at > datetime.utcnow()
+        )
+    
+    def get_rotation(self, rotation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """An unexpired rotation with its acknowledged chunks and staged entry count"""
+        rotation = self._live_rotation(rotation_id, user_id).first()
+        if not rotation:
+            return None
+        chunks = [seq for (seq,) in self.session.query(VaultRotationChunk.seq)
+                  .filter_by(rotation_id=rotation_id).order_by(VaultRotationChunk.seq)]
+        staged = self.session.query(func.count(VaultRotationEntry.password_id)).filter_by(
+            rotation_id=rotation_id
+        ).scalar()
+        return {**rotation.to_dict(), 'chunks': chunks, 'staged': staged}
+    
+    def stage_rotation_chunk(self, rotation_id: str, user_id: str, seq: int,
+                             entries: List[Dict[str, Any]]) -> int:
+        """Upsert a chunk's entries into the staging table and acknowledge it, in one transaction"""
+        if entries:
+            versions = dict(self.session.query(PasswordEntry.id, PasswordEntry.updated_at).filter(
+                PasswordEntry.user_id == user_id,
+                PasswordEntry.id.in_([entry['id'] for entry in entries])
+            ))
+            stmt = insert(VaultRotationEntry.__table__).values([
+                {'rotation_id': rotation_id, 'password_id': entry['id'],
+                 'entry_updated_at': versions.get(entry['id']),
+                 **{field: entry.get(field) for field in ROTATED_FIELDS}}
+                for entry in entries
+            ])
+            self.session.execute(stmt.on_conflict_do_update(
+                index_elements=['rotation_id', 'password_id'],
+                set_={field: stmt.excluded[field] for field in (*ROTATED_FIELDS, 'entry_updated_at')}
+            ))
+        stmt = insert(VaultRotationChunk.__table__).values(rotation_id=rotation_id, seq=seq, entries=len(entries))
+        self.session.execute(stmt.on_conflict_do_update(
+            index_elements=['rotation_id', 'seq'],
+            set_={'entries': stmt.excluded.entries}
+        ))
+        self.session.commit()
+        return len(entries)
+    
+    def commit_rotation(self, rotation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        One transaction: lock the rotation and the user's entries, check the
+        staged ids cover exactly those entries and none was edited after it
+        was staged, then UPDATE ... FROM the staging table, set the new
+        master password and drop the history
+        """
+        rotation = self._live_rotation(rotation_id, user_id).with_for_update().first()
+        if not rotation:
+            self.session.rollback()
+            return None
+        
+        current = {pid for (pid,) in self.session.query(PasswordEntry.id)
+                   .filter_by(user_id=user_id).with_for_update()}
+        staged = {pid for (pid,) in self.session.query(VaultRotationEntry.password_id)
+                  .filter_by(rotation_id=rotation_id)}
+        if current != staged:
+            self.session.rollback()
+            return {'committed': False, 'missing': sorted(current - staged),
+                    'unexpected': sorted(staged - current), 'changed': []}
+        
+        entries, staging = PasswordEntry.__table__, VaultRotationEntry.__table__
+        changed = [pid for (pid,) in self.session.execute(
+            select(entries.c.id)
+            .where(entries.c.id == staging.c.password_id,
+                   staging.c.rotation_id == rotation_id,
+                   entries.c.user_id == user_id,
+                   entries.c.updated_at.is_distinct_from(staging.c.entry_updated_at))
+            .order_by(entries.c.id)
+        )]
+        if changed:
+            self.session.rollback()
+            return {'committed': False, 'missing': [], 'unexpected': [], 'changed': changed}
+        
+        now = datetime.utcnow()
+        self.session.execute(
+            entries.update()
+            .where(entries.c.id == staging.c.password_id,
+                   staging.c.rotation_id == rotation_id,
+                   entries.c.user_id == user_id)
+            .values(updated_at=now, **{field: staging.c[field] for field in ROTATED_FIELDS})
+        )
+        credentials = {'master_password_hash': rotation.master_password_hash, 'salt': rotation.salt}
+        self.session.query(User).filter_by(id=user_id).update(
+            {User.master_password_hash: rotation.master_password_hash, User.salt: rotation.salt,
+             User.updated_at: now},
+            synchronize_session=False
+        )
+        self.session.query(VaultRotation).filter_by(id=rotation_id).delete(synchronize_session=False)
+        # History is encrypted under the old master password
+        self.session.query(PasswordHistory).filter_by(user_id=user_id).delete(synchronize_session=False)
+        self.session.commit()
+        self._mark_write(user_id)
+        return {'committed': True, 'updated': len(current), **credentials}
+    
+    def delete_rotation(self, rotation_id: str, user_id: str) -> bool:
+        """Abandon a rotation and its staged entries"""
+        deleted = self.session.query(VaultRotation).filter_by(
+            id=rotation_id, user_id=user_id
+        ).delete(synchronize_session=False)
+        self.session.commit()
+        return deleted > 0
+    
+    def purge_rotations(self, now: datetime) -> int:
+        """Delete expired rotations; chunks and staged entries go with them"""
+        removed = self.session.query(VaultRotation).filter(
+            VaultRotation.expires_at <= now
+        ).delete(synchronize_session=False)
+        self.session.commit()
+        return removed
+    
+    def export_user_data(self, user_ids: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Password entries and attachments of a batch of users, keyed 'password_entries' and 'attachments'"""
+        entries = select(*_ENTRY_COLUMNS).where(PasswordEntry.user_id.in_(user_ids)).order_by(PasswordEntry.id)
+        attachments = self.session.query(Attachment).filter(Attachment.user_id.in_(user_ids))
+        return {
+            'password_entries': self._with_tags(self.session,
+                                                [_entry_dict(row) for row in self.session.execute(entries)],
+                                                PasswordTag.user_id.in_(user_ids)),
+            'attachments': [attachment.to_dict() for attachment in attachments.order_by(Attachment.id)]
+        }
+    
+    def bulk_load(self, users: List[Dict[str, Any]], password_entries: List[Dict[str, Any]],
+                  attachments: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        COPY each table's rows into a temporary staging table, then insert the
+        ones not already present, all in one transaction. Replaying a batch
+        after an interrupted run is therefore a no-op.
+        """
+        connection = self.manager.engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            loaded = {
+                table: self._copy_new_rows(cursor, table, rows)
+                for table, rows in (('users', users), ('password_entries', password_entries),
+                                    ('attachments', attachments))
+            }
+            self._copy_new_rows(cursor, 'password_tags', [
+                {'password_id': entry['id'], 'tag': tag, 'user_id': entry['user_id']}
+                for entry in password_entries for tag in entry.get('tags') or []
+            ])
+            foldered = sorted({entry['user_id'] for entry in password_entries if entry.get('folder')})
+            if foldered:
+                cursor.execute("DELETE FROM folder_counts WHERE user_id = ANY(%s)", (foldered,))
+                cursor.execute(
+                    "INSERT INTO folder_counts (user_id, folder, entries) SELECT user_id, folder, COUNT(*) "
+                    "FROM password_entries WHERE user_id = ANY(%s) AND folder IS NOT NULL "
+                    "GROUP BY user_id, folder",
+                    (foldered,)
+                )
+            if attachments:
+                cursor.execute(
+                    "UPDATE users SET storage_bytes = (SELECT COALESCE(SUM(size), 0) FROM attachments "
+                    "WHERE attachments.user_id = users.id) WHERE id = ANY(%s)",
+                    (sorted({a['user_id'] for a in attachments}),)
+                )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        return loaded
+    
+    def begin_snapshot(self, token: Optional[str] = None) -> str:
+        """Open a read-only REPEATABLE READ transaction, exporting or importing its snapshot"""
+        self.session.rollback()
+        self.session.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"))
+        if token:
+            self.session.execute(text("SET TRANSACTION SNAPSHOT :token"), {'token': token})
+            return token
+        return self.session.execute(text("SELECT pg_export_snapshot()")).scalar()
+    
+    def end_snapshot(self):
+        self.session.rollback()
+    
+    @staticmethod
+    def _copy_new_rows(cursor, table: str, rows: List[Dict[str, Any]]) -> int:
+        if not rows:
+            return 0
+        columns = _COPY_COLUMNS[table]
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_value(row.get(column)) for column in columns) + '\n')
+        buffer.seek(0)
+        
+        column_list = ', '.join(columns)
+        cursor.execute(f"CREATE TEMP TABLE staging_{table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor.copy_expert(f"COPY staging_{table} ({column_list}) FROM STDIN", buffer)
+        cursor.execute(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM staging_{table} "
+                       f"ON CONFLICT DO NOTHING")
+        return cursor.rowcount
+    
+    def import_passwords(self, entries: List[Dict[str, Any]]) -> int:
+        """Upsert password entries as returned by get_passwords, preserving ids and timestamps"""
+        if not entries:
+            return 0
+        
+        rows = [{
+            'id': entry['id'],
+            'user_id': entry['user_id'],
+            'website_url': entry['website_url'],
+            'website_name': entry.get('website_name'),
+            'username': entry.get('username'),
+            'encrypted_password': entry['encrypted_password'],
+            'iv': entry.get('iv'),
+            'notes': entry.get('notes'),
+            'created_at': parse_timestamp(entry.get('created_at')),
+            'updated_at': parse_timestamp(entry.get('updated_at')),
+            'last_used': parse_timestamp(entry.get('last_used')),
+            'fingerprint': entry.get('fingerprint'),
+            'folder': entry.get('folder')
+        } for entry in entries]
+        
+        stmt = insert(PasswordEntry.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['id'],
+            set_={col: stmt.excluded[col] for col in rows[0] if col != 'id'}
+        )
+        self.session.execute(stmt)
+        for entry in entries:
+            if 'tags' in entry:
+                self._set_tags(entry['user_id'], entry['id'], entry['tags'] or [])
+        user_ids = sorted({row['user_id'] for row in rows})
+        self._recount_folders(user_ids)
+        self.session.commit()
+        for user_id in user_ids:
+            self._mark_write(user_id)
+        return len(rows)
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""
+Query plan inspection used by tests to catch queries that fall back to
+sequential (Postgres) or collection (MongoDB) scans
+"""
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+from sqlalchemy import event
+
+
+@contextmanager
+def capture_statements(engine):
+    """Collect (statement, parameters) for every cursor execution on an engine"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _walk_plan(node: Dict[str, Any], children_key: str):
+    yield node
+    for child in node.get(children_key, []):
+        yield from _walk_plan(child, children_key)
+
+
+def postgres_seq_scans(engine, statement: str, parameters=None) -> List[str]:
+    """
+    EXPLAIN a statement with sequential scans discouraged and return the
+    tables that are still scanned sequentially (i.e. no usable index exists)
+    """
+    with engine.begin() as conn:
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters or {}).scalar()
+    return [node['Relation Name'] for node in _walk_plan(plan[0]['Plan'], 'Plans')
+            if node['Node Type'] == 'Seq Scan']
+
+
+def mongo_collection_scans(collection, query: Dict[str, Any]) -> bool:
+    """Return True if the winning plan for a find() includes a COLLSCAN stage"""
+    winning_plan = collection.find(query).explain()['queryPlanner']['winningPlan']
+    stages = [winning_plan]
+    while stages:
+        stage = stages.pop()
+        if stage.get('stage') == 'COLLSCAN':
+            return True
+        if 'queryPlan' in stage:
+            stages.append(stage['queryPlan'])
+        if 'inputStage' in stage:
+            stages.append(stage['inputStage'])
+        stages.extend(stage.get('inputStages', []))
+    return False
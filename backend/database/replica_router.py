@@ -0,0 +1,136 @@
+from typing import Any, Callable, Dict, List, Optional
+import itertools
+import logging
+import time
+
+from structured_logging import _real_thread_primitives
+
+logger = logging.getLogger(__name__)
+
+
+class RedisWriteLog:
+    """Recent writers shared by all workers, as keys that expire after the window"""
+
+    def __init__(self, url: str, window: float, prefix: str = 'recent-write:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.window_ms = max(int(window * 1000), 1)
+        self.prefix = prefix
+
+    def mark(self, user_id: str):
+        self.client.set(self.prefix + user_id, 1, px=self.window_ms)
+
+    def recent(self, user_id: str) -> bool:
+        return bool(self.client.exists(self.prefix + user_id))
+
+
+def create_write_log(storage_uri: Optional[str], window: float) -> Optional[RedisWriteLog]:
+    """None (per-process only) for memory:// or unset, redis://... to share across workers"""
+    if not storage_uri or storage_uri.startswith('memory://'):
+        return None
+    return RedisWriteLog(storage_uri, window)
+
+
+class ReplicaRouter:
+    """
+    Chooses a read replica for read-only repository calls.
+
+    Replicas are probed at most once per check interval, in a background
+    OS thread that choose() starts when the last probe is stale, so a slow
+    or hung replica never holds up a request (nor, under eventlet, the hub); until the first probe finishes
+    every read goes to the primary. A replica is eligible while its probe
+    succeeds and its reported lag is within max_lag seconds. Users who
+    wrote within the read-your-writes window are always sent to the primary
+    (choose() returns None). Writes are remembered per process, and also
+    in Redis when writes_storage_uri is set so that every worker sees them;
+    without it a read served by another worker can still land on a replica
+    and trail the write by up to max_lag. If Redis is unreachable, reads
+    go to the primary.
+
+    The probe runs outside the request greenlets, so it must not share
+    connection pools with them.
+    """
+
+    def __init__(self, replicas: List[Any], probe: Callable[[Any], float],
+                 max_lag: float = 5.0, read_your_writes_window: float = 5.0,
+                 check_interval: float = 10.0, writes_storage_uri: Optional[str] = None):
+        self.replicas = list(replicas)
+        self.probe = probe
+        self.max_lag = max_lag
+        self.read_your_writes_window = read_your_writes_window
+        self.check_interval = check_interval
+        self._healthy = {id(r): False for r in self.replicas}
+        self._last_check = 0.0
+        self._checking = _real_thread_primitives()[0].Lock()
+        self._recent_writes: Dict[str, float] = {}
+        self._shared_writes = create_write_log(writes_storage_uri, read_your_writes_window)
+        self._cycle = itertools.count()
+
+    def mark_write(self, user_id: Optional[str]):
+        """Pin a user to the primary for the read-your-writes window"""
+        if not user_id:
+            return
+        now = time.monotonic()
+        self._recent_writes[user_id] = now
+        if len(self._recent_writes) > 10000:
+            cutoff = now - self.read_your_writes_window
+            self._recent_writes = {u: t for u, t in self._recent_writes.items() if t >= cutoff}
+        if self._shared_writes is not None:
+            try:
+                self._shared_writes.mark(user_id)
+            except Exception:
+                logger.warning("Could not record write for read-your-writes", exc_info=True)
+
+    def mark_unhealthy(self, replica: Any):
+        """Take a replica out of rotation until the next health check"""
+        self._healthy[id(replica)] = False
+
+    def check_health(self):
+        """Probe every replica and record whether it is usable"""
+        for replica in self.replicas:
+            try:
+                self._healthy[id(replica)] = self.probe(replica) <= self.max_lag
+            except Exception:
+                self._healthy[id(replica)] = False
+        self._last_check = time.monotonic()
+
+    def _refresh(self):
+        """Probe in a background thread unless a probe is already running"""
+        if not self._checking.acquire(blocking=False):
+            return
+
+        def check():
+            try:
+                self.check_health()
+            finally:
+                self._checking.release()
+
+        real_threading, _ = _real_thread_primitives()
+        real_threading.Thread(target=check, name='replica-health', daemon=True).start()
+
+    def choose(self, user_id: Optional[str] = None) -> Optional[Any]:
+        """Return a healthy replica, or None to read from the primary"""
+        if not self.replicas:
+            return None
+
+        now = time.monotonic()
+        if user_id:
+            wrote_at = self._recent_writes.get(user_id)
+            if wrote_at is not None:
+                if now - wrote_at < self.read_your_writes_window:
+                    return None
+                del self._recent_writes[user_id]
+            if self._shared_writes is not None:
+                try:
+                    if self._shared_writes.recent(user_id):
+                        return None
+                except Exception:
+                    return None
+
+        if now - self._last_check >= self.check_interval:
+            self._refresh()
+
+        healthy = [r for r in self.replicas if self._healthy[id(r)]]
+        if not healthy:
+            return None
+        return healthy[next(self._cycle) % len(healthy)]
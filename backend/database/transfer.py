@@ -0,0 +1,224 @@
+"""
+Streaming copy of users, password entries, attachment metadata and password
+history between two repositories, e.g. from PostgreSQL to MongoDB
+
+The user id space is split into ranges by leading hex digits, and the ranges
+are copied by parallel workers that each open their own connections. A
+worker streams its users through a batched cursor, fetches each batch's
+entries and attachments in one query per table, and hands them to the
+target's bulk_load (COPY on PostgreSQL, unordered insert_many on MongoDB),
+then copies the batch's password history.
+The last user id copied in each range is checkpointed after every batch, so
+an interrupted run resumes where it stopped; replayed rows are skipped.
+
+Attachment blobs are not copied: both sides must use the same blob store.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database.base_repository import BaseRepository, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+KeyRange = Tuple[Optional[str], Optional[str]]
+RepositoryFactory = Callable[[], BaseRepository]
+
+TABLES = ('users', 'password_entries', 'attachments', 'password_history')
+_TIMESTAMP_FIELDS = ('created_at', 'updated_at', 'last_used', 'replaced_at')
+
+
+def key_ranges(partitions: int) -> List[KeyRange]:
+    """Split the id space into contiguous (start_after, end_before) ranges on leading hex digits"""
+    partitions = max(1, min(partitions, 256))
+    bounds = [format(i * 256 // partitions, '02x') for i in range(1, partitions)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def range_key(key_range: KeyRange) -> str:
+    start, end = key_range
+    return f"{start or ''}..{end or ''}"
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Checkpoint:
+    """Progress per range, rewritten atomically to a JSON file after every batch"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.partitions: Optional[int] = None
+        self.ranges: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.partitions = state['partitions']
+            self.ranges = state['ranges']
+
+    def start(self, partitions: int):
+        if self.partitions is not None and self.partitions != partitions:
+            raise ValueError(f"Checkpoint {self.path} was written with {self.partitions} partitions, "
+                             f"not {partitions}")
+        self.partitions = partitions
+
+    def state(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.ranges.get(key) or {'last_id': None, 'done': False, **dict.fromkeys(TABLES, 0)})
+
+    def advance(self, key: str, last_id: Optional[str], loaded: Dict[str, int], done: bool = False):
+        with self._lock:
+            state = self.ranges.setdefault(key, {'last_id': None, 'done': False, **dict.fromkeys(TABLES, 0)})
+            if last_id is not None:
+                state['last_id'] = last_id
+            for table in TABLES:
+                # Checkpoints written before a table was added have no count for it
+                state[table] = state.get(table, 0) + loaded.get(table, 0)
+            state['done'] = done
+            self._save()
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            return {table: sum(state.get(table, 0) for state in self.ranges.values()) for table in TABLES}
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'partitions': self.partitions, 'ranges': self.ranges}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def _copy_range(source_factory: RepositoryFactory, target_factory: RepositoryFactory,
+                key_range: KeyRange, batch_size: int, checkpoint: Checkpoint):
+    key = range_key(key_range)
+    start_after = checkpoint.state(key)['last_id'] or key_range[0]
+    source, target = source_factory(), target_factory()
+    try:
+        for users in batched(source.iter_users(batch_size, start_after, key_range[1]), batch_size):
+            user_ids = [user['id'] for user in users]
+            data = source.export_user_data(user_ids)
+            loaded = target.bulk_load(users, data['password_entries'], data['attachments'])
+            # After the entries, so MongoDB can raise their history counters
+            loaded['password_history'] = target.import_password_history(source.export_password_history(user_ids))
+            checkpoint.advance(key, users[-1]['id'], loaded)
+        checkpoint.advance(key, None, {}, done=True)
+        logger.info(f"Copied range {key}: {checkpoint.state(key)['users']} users")
+    finally:
+        source.close()
+        target.close()
+
+
+def copy_users(source_factory: RepositoryFactory, target_factory: RepositoryFactory,
+               workers: int = 4, partitions: int = 16, batch_size: int = 1000,
+               checkpoint: Optional[Checkpoint] = None) -> Dict[str, int]:
+    """
+    Copy every user from source to target with one worker per range at a
+    time; returns rows inserted per table, including earlier resumed runs
+    """
+    checkpoint = checkpoint or Checkpoint()
+    ranges = key_ranges(partitions)
+    checkpoint.start(len(ranges))
+    pending = [r for r in ranges if not checkpoint.state(range_key(r))['done']]
+    if len(pending) < len(ranges):
+        logger.info(f"Resuming: {len(ranges) - len(pending)}/{len(ranges)} ranges already copied")
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_copy_range, source_factory, target_factory, r, batch_size, checkpoint)
+                   for r in pending]
+        for future in futures:
+            future.result()
+    return checkpoint.totals()
+
+
+def _canonical(value: Any) -> Any:
+    """Normalize a record so both backends hash it identically (MongoDB keeps milliseconds)"""
+    if isinstance(value, dict):
+        return {k: _canonical_timestamp(v) if k in _TIMESTAMP_FIELDS else _canonical(v)
+                for k, v in value.items()}
+    if isinstance(value, list):
+        if value and isinstance(value[0], dict):
+            return [_canonical(v) for v in sorted(value, key=_row_key)]
+        return sorted(value)
+    return value
+
+
+def _row_key(row: Dict[str, Any]) -> Any:
+    """Rows have an id, except history versions, which are keyed by entry and version"""
+    return row['id'] if 'id' in row else (row['password_id'], row['version'])
+
+
+def _canonical_timestamp(value: Optional[str]) -> Optional[str]:
+    parsed: Optional[datetime] = parse_timestamp(value)
+    return parsed.isoformat(timespec='milliseconds') if parsed else None
+
+
+def user_checksums(repo: BaseRepository, key_range: KeyRange, batch_size: int = 1000) -> Iterator[Tuple[str, str]]:
+    """Stream (user id, SHA-256 of the user and everything they own) in id order"""
+    for users in batched(repo.iter_users(batch_size, *key_range), batch_size):
+        owned = {user['id']: {table: [] for table in TABLES[1:]} for user in users}
+        exported = {**repo.export_user_data(list(owned)),
+                    'password_history': repo.export_password_history(list(owned))}
+        for table, rows in exported.items():
+            for row in rows:
+                owned[row['user_id']][table].append(row)
+        for user in users:
+            record = _canonical({'user': user, **owned[user['id']]})
+            digest = hashlib.sha256(json.dumps(record, sort_keys=True, separators=(',', ':')).encode())
+            yield user['id'], digest.hexdigest()
+
+
+def _verify_range(source_factory: RepositoryFactory, target_factory: RepositoryFactory,
+                  key_range: KeyRange, batch_size: int) -> Dict[str, int]:
+    """Merge-join both sides' checksum streams by user id"""
+    stats = {'users': 0, 'mismatched': 0, 'missing_in_target': 0, 'extra_in_target': 0}
+    source, target = source_factory(), target_factory()
+    try:
+        left = user_checksums(source, key_range, batch_size)
+        right = user_checksums(target, key_range, batch_size)
+        a, b = next(left, None), next(right, None)
+        while a is not None or b is not None:
+            if b is None or (a is not None and a[0] < b[0]):
+                stats['missing_in_target'] += 1
+                logger.warning(f"User {a[0]} is missing from the target")
+                a = next(left, None)
+            elif a is None or b[0] < a[0]:
+                stats['extra_in_target'] += 1
+                b = next(right, None)
+            else:
+                stats['users'] += 1
+                if a[1] != b[1]:
+                    stats['mismatched'] += 1
+                    logger.warning(f"Checksum mismatch for user {a[0]}")
+                a, b = next(left, None), next(right, None)
+    finally:
+        source.close()
+        target.close()
+    return stats
+
+
+def verify_copy(source_factory: RepositoryFactory, target_factory: RepositoryFactory,
+                workers: int = 4, partitions: int = 16, batch_size: int = 1000) -> Dict[str, int]:
+    """Compare per-user checksums of both sides, one batch at a time"""
+    totals = {'users': 0, 'mismatched': 0, 'missing_in_target': 0, 'extra_in_target': 0}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_verify_range, source_factory, target_factory, r, batch_size)
+                   for r in key_ranges(partitions)]
+        for future in futures:
+            for name, count in future.result().items():
+                totals[name] += count
+    return totals
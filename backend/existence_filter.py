@@ -0,0 +1,88 @@
+"""
+In-memory Bloom filters for username/email existence checks
+"""
+import hashlib
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over a blake2b digest"""
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, item):
+        """Add an item to the filter"""
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        """False means definitely absent, True means possibly present"""
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class UserExistenceFilter:
+    """
+    Bloom filters over existing usernames and emails.
+    A hit must still be confirmed against the repository. Each worker adds
+    the users it registers and pulls the ones registered elsewhere every
+    sync_interval; a miss is a definite negative that lets callers skip the
+    database only while the last sync is recent, so it trails other workers
+    by at most two intervals and otherwise counts as a possible hit.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.01, sync_interval=30.0):
+        self.usernames = BloomFilter(capacity, error_rate)
+        self.emails = BloomFilter(capacity, error_rate)
+        self.sync_interval = sync_interval
+        self.ready = False
+        self._last_sync: Optional[datetime] = None
+        self._synced_at = 0.0
+
+    def add(self, username, email):
+        """Record a newly created user"""
+        self.usernames.add(username)
+        self.emails.add(email)
+
+    def since(self) -> Optional[datetime]:
+        """Creation time to resume scanning users from; None before the first load"""
+        # Overlap the window so rows committed late (or by a skewed clock) are not missed
+        return self._last_sync - timedelta(seconds=self.sync_interval * 2) if self._last_sync else None
+
+    def mark_synced(self, started: datetime):
+        """Record a completed scan of users created up to started"""
+        self._last_sync = started
+        self._synced_at = time.monotonic()
+        self.ready = True
+
+    def load(self, identities):
+        """Populate from an iterable of (username, email) pairs scanned lazily from the repository"""
+        started = datetime.utcnow()
+        for username, email in identities:
+            self.add(username, email)
+        self.mark_synced(started)
+
+    def synced(self):
+        return self.ready and time.monotonic() - self._synced_at <= self.sync_interval * 2
+
+    def might_have_username(self, username):
+        """Until loaded, or when a sync is overdue, every name is a possible hit"""
+        return not self.synced() or username in self.usernames
+
+    def might_have_email(self, email):
+        return not self.synced() or email in self.emails
@@ -0,0 +1,68 @@
+"""
+Pre-fork multi-worker deployment: gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master (preload_app) so read-only warm
+state such as the compiled config and the username/email filter is shared
+with workers copy-on-write. The master's database connections are closed
+before forking and each worker connects lazily on its first request.
+
+Socket.IO across workers needs SOCKETIO_MESSAGE_QUEUE; clients should use
+the websocket transport (or a sticky load balancer for long-polling).
+"""
+import eventlet
+eventlet.monkey_patch()
+
+import gc
+import multiprocessing
+import os
+import signal
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'eventlet'
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '1000'))
+preload_app = True
+# Must cover DRAIN_DELAY_SECONDS plus the longest request
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', '30'))
+
+
+def when_ready(server):
+    from app import db_repo, revocations, warm_user_filter
+    warm_user_filter()
+    revocations.sync()
+    # Warm state is built; drop the master's connections before forking
+    db_repo.release()
+    # Keep preloaded objects out of the collector so workers don't dirty shared pages
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    # Background tasks do not survive fork; start them in each worker
+    from app import (audit, disconnect_clients, history, readiness, revocations, rotations, socketio, start_draining,
+                     sync_user_filter)
+    socketio.start_background_task(sync_user_filter, socketio.sleep)
+    socketio.start_background_task(revocations.run, socketio.sleep)
+    socketio.start_background_task(rotations.run, socketio.sleep)
+    socketio.start_background_task(history.run, socketio.sleep)
+    socketio.start_background_task(audit.run, socketio.sleep)
+    socketio.start_background_task(readiness.run, socketio.sleep)
+
+    # SIGTERM: go unready first, then let gunicorn stop accepting and wait for
+    # in-flight requests; Socket.IO connections would hold it until the timeout
+    stop = worker.handle_exit
+
+    def drain():
+        start_draining()
+        stop(signal.SIGTERM, None)
+        disconnect_clients()
+
+    def handle_term(sig, frame):
+        if not readiness.draining:
+            socketio.start_background_task(drain)
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
@@ -0,0 +1,237 @@
+"""
+Operational commands for the Password Manager backend
+
+Usage: python manage.py <command> [options]
+"""
+import argparse
+import itertools
+import json
+import os
+import secrets
+import sys
+import time
+
+from breach_filter import BreachIndex, build_index, hibp_keys, plaintext_keys
+from config import get_config
+from database.base_repository import parse_timestamp
+from database.backup import BackupError, backup as dump_backup, restore as load_backup
+from database.db_factory import get_repository, open_repository
+from database.sharded_repository import ShardedRepository
+from database.transfer import Checkpoint, copy_users, verify_copy
+from structured_logging import setup_logging
+
+
+def reshard(args, config):
+    """Move users whose home shard changed from SHARD_PREVIOUS_URIS to SHARD_URIS"""
+    repo = get_repository(config)
+    try:
+        if not isinstance(repo, ShardedRepository):
+            print("❌ Resharding requires SHARD_URIS to be configured")
+            return 1
+        stats = repo.reshard(batch_size=args.batch_size)
+        print(f"✓ Resharding complete: {stats['users_moved']}/{stats['users_scanned']} users moved, "
+              f"{stats['entries_moved']} entries")
+        return 0
+    finally:
+        repo.close()
+
+
+def migrate(args, config):
+    """Create tables/collections and indexes and record the schema version"""
+    repo = get_repository(config, verify_schema=False)
+    try:
+        repo.migrate()
+        return 0
+    finally:
+        repo.close()
+
+
+def transfer(args, config):
+    """Copy all users, entries and attachment metadata to another database, then verify checksums"""
+    source_type = (args.source_type or config.DATABASE_TYPE).lower()
+    source_uri = args.source_uri or (config.POSTGRES_URI if source_type == 'postgresql' else config.MONGODB_URI)
+
+    def source():
+        return open_repository(source_type, source_uri)
+
+    def target():
+        return open_repository(args.target_type, args.target_uri)
+
+    if not args.verify_only:
+        repo = target()
+        try:
+            repo.migrate()
+        finally:
+            repo.close()
+        stats = copy_users(source, target, workers=args.workers, partitions=args.partitions,
+                           batch_size=args.batch_size, checkpoint=Checkpoint(args.checkpoint))
+        print(f"✓ Copied {stats['users']} users, {stats['password_entries']} entries, "
+              f"{stats['attachments']} attachments")
+        if args.no_verify:
+            return 0
+
+    result = verify_copy(source, target, workers=args.workers, partitions=args.partitions,
+                         batch_size=args.batch_size)
+    if result['mismatched'] or result['missing_in_target']:
+        print(f"❌ Verification failed: {result['mismatched']} mismatched, "
+              f"{result['missing_in_target']} missing of {result['users'] + result['missing_in_target']} users")
+        return 1
+    print(f"✓ Verified {result['users']} users ({result['extra_in_target']} extra in target)")
+    return 0
+
+
+def backup(args, config):
+    """Write a consistent, compressed and checksummed snapshot of the database to a directory"""
+    report = dump_backup(lambda: get_repository(config), args.output, workers=args.workers,
+                         partitions=args.partitions, batch_size=args.batch_size)
+    print(f"✓ Backed up {report['users']} users, {report['password_entries']} entries, "
+          f"{report['attachments']} attachments in {report['elapsed_seconds']}s "
+          f"({report['users_per_second']} users/s, {report['bytes']} bytes compressed)")
+    return 0
+
+
+def restore(args, config):
+    """Load a backup directory into the configured database (or --target-type/--target-uri)"""
+    if args.target_type:
+        def target():
+            return open_repository(args.target_type, args.target_uri)
+    else:
+        def target():
+            return get_repository(config, verify_schema=False)
+
+    repo = target()
+    try:
+        repo.migrate()
+    finally:
+        repo.close()
+
+    try:
+        report = load_backup(target, args.input, workers=args.workers)
+    except BackupError as e:
+        print(f"❌ {e}")
+        return 1
+    inserted = report['inserted']
+    print(f"✓ Restored {inserted['users']} users, {inserted['password_entries']} entries, "
+          f"{inserted['attachments']} attachments in {report['elapsed_seconds']}s "
+          f"({report['users_per_second']} users/s)")
+    return 0
+
+
+def build_breach_index(args, config):
+    """Build or update the breached password index from Pwned Passwords SHA-1 files or wordlists"""
+    output = args.output or config.BREACHED_PASSWORDS_PATH
+    if not output:
+        print("❌ Pass --output or set BREACHED_PASSWORDS_PATH")
+        return 1
+
+    sources = []
+    if args.update and os.path.exists(output):
+        sources.append(BreachIndex(output).keys())
+    files = [open(path, encoding='utf-8', errors='replace') for path in args.input]
+    try:
+        for f in files:
+            sources.append(hibp_keys(f, args.min_count) if args.format == 'sha1' else plaintext_keys(f))
+        started = time.perf_counter()
+        count = build_index(itertools.chain(*sources), output, run_size=args.run_size)
+        elapsed = time.perf_counter() - started
+    finally:
+        for f in files:
+            f.close()
+
+    index = BreachIndex(output)
+    probes = [int.from_bytes(secrets.token_bytes(8), 'big') for _ in range(10000)]
+    started = time.perf_counter()
+    for key in probes:
+        key in index
+    lookup_us = (time.perf_counter() - started) / len(probes) * 1e6
+    print(f"✓ Wrote {count} hashes to {output} ({os.path.getsize(output) / 1e6:.1f} MB) in {elapsed:.1f}s; "
+          f"{lookup_us:.1f} µs per lookup")
+    return 0
+
+
+def audit(args, config):
+    """Print a user's audit events as JSON lines, newest first"""
+    repo = get_repository(config)
+    try:
+        since, until = parse_timestamp(args.since), parse_timestamp(args.until)
+        before, remaining = None, args.limit
+        while remaining > 0:
+            events = repo.get_audit_events(args.user, since, until, args.event, min(remaining, 500), before)
+            for event in events:
+                print(json.dumps(event))
+            if len(events) < min(remaining, 500):
+                break
+            remaining -= len(events)
+            before = (parse_timestamp(events[-1]['ts']), events[-1]['id'])
+        return 0
+    finally:
+        repo.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Password Manager backend management')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    migrate_parser = subparsers.add_parser('migrate', help=migrate.__doc__)
+    migrate_parser.set_defaults(func=migrate)
+
+    reshard_parser = subparsers.add_parser('reshard', help=reshard.__doc__)
+    reshard_parser.add_argument('--batch-size', type=int, default=100)
+    reshard_parser.set_defaults(func=reshard)
+
+    transfer_parser = subparsers.add_parser('transfer', help=transfer.__doc__)
+    transfer_parser.add_argument('--source-type', choices=['postgresql', 'mongodb'],
+                                 help='defaults to DATABASE_TYPE')
+    transfer_parser.add_argument('--source-uri', help='defaults to the configured URI for the source type')
+    transfer_parser.add_argument('--target-type', choices=['postgresql', 'mongodb'], required=True)
+    transfer_parser.add_argument('--target-uri', required=True)
+    transfer_parser.add_argument('--workers', type=int, default=4)
+    transfer_parser.add_argument('--partitions', type=int, default=16)
+    transfer_parser.add_argument('--batch-size', type=int, default=1000)
+    transfer_parser.add_argument('--checkpoint', help='JSON file recording progress, to resume an interrupted copy')
+    transfer_parser.add_argument('--verify-only', action='store_true')
+    transfer_parser.add_argument('--no-verify', action='store_true')
+    transfer_parser.set_defaults(func=transfer)
+
+    backup_parser = subparsers.add_parser('backup', help=backup.__doc__)
+    backup_parser.add_argument('--output', required=True, help='directory to create')
+    backup_parser.add_argument('--workers', type=int, default=4)
+    backup_parser.add_argument('--partitions', type=int, default=16)
+    backup_parser.add_argument('--batch-size', type=int, default=1000)
+    backup_parser.set_defaults(func=backup)
+
+    restore_parser = subparsers.add_parser('restore', help=restore.__doc__)
+    restore_parser.add_argument('--input', required=True, help='backup directory')
+    restore_parser.add_argument('--target-type', choices=['postgresql', 'mongodb'])
+    restore_parser.add_argument('--target-uri')
+    restore_parser.add_argument('--workers', type=int, default=4)
+    restore_parser.set_defaults(func=restore)
+
+    breach_parser = subparsers.add_parser('build-breach-index', help=build_breach_index.__doc__)
+    breach_parser.add_argument('--input', nargs='+', required=True, help='corpus files')
+    breach_parser.add_argument('--format', choices=['sha1', 'plaintext'], default='sha1',
+                               help='"SHA1HEX:count" lines (Pwned Passwords) or one password per line')
+    breach_parser.add_argument('--min-count', type=int, default=1,
+                               help='sha1 format: skip hashes seen fewer times, for a smaller index')
+    breach_parser.add_argument('--output', help='defaults to BREACHED_PASSWORDS_PATH')
+    breach_parser.add_argument('--update', action='store_true', help='merge into the existing index')
+    breach_parser.add_argument('--run-size', type=int, default=2_000_000,
+                               help='keys sorted in memory at a time')
+    breach_parser.set_defaults(func=build_breach_index)
+
+    audit_parser = subparsers.add_parser('audit', help=audit.__doc__)
+    audit_parser.add_argument('--user', required=True, help='user id')
+    audit_parser.add_argument('--since', help='ISO timestamp (UTC), inclusive')
+    audit_parser.add_argument('--until', help='ISO timestamp (UTC), exclusive')
+    audit_parser.add_argument('--event', help='only this event type, e.g. auth.login_failed')
+    audit_parser.add_argument('--limit', type=int, default=1000)
+    audit_parser.set_defaults(func=audit)
+
+    args = parser.parse_args(argv)
+    config = get_config(os.getenv('FLASK_ENV', 'development'))
+    setup_logging(config.LOG_LEVEL, config.LOG_FORMAT)
+    return args.func(args, config)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,16 @@
-from sqlalchemy import create_engine, Column, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Text, DateTime, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
+import json
 import uuid
 
 Base = declarative_base()
 
+# SQLAlchemy's defaults, stated so pool usage can be reported against them
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -14,6 +19,10 @@ class User(Base):
     email = Column(String(255), unique=True, nullable=False)
     master_password_hash = Column(String(255), nullable=False)
     salt = Column(String(255), nullable=False)
+    # Total attachment bytes, maintained incrementally with each attachment write
+    storage_bytes = Column(BigInteger, nullable=False, default=0, server_default='0')
+    # Set while the user's entries are being moved between shards; writes wait until it lapses
+    moving_until = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -44,6 +53,9 @@ class PasswordEntry(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_used = Column(DateTime)
+    # Client-computed keyed hash of the plaintext, for reuse detection
+    fingerprint = Column(String(64))
+    folder = Column(String(100))
     
     user = relationship('User', back_populates='passwords')
     
@@ -59,12 +71,170 @@ class PasswordEntry(Base):
             'notes': self.notes,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'last_used': self.last_used.isoformat() if self.last_used else None
+            'last_used': self.last_used.isoformat() if self.last_used else None,
+            'fingerprint': self.fingerprint,
+            'folder': self.folder
+        }
+
+class PasswordTag(Base):
+    __tablename__ = 'password_tags'
+    
+    password_id = Column(String(36), ForeignKey('password_entries.id', ondelete='CASCADE'), primary_key=True)
+    tag = Column(String(50), primary_key=True)
+    user_id = Column(String(36), ForeignKey('users.id'), nullable=False)
+
+class FolderCount(Base):
+    __tablename__ = 'folder_counts'
+    
+    # Maintained by the repository on every entry write, so the sidebar needs no aggregation
+    user_id = Column(String(36), ForeignKey('users.id'), primary_key=True)
+    folder = Column(String(100), primary_key=True)
+    entries = Column(Integer, nullable=False, default=0)
+
+class Attachment(Base):
+    __tablename__ = 'attachments'
+    
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String(36), ForeignKey('users.id'), nullable=False)
+    password_id = Column(String(36), ForeignKey('password_entries.id', ondelete='CASCADE'), nullable=False)
+    filename = Column(String(255), nullable=False)
+    # SHA-256 of the encrypted bytes in the blob store; the bytes never live in this table
+    blob_id = Column(String(64), nullable=False)
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'password_id': self.password_id,
+            'filename': self.filename,
+            'blob_id': self.blob_id,
+            'size': self.size,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class TokenRevocation(Base):
+    __tablename__ = 'token_revocations'
+    
+    # A token's jti, or "user:<id>" to revoke every token a user was issued before revoked_at
+    key = Column(String(100), primary_key=True)
+    user_id = Column(String(36), nullable=False)
+    revoked_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'user_id': self.user_id,
+            'revoked_at': self.revoked_at.isoformat(),
+            'expires_at': self.expires_at.isoformat()
+        }
+
+class VaultRotation(Base):
+    __tablename__ = 'vault_rotations'
+    
+    # Re-encryption in progress; the new hash is only applied on commit
+    id = Column(String(36), primary_key=True)
+    user_id = Column(String(36), ForeignKey('users.id'), nullable=False)
+    master_password_hash = Column(String(255), nullable=False)
+    salt = Column(String(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'expires_at': self.expires_at.isoformat()
+        }
+
+class VaultRotationChunk(Base):
+    __tablename__ = 'vault_rotation_chunks'
+    
+    rotation_id = Column(String(36), ForeignKey('vault_rotations.id', ondelete='CASCADE'), primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    entries = Column(Integer, nullable=False)
+
+class VaultRotationEntry(Base):
+    __tablename__ = 'vault_rotation_entries'
+    
+    # Staged copy of an entry's encrypted fields, swapped into password_entries on commit
+    rotation_id = Column(String(36), ForeignKey('vault_rotations.id', ondelete='CASCADE'), primary_key=True)
+    password_id = Column(String(36), primary_key=True)
+    username = Column(Text)
+    encrypted_password = Column(Text, nullable=False)
+    iv = Column(String(255))
+    notes = Column(Text)
+    fingerprint = Column(String(64))
+    # The entry's updated_at when staged; commit refuses entries edited since
+    entry_updated_at = Column(DateTime)
+
+class PasswordHistory(Base):
+    __tablename__ = 'password_history'
+    
+    # Append-only: an entry's encrypted fields as they were before each update.
+    # Never joined by the entry read paths; the primary key serves paging and pruning
+    user_id = Column(String(36), ForeignKey('users.id'), primary_key=True)
+    password_id = Column(String(36), ForeignKey('password_entries.id', ondelete='CASCADE'), primary_key=True)
+    version = Column(Integer, primary_key=True)
+    username = Column(Text)
+    encrypted_password = Column(Text, nullable=False)
+    iv = Column(String(255))
+    notes = Column(Text)
+    fingerprint = Column(String(64))
+    replaced_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'password_id': self.password_id,
+            'version': self.version,
+            'username': self.username,
+            'encrypted_password': self.encrypted_password,
+            'iv': self.iv,
+            'notes': self.notes,
+            'fingerprint': self.fingerprint,
+            'replaced_at': self.replaced_at.isoformat()
+        }
+
+class AuditEvent(Base):
+    __tablename__ = 'audit_events'
+    # Range-partitioned by month; the repository creates partitions as events
+    # arrive and drops whole ones past the retention period
+    __table_args__ = {'postgresql_partition_by': 'RANGE (ts)'}
+    
+    # The partition key has to be part of the primary key
+    ts = Column(DateTime, primary_key=True)
+    id = Column(String(32), primary_key=True)
+    event = Column(String(50), nullable=False)
+    # No foreign key: the trail outlives deleted users until it expires
+    user_id = Column(String(36))
+    ip = Column(String(45))
+    request_id = Column(String(64))
+    details = Column(Text)  # JSON
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'ts': self.ts.isoformat(),
+            'event': self.event,
+            'user_id': self.user_id,
+            'ip': self.ip,
+            'request_id': self.request_id,
+            'details': json.loads(self.details) if self.details else {}
+        }
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
 class PostgresConnectionManager:
     def __init__(self, database_uri):
-        self.engine = create_engine(database_uri, pool_pre_ping=True)
+        self.engine = create_engine(database_uri, pool_pre_ping=True, pool_size=POOL_SIZE,
+                                    max_overflow=MAX_OVERFLOW)
         self.Session = sessionmaker(bind=self.engine)
     
     def create_tables(self):
@@ -0,0 +1,46 @@
+"""
+Append-only history of password entries
+
+Every update that changes an entry's encrypted fields first archives their
+previous values as the entry's next version, in a separate table (a
+collection on MongoDB) that the vault read paths never touch. The write
+path pays one insert; keeping each entry to its newest versions is left to
+a background job that prunes in batches. History is dropped when the entry
+is deleted and when a master password change re-encrypts the vault.
+"""
+import logging
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHistory:
+    def __init__(self, repo, limit: int = 20, prune_interval: float = 600, batch_size: int = 500):
+        self.repo = repo
+        self.limit = max(limit, 1)
+        self.prune_interval = prune_interval
+        self.batch_size = batch_size
+
+    def page(self, password_id: str, user_id: str, limit: int = 20,
+             before: Optional[int] = None) -> Dict[str, Any]:
+        """Newest versions first; pass next_before back as before for the next page"""
+        limit = min(max(limit, 1), self.limit)
+        versions = self.repo.get_password_history(password_id, user_id, limit, before)
+        next_before = versions[-1]['version'] if len(versions) == limit else None
+        return {'versions': versions, 'next_before': next_before}
+
+    def prune(self) -> int:
+        removed = self.repo.prune_password_history(self.limit, self.batch_size)
+        if removed:
+            logger.info(f"Pruned {removed} password history versions")
+        return removed
+
+    def run(self, sleep=time.sleep):
+        """Background loop: trim every entry to its newest versions"""
+        while True:
+            try:
+                self.prune()
+            except Exception:
+                logger.exception("Password history prune failed")
+            sleep(self.prune_interval)
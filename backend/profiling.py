@@ -0,0 +1,144 @@
+"""
+Slow-query log and per-request profiling hooks
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+
+from flask import g, has_request_context, request
+
+from crypto_utils import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+
+def current_route():
+    """Endpoint of the request being served, if any"""
+    if has_request_context():
+        return request.endpoint or request.path
+    return None
+
+
+class SlowQueryLog:
+    """
+    Records database calls slower than a threshold with their statement
+    shape (no parameter values), duration, row count and route.
+    """
+
+    def __init__(self, threshold_ms=200.0):
+        self.threshold_ms = threshold_ms
+
+    def record(self, backend, shape, duration_ms, rows):
+        if duration_ms < self.threshold_ms:
+            return
+        logger.warning("Slow query", extra={'backend': backend, 'shape': shape,
+                                            'duration_ms': round(duration_ms, 1), 'rows': rows,
+                                            'route': current_route()})
+
+    def install(self, database_type):
+        """Attach to the driver for the configured database only"""
+        if self.threshold_ms < 0:
+            return
+        if database_type == 'mongodb':
+            self._install_pymongo()
+        else:
+            self._install_sqlalchemy()
+
+    def _install_sqlalchemy(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        @event.listens_for(Engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+        @event.listens_for(Engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            duration_ms = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+            shape = re.sub(r'\s+', ' ', statement).strip()[:500]
+            self.record('postgresql', shape, duration_ms, cursor.rowcount)
+
+    def _install_pymongo(self):
+        from pymongo import monitoring
+
+        slow_log = self
+
+        class SlowCommandListener(monitoring.CommandListener):
+            def __init__(self):
+                self.shapes = {}
+
+            def started(self, event):
+                command = event.command
+                collection = command.get(event.command_name)
+                spec = command.get('filter') or command.get('query') or {}
+                if event.command_name in ('update', 'delete') and command.get(event.command_name + 's'):
+                    spec = command[event.command_name + 's'][0].get('q', {})
+                self.shapes[event.request_id] = (
+                    f"{event.command_name} {collection} {{{', '.join(sorted(spec))}}}"
+                )
+
+            def succeeded(self, event):
+                shape = self.shapes.pop(event.request_id, event.command_name)
+                reply = event.reply
+                if 'cursor' in reply:
+                    rows = len(reply['cursor'].get('firstBatch', reply['cursor'].get('nextBatch', [])))
+                else:
+                    rows = reply.get('n', -1)
+                slow_log.record('mongodb', shape, event.duration_micros / 1000, rows)
+
+            def failed(self, event):
+                self.shapes.pop(event.request_id, None)
+
+        monitoring.register(SlowCommandListener())
+
+
+class RequestProfiler:
+    """
+    Opt-in cProfile capture for a sample of requests, or for requests that
+    send the profiling header with the configured token. Profiles are
+    written as .prof files (snakeviz, flameprof, py-spy-compatible tooling).
+
+    cProfile follows the OS thread, so under eventlet a profile also
+    includes other green threads that ran during the request; only one
+    request is profiled at a time per process.
+    """
+
+    HEADER = 'X-Profile'
+
+    def __init__(self, sample_rate=0.0, token=None, output_dir='profiles'):
+        self.sample_rate = sample_rate
+        self.token = token
+        self.output_dir = output_dir
+        self._active = False
+
+    def init_app(self, app):
+        if self.sample_rate <= 0 and not self.token:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        app.before_request(self._start)
+        app.teardown_request(self._stop)
+
+    def _requested(self):
+        header = request.headers.get(self.HEADER)
+        if self.token and header:
+            return constant_time_compare(header.encode(), self.token.encode())
+        return random.random() < self.sample_rate
+
+    def _start(self):
+        if self._active or not self._requested():
+            return
+        self._active = True
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def _stop(self, exc=None):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        profiler.disable()
+        self._active = False
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{request.endpoint or 'unknown'}-{os.getpid()}.prof"
+        profiler.dump_stats(os.path.join(self.output_dir, name))
@@ -0,0 +1,116 @@
+"""
+Token-bucket rate limiting for the auth endpoints
+
+Checks run before any Argon2 or database work, so a rejected attempt costs
+a dict lookup (or one Redis round trip with the shared backend).
+"""
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class Limit:
+    """A bucket of `capacity` attempts refilled evenly over `period` seconds"""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+
+    @classmethod
+    def parse(cls, spec: str) -> 'Limit':
+        """Parse "5/minute", "100/hour" or "10/30second" style limits"""
+        match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d*)\s*(second|minute|hour|day)s?\s*', spec)
+        if not match:
+            raise ValueError(f"Invalid rate limit: {spec!r}")
+        capacity, multiplier, unit = match.groups()
+        return cls(int(capacity), int(multiplier or 1) * _PERIODS[unit])
+
+
+class MemoryBackend:
+    """Per-process buckets; the least recently used are dropped past max_keys"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[str, Tuple[float, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        """Consume one token; return 0 if admitted, else seconds until one is available"""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit.capacity, now))
+            tokens = min(limit.capacity, tokens + (now - updated) * limit.rate)
+            retry_after = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / limit.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return retry_after
+
+
+class RedisBackend:
+    """Buckets shared by all workers, updated atomically by a Lua script"""
+
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(retry_after)
+"""
+
+    def __init__(self, url: str, prefix: str = 'ratelimit:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        return float(self._script(keys=[self.prefix + key], args=[limit.capacity, limit.rate, now]))
+
+
+def create_backend(storage_uri: Optional[str]):
+    """memory:// (default) for a single worker, redis://... to share buckets across workers"""
+    if not storage_uri or storage_uri.startswith('memory://'):
+        return MemoryBackend()
+    return RedisBackend(storage_uri)
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, Limit], backend=None):
+        self.limits = limits
+        self.backend = backend or MemoryBackend()
+        self.stats = {name: {'admitted': 0, 'rejected': 0} for name in limits}
+
+    def check(self, keys: Iterable[Tuple[str, str]]) -> float:
+        """
+        Take a token from each (limit name, key) bucket. Returns 0 if the
+        attempt is admitted, else the longest Retry-After in seconds.
+        """
+        now = time.time()
+        retry_after = 0.0
+        for name, key in keys:
+            if not key:
+                continue
+            wait = self.backend.take(f'{name}:{key}', self.limits[name], now)
+            self.stats[name]['rejected' if wait else 'admitted'] += 1
+            retry_after = max(retry_after, wait)
+        return math.ceil(retry_after) if retry_after else 0
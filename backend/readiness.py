@@ -0,0 +1,100 @@
+"""
+Liveness and readiness
+
+Liveness only says the process answers requests. Readiness says whether
+this worker should receive traffic: a background loop pings the database
+every interval and caches the round-trip latency and connection pool
+usage, so probe requests never touch the database themselves. A worker is
+unready while the last probe failed or is overdue, latency or pool
+saturation is above its threshold, too many requests are waiting for
+Argon2, or it is draining for shutdown.
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class InFlight:
+    """Number of callers currently inside a with-block, e.g. queued or running Argon2 work"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with self._lock:
+            self.count += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self.count -= 1
+
+
+class Readiness:
+    def __init__(self, repo, argon2_queue: InFlight, interval: float = 5.0, max_db_latency_ms: float = 500,
+                 max_pool_saturation: float = 0.9, max_argon2_queue: int = 32):
+        self.repo = repo
+        self.argon2_queue = argon2_queue
+        self.interval = interval
+        self.max_db_latency_ms = max_db_latency_ms
+        self.max_pool_saturation = max_pool_saturation
+        self.max_argon2_queue = max_argon2_queue
+        self.draining = False
+        self._probe: Optional[Dict[str, Any]] = None
+
+    def probe(self):
+        """Time one database round trip and read pool usage; the result is cached"""
+        started = time.perf_counter()
+        try:
+            self.repo.ping()
+            latency_ms = (time.perf_counter() - started) * 1000
+            pool = self.repo.pool_status()
+            result = {'ok': True, 'latency_ms': round(latency_ms, 1), 'pool_in_use': pool['in_use'],
+                      'pool_size': pool['size']}
+        except Exception as e:
+            logger.warning(f"Database readiness probe failed: {e}")
+            result = {'ok': False, 'error': str(e) or type(e).__name__}
+        result['checked_at'] = time.time()
+        self._probe = result
+
+    def run(self, sleep=time.sleep):
+        """Background loop: probe the database every interval"""
+        while True:
+            self.probe()
+            sleep(self.interval)
+
+    def status(self) -> Tuple[bool, Dict[str, Any]]:
+        """(ready, report) from the cached probe and live counters"""
+        reasons = []
+        probe = self._probe
+        saturation = None
+        if self.draining:
+            reasons.append('draining')
+        if probe is None:
+            reasons.append('database not probed yet')
+        elif not probe['ok']:
+            reasons.append('database unreachable')
+        else:
+            # A probe stuck waiting for a connection stops refreshing the cache
+            if time.time() - probe['checked_at'] > self.interval * 3:
+                reasons.append('database probe overdue')
+            if probe['latency_ms'] > self.max_db_latency_ms:
+                reasons.append('database latency')
+            saturation = round(probe['pool_in_use'] / probe['pool_size'], 2) if probe['pool_size'] else 0.0
+            if saturation > self.max_pool_saturation:
+                reasons.append('connection pool saturated')
+        if self.argon2_queue.count > self.max_argon2_queue:
+            reasons.append('argon2 queue')
+
+        return not reasons, {
+            'ready': not reasons,
+            'reasons': reasons,
+            'database': probe,
+            'pool_saturation': saturation,
+            'argon2_queue': self.argon2_queue.count,
+            'draining': self.draining
+        }
@@ -0,0 +1,22 @@
+"""
+Cold-start timing: import, database connect and first-request latency
+"""
+import time
+
+_origin = time.perf_counter()
+_marks = {}
+
+
+def record(name, seconds):
+    """Record a phase duration; only the first value for a phase is kept"""
+    _marks.setdefault(name, seconds)
+
+
+def mark(name):
+    """Record time elapsed since this module was first imported"""
+    record(name, time.perf_counter() - _origin)
+
+
+def report():
+    """Phase durations in milliseconds"""
+    return {name: round(seconds * 1000, 1) for name, seconds in _marks.items()}
@@ -0,0 +1,220 @@
+"""
+Structured, non-blocking logging
+
+Records are formatted as JSON lines and handed to a bounded in-memory
+queue; a writer running on a real OS thread drains it to stdout, so a slow
+pipe never blocks request handlers (or the eventlet hub). When the queue is
+full records are dropped and counted instead of waiting. Error records are
+rate limited per message so an error storm cannot amplify load.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'request_id'}
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+
+def _real_thread_primitives():
+    """Unpatched threading/queue modules when running under eventlet"""
+    try:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            return patcher.original('threading'), patcher.original('queue')
+    except ImportError:
+        pass
+    return threading, queue
+
+
+def current_request_id():
+    """Correlation ID of the Flask request being served, if any"""
+    try:
+        from flask import g, has_request_context
+    except ImportError:
+        return None
+    if has_request_context():
+        return g.get('request_id')
+    return None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp records with the current request's correlation ID"""
+
+    def filter(self, record):
+        record.request_id = current_request_id()
+        return True
+
+
+class ErrorRateLimitFilter(logging.Filter):
+    """
+    Token bucket per (logger, message template) for ERROR and above.
+    Suppressed records are counted and the count is attached to the next
+    record that gets through. Log with %-style arguments, not f-strings,
+    so one template shares one bucket; past max_keys the least recently
+    used buckets are dropped.
+    """
+
+    def __init__(self, rate=1.0, burst=10, max_keys=1000):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR or self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        tokens, updated, suppressed = self._buckets.pop(key, (self.burst, now, 0))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now, suppressed + 1)
+            admitted = False
+        else:
+            if suppressed:
+                record.suppressed = suppressed
+            self._buckets[key] = (tokens - 1, now, 0)
+            admitted = True
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return admitted
+
+
+class AsyncQueueHandler(logging.Handler):
+    """Formats on the caller, writes on a background OS thread, never blocks"""
+
+    def __init__(self, stream=None, max_queue=10000):
+        super().__init__()
+        self.stream = stream or sys.stdout
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._start()
+        if hasattr(os, 'register_at_fork'):
+            # The writer thread does not survive fork; give each child its own
+            os.register_at_fork(after_in_child=self._start)
+        atexit.register(self.drain)
+
+    def _start(self):
+        real_threading, real_queue = _real_thread_primitives()
+        self._queue = real_queue.Queue(maxsize=self.max_queue)
+        # eventlet's patched queue has its own Full, which would not match
+        self._full, self._empty = real_queue.Full, real_queue.Empty
+        real_threading.Thread(target=self._run, name='log-writer', daemon=True).start()
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self._queue.put_nowait(line)
+        except self._full:
+            self.dropped += 1
+
+    def _take(self, lines, limit):
+        while len(lines) < limit:
+            try:
+                lines.append(self._queue.get_nowait())
+            except self._empty:
+                break
+        return lines
+
+    def drain(self):
+        """Write out whatever is still queued (called at interpreter exit)"""
+        lines = self._take([], self.max_queue)
+        if lines:
+            self._write(lines)
+
+    def _run(self):
+        while True:
+            lines = self._take([self._queue.get()], 500)
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                lines.append(json.dumps({'ts': round(time.time(), 3), 'level': 'WARNING',
+                                         'logger': __name__, 'msg': 'Log records dropped',
+                                         'dropped': dropped}))
+            self._write(lines)
+
+    def _write(self, lines):
+        try:
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+        except Exception:
+            pass
+
+
+def setup_logging(level='INFO', fmt='json', error_rate=1.0, error_burst=10, max_queue=10000):
+    """Route the root logger through the async JSON handler (idempotent)"""
+    root = logging.getLogger()
+    if any(isinstance(h, AsyncQueueHandler) for h in root.handlers):
+        return root
+
+    handler = AsyncQueueHandler(max_queue=max_queue)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'))
+    handler.addFilter(RequestIdFilter())
+    handler.addFilter(ErrorRateLimitFilter(error_rate, error_burst))
+
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return root
+
+
+def flush():
+    """Write out log lines still queued in this process (before a worker exits)"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, AsyncQueueHandler):
+            handler.drain()
+
+
+def init_app(app):
+    """Assign each request a correlation ID (honouring an incoming X-Request-ID)"""
+    from flask import g, request
+
+    @app.before_request
+    def assign_request_id():
+        incoming = request.headers.get(REQUEST_ID_HEADER, '')
+        g.request_id = incoming[:64] if incoming.isprintable() and incoming else uuid.uuid4().hex
+
+    @app.after_request
+    def echo_request_id(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
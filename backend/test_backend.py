@@ -2,24 +2,44 @@
 Comprehensive test suite for Password Manager Backend
 Tests authentication, CRUD operations, and security features
 """
+import os
 import pytest
 import json
-from app import app, db_manager
-from models import User, PasswordEntry
-from auth import generate_salt, hash_master_password
+import shutil
+import tempfile
+from datetime import datetime
+
+# Selected before app is imported, since the repository is built from it
+os.environ.setdefault('FLASK_ENV', 'testing')
+# Uploaded blobs go to a scratch directory rather than backend/attachments
+ATTACHMENT_DIR = tempfile.mkdtemp(prefix='test-attachments-')
+os.environ['ATTACHMENT_DIR'] = ATTACHMENT_DIR
+
+from app import app, db_repo
 from config import get_config
 
-# Configure for testing
-app.config.from_object(get_config('testing'))
+def drop_schema():
+    """Remove every table/collection so the next test migrates from scratch"""
+    if app.config['DATABASE_TYPE'] == 'mongodb':
+        db_repo.client.drop_database(db_repo.db.name)
+    else:
+        db_repo.session.rollback()
+        db_repo.manager.drop_tables()
+
+@pytest.fixture(scope='session', autouse=True)
+def attachment_dir():
+    """Remove the scratch blob directory after the run"""
+    yield ATTACHMENT_DIR
+    shutil.rmtree(ATTACHMENT_DIR, ignore_errors=True)
 
 @pytest.fixture
 def client():
-    """Create test client"""
+    """Create test client against a freshly migrated schema"""
+    db_repo.migrate()
     with app.test_client() as client:
         with app.app_context():
-            db_manager.create_tables()
             yield client
-            db_manager.drop_tables()
+    drop_schema()
 
 @pytest.fixture
 def auth_headers(client):
@@ -48,6 +68,43 @@ def test_health_check(client):
     data = json.loads(response.data)
     assert data['status'] == 'healthy'
 
+def test_readiness_probe(client):
+    """Test liveness is unconditional and readiness follows the cached probe and draining"""
+    from app import readiness
+    assert client.get('/health/live').status_code == 200
+    
+    readiness.probe()
+    response = client.get('/health/ready')
+    assert response.status_code == 200
+    assert json.loads(response.data)['database']['ok'] is True
+    
+    readiness.draining = True
+    try:
+        response = client.get('/health/ready')
+        assert response.status_code == 503
+        assert 'draining' in json.loads(response.data)['reasons']
+    finally:
+        readiness.draining = False
+
+def test_cors_preflight(client):
+    """Test preflight is answered directly with a cacheable response"""
+    response = client.options('/api/passwords', headers={
+        'Origin': 'chrome-extension://abcdef',
+        'Access-Control-Request-Method': 'POST',
+        'Access-Control-Request-Headers': 'Content-Type, Authorization'
+    })
+    assert response.status_code == 204
+    assert response.headers['Access-Control-Allow-Origin'] == 'chrome-extension://abcdef'
+    assert int(response.headers['Access-Control-Max-Age']) > 0
+
+def test_request_id_header(client):
+    """Test correlation ID is generated or echoed back"""
+    response = client.get('/health')
+    assert len(response.headers['X-Request-ID']) == 32
+    
+    response = client.get('/health', headers={'X-Request-ID': 'abc-123'})
+    assert response.headers['X-Request-ID'] == 'abc-123'
+
 # ============================================================================
 # AUTHENTICATION TESTS
 # ============================================================================
@@ -65,13 +122,15 @@ def test_register_success(client):
     data = json.loads(response.data)
     assert 'token' in data
     assert data['user']['username'] == 'newuser'
+    # Hashing runs on the thread pool but is still timed in the request's trace
+    assert 'argon2;dur=' in response.headers['Server-Timing']
 
 def test_register_duplicate_username(client):
     """Test registration with duplicate username"""
     # First registration
     client.post('/api/auth/register',
         json={
-            'username': 'duplicate',
+            'username': 'myemail',
             'email': 'user1@example.com',
             'master_password': 'SecurePass123!'
         })
@@ -79,14 +138,65 @@ def test_register_duplicate_username(client):
     # Duplicate registration
     response = client.post('/api/auth/register',
         json={
-            'username': 'duplicate',
+            'username': 'myemail',
             'email': 'user2@example.com',
             'master_password': 'SecurePass123!'
         })
     
+    # Told apart by constraint name, not by "email" appearing in the message
+    assert response.status_code == 409
+    data = json.loads(response.data)
+    assert data['error'] == 'Username already exists'
+
+def test_register_duplicate_email(client):
+    """Test registration with duplicate email"""
+    client.post('/api/auth/register',
+        json={
+            'username': 'emailuser1',
+            'email': 'shared@example.com',
+            'master_password': 'SecurePass123!'
+        })
+    
+    response = client.post('/api/auth/register',
+        json={
+            'username': 'emailuser2',
+            'email': 'shared@example.com',
+            'master_password': 'SecurePass123!'
+        })
+    
     assert response.status_code == 409
     data = json.loads(response.data)
-    assert 'already exists' in data['error']
+    assert data['error'] == 'Email already exists'
+
+def test_username_available(client):
+    """Test username availability check"""
+    response = client.get('/api/auth/username-available?username=freshname')
+    assert response.status_code == 200
+    assert json.loads(response.data)['available'] is True
+    
+    client.post('/api/auth/register',
+        json={
+            'username': 'freshname',
+            'email': 'fresh@example.com',
+            'master_password': 'SecurePass123!'
+        })
+    
+    response = client.get('/api/auth/username-available?username=freshname')
+    assert response.status_code == 200
+    assert json.loads(response.data)['available'] is False
+
+def test_user_filter_syncs_other_workers(client, monkeypatch):
+    """Test the existence filter picks up users it did not register and distrusts misses when stale"""
+    from app import db_repo, user_filter, warm_user_filter
+    
+    warm_user_filter()
+    db_repo.create_user('elsewhere', 'elsewhere@example.com', 'hash', 'salt')
+    assert not user_filter.might_have_username('elsewhere')
+    warm_user_filter()
+    assert user_filter.might_have_username('elsewhere')
+    
+    monkeypatch.setattr(user_filter, 'sync_interval', 0)
+    assert user_filter.might_have_username('nobody-registered-this')
 
 def test_register_weak_password(client):
     """Test registration with weak password"""
@@ -123,6 +233,16 @@ def test_login_success(client):
     assert 'token' in data
     assert data['message'] == 'Login successful'
 
+def test_login_rate_limited_per_username(client, monkeypatch):
+    """Test repeated login attempts for one username are throttled"""
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    statuses = [
+        client.post('/api/auth/login', json={'username': 'victim', 'master_password': 'guess'}).status_code
+        for _ in range(11)
+    ]
+    assert statuses[0] == 401
+    assert statuses[-1] == 429
+
 def test_login_invalid_credentials(client):
     """Test login with invalid credentials"""
     response = client.post('/api/auth/login',
@@ -274,10 +394,277 @@ def test_search_passwords(client, auth_headers):
     assert len(data['passwords']) == 1
     assert 'github' in data['passwords'][0]['website_url']
 
+def test_filter_by_folder_and_tag(client, auth_headers):
+    """Test folder/tag filtering, pagination and folder counts"""
+    for i, (folder, tags) in enumerate([('Work', ['vpn']), ('Work', ['mail']), ('Home', ['mail'])]):
+        client.post('/api/passwords',
+            headers=auth_headers,
+            json={
+                'website_url': f'https://site{i}.com',
+                'encrypted_password': 'encrypted',
+                'iv': 'iv',
+                'folder': folder,
+                'tags': tags
+            })
+    
+    response = client.get('/api/passwords?folder=Work&limit=1', headers=auth_headers)
+    data = json.loads(response.data)
+    assert len(data['passwords']) == 1
+    response = client.get(f"/api/passwords?folder=Work&limit=1&after={data['next_after']}", headers=auth_headers)
+    assert len(json.loads(response.data)['passwords']) == 1
+    
+    response = client.get('/api/passwords?tag=mail', headers=auth_headers)
+    data = json.loads(response.data)
+    assert {p['folder'] for p in data['passwords']} == {'Work', 'Home'}
+    assert data['next_after'] is None
+    
+    response = client.get('/api/folders', headers=auth_headers)
+    data = json.loads(response.data)
+    assert data['folders'] == [{'name': 'Home', 'count': 1}, {'name': 'Work', 'count': 2}]
+    assert data['total'] == 3
+
+def test_password_history(client, auth_headers):
+    """Test updates archive previous versions, paged newest first"""
+    response = client.post('/api/passwords',
+        headers=auth_headers,
+        json={'website_url': 'https://example.com', 'encrypted_password': 'v1', 'iv': 'iv1'})
+    password_id = json.loads(response.data)['password']['id']
+    for version in ('v2', 'v3'):
+        client.put(f'/api/passwords/{password_id}', headers=auth_headers,
+                   json={'encrypted_password': version, 'iv': f'iv-{version}'})
+    client.put(f'/api/passwords/{password_id}', headers=auth_headers, json={'folder': 'Work'})
+    
+    response = client.get(f'/api/passwords/{password_id}/history?limit=1', headers=auth_headers)
+    data = json.loads(response.data)
+    assert [v['encrypted_password'] for v in data['versions']] == ['v2']
+    response = client.get(f"/api/passwords/{password_id}/history?before={data['next_before']}",
+                          headers=auth_headers)
+    data = json.loads(response.data)
+    assert [v['encrypted_password'] for v in data['versions']] == ['v1']
+    assert data['next_before'] is None
+    
+    response = client.get('/api/passwords', headers=auth_headers)
+    assert 'history_version' not in json.loads(response.data)['passwords'][0]
+
+def test_typeahead_prefix_search(client, auth_headers):
+    """Test typeahead matches name/host prefixes and sees new entries"""
+    client.post('/api/passwords',
+        headers=auth_headers,
+        json={'website_url': 'https://mail.google.com', 'website_name': 'Gmail',
+              'encrypted_password': 'encrypted1'})
+    
+    response = client.get('/api/passwords/typeahead?q=goo', headers=auth_headers)
+    assert [r['website_name'] for r in json.loads(response.data)['results']] == ['Gmail']
+    
+    client.post('/api/passwords',
+        headers=auth_headers,
+        json={'website_url': 'https://github.com', 'website_name': 'GitHub',
+              'encrypted_password': 'encrypted2'})
+    
+    response = client.get('/api/passwords/typeahead?q=gi', headers=auth_headers)
+    assert [r['website_name'] for r in json.loads(response.data)['results']] == ['GitHub']
+
+def test_password_health_reused(client, auth_headers):
+    """Test entries sharing a fingerprint are reported as reused"""
+    fingerprint = 'ab' * 32
+    ids = []
+    for url in ('https://a.example.com', 'https://b.example.com'):
+        response = client.post('/api/passwords',
+            headers=auth_headers,
+            json={
+                'website_url': url,
+                'encrypted_password': 'encrypted',
+                'fingerprint': fingerprint
+            })
+        ids.append(json.loads(response.data)['password']['id'])
+    
+    response = client.get('/api/passwords/health', headers=auth_headers)
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['reused'] == [{'fingerprint': fingerprint, 'password_ids': sorted(ids)}]
+    
+    # Opening an entry records last_used but does not make an old password fresh
+    user_id = db_repo.get_user_by_username('testuser')['id']
+    changed_before = datetime.utcnow()
+    client.get(f'/api/passwords/{ids[0]}', headers=auth_headers)
+    stale = db_repo.get_password_health(user_id, changed_before)['stale']
+    assert {entry['id'] for entry in stale} == set(ids)
+
+def test_attachment_upload_and_download(client, auth_headers):
+    """Test attachments round-trip and are kept out of the password list"""
+    response = client.post('/api/passwords',
+        headers=auth_headers,
+        json={'website_url': 'https://example.com', 'encrypted_password': 'encrypted'})
+    password_id = json.loads(response.data)['password']['id']
+    
+    content = b'encrypted-bytes' * 1000
+    response = client.post(f'/api/passwords/{password_id}/attachments?filename=codes.bin',
+        headers=auth_headers, data=content, content_type='application/octet-stream')
+    assert response.status_code == 201
+    attachment = json.loads(response.data)['attachment']
+    assert attachment['size'] == len(content)
+    
+    response = client.get(f"/api/attachments/{attachment['id']}",
+        headers={**auth_headers, 'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert response.data == content[:10]
+    
+    response = client.get(f'/api/passwords/{password_id}/attachments', headers=auth_headers)
+    assert json.loads(response.data)['storage_used'] == len(content)
+    
+    # A rotation would leave them encrypted under the old master password
+    response = client.post('/api/vault/rotations', headers=auth_headers,
+        json={'current_master_password': 'TestPass123!', 'new_master_password': 'NewPass456!'})
+    assert response.status_code == 409
+
+def test_master_password_rotation(client, auth_headers):
+    """Test chunked re-encryption is invisible until commit, then swaps everything"""
+    ids = [json.loads(client.post('/api/passwords',
+        headers=auth_headers,
+        json={'website_url': f'https://site{i}.com', 'encrypted_password': 'old', 'iv': 'iv'}
+    ).data)['password']['id'] for i in range(3)]
+    
+    response = client.post('/api/vault/rotations', headers=auth_headers,
+        json={'current_master_password': 'TestPass123!', 'new_master_password': 'NewPass456!'})
+    assert response.status_code == 201
+    rotation_id = json.loads(response.data)['rotation_id']
+    
+    fields = {'username': None, 'encrypted_password': 'new', 'iv': 'iv2', 'notes': None, 'fingerprint': None}
+    chunks = [[{'id': ids[0], **fields}], [{'id': i, **fields} for i in ids[1:]]]
+    response = client.put(f'/api/vault/rotations/{rotation_id}/chunks/0', headers=auth_headers,
+        json={'entries': [{'id': ids[0], 'encrypted_password': 'new', 'iv': 'iv2'}]})
+    assert response.status_code == 400
+    client.put(f'/api/vault/rotations/{rotation_id}/chunks/0', headers=auth_headers, json={'entries': chunks[0]})
+    response = client.post(f'/api/vault/rotations/{rotation_id}/commit', headers=auth_headers)
+    assert response.status_code == 409
+    assert json.loads(response.data)['missing'] == sorted(ids[1:])
+    
+    # Resume after a "disconnect"
+    status = json.loads(client.get(f'/api/vault/rotations/{rotation_id}', headers=auth_headers).data)
+    assert status['next_chunk'] == 1
+    client.put(f'/api/vault/rotations/{rotation_id}/chunks/1', headers=auth_headers, json={'entries': chunks[1]})
+    # Opening an entry (autofill) is not an edit
+    client.get(f'/api/passwords/{ids[1]}', headers=auth_headers)
+    
+    # An edit after staging is not overwritten with the stale re-encryption
+    client.put(f'/api/passwords/{ids[0]}', headers=auth_headers, json={'encrypted_password': 'edited'})
+    response = client.post(f'/api/vault/rotations/{rotation_id}/commit', headers=auth_headers)
+    assert response.status_code == 409
+    assert json.loads(response.data)['changed'] == [ids[0]]
+    client.put(f'/api/vault/rotations/{rotation_id}/chunks/0', headers=auth_headers, json={'entries': chunks[0]})
+    response = client.post(f'/api/vault/rotations/{rotation_id}/commit', headers=auth_headers)
+    assert json.loads(response.data)['updated'] == 3
+    
+    response = client.post('/api/auth/login', json={'username': 'testuser', 'master_password': 'NewPass456!'})
+    headers = {'Authorization': f"Bearer {json.loads(response.data)['token']}"}
+    passwords = json.loads(client.get('/api/passwords', headers=headers).data)['passwords']
+    assert {p['encrypted_password'] for p in passwords} == {'new'}
+
+# ============================================================================
+# QUERY PLAN TESTS
+# ============================================================================
+
+def test_repository_queries_use_indexes(client, auth_headers):
+    """Test that repository read queries never fall back to full scans"""
+    from app import db_repo
+    
+    user = db_repo.get_user_by_username('testuser')
+    client.post('/api/passwords',
+        headers=auth_headers,
+        json={
+            'website_url': 'https://indexed.com',
+            'encrypted_password': 'encrypted',
+            'iv': 'iv'
+        })
+    
+    if app.config['DATABASE_TYPE'] == 'mongodb':
+        from database.query_plans import mongo_collection_scans
+        assert not mongo_collection_scans(db_repo.users, {'username': 'testuser'})
+        assert not mongo_collection_scans(db_repo.users, {'email': 'test@example.com'})
+        assert not mongo_collection_scans(db_repo.passwords, {'user_id': user['id']})
+        assert not mongo_collection_scans(db_repo.passwords, {
+            'user_id': user['id'],
+            'website_url': {'$regex': 'indexed', '$options': 'i'}
+        })
+    else:
+        from database.query_plans import capture_statements, postgres_seq_scans
+        engine = db_repo.manager.engine
+        with capture_statements(engine) as statements:
+            db_repo.get_user_by_username('testuser')
+            db_repo.get_user_by_email('test@example.com')
+            db_repo.get_passwords(user['id'])
+            db_repo.search_passwords(user['id'], 'indexed')
+            db_repo.get_password_count(user['id'])
+        
+        assert statements
+        for statement, parameters in statements:
+            assert postgres_seq_scans(engine, statement, parameters) == [], statement
+
+# ============================================================================
+# DATA TRANSFER TESTS
+# ============================================================================
+
+def test_bulk_load_replay_is_noop(client, auth_headers):
+    """Test replaying an exported batch inserts nothing and keeps checksums stable"""
+    from app import db_repo
+    from database.transfer import user_checksums
+    
+    client.post('/api/passwords',
+        headers=auth_headers,
+        json={
+            'website_url': 'https://copied.com',
+            'encrypted_password': 'encrypted',
+            'iv': 'iv'
+        })
+    users = list(db_repo.iter_users())
+    before = list(user_checksums(db_repo, (None, None)))
+    
+    data = db_repo.export_user_data([user['id'] for user in users])
+    loaded = db_repo.bulk_load(users, data['password_entries'], data['attachments'])
+    
+    assert loaded == {'users': 0, 'password_entries': 0, 'attachments': 0}
+    assert list(user_checksums(db_repo, (None, None))) == before
+
+def test_backup_manifest_checksums(client, auth_headers, tmp_path):
+    """Test a backup records its rows, restoring it over the source inserts nothing and history survives"""
+    from database.backup import backup, restore
+    from database.db_factory import get_repository
+    
+    response = client.post('/api/passwords', headers=auth_headers,
+        json={'website_url': 'https://kept.com', 'encrypted_password': 'v1', 'iv': 'iv'})
+    password_id = json.loads(response.data)['password']['id']
+    client.put(f'/api/passwords/{password_id}', headers=auth_headers, json={'encrypted_password': 'v2'})
+    
+    config = get_config('testing')
+    backup(lambda: get_repository(config), str(tmp_path), workers=2, partitions=4)
+    
+    manifest = json.loads((tmp_path / 'manifest.json').read_text())
+    assert manifest['totals']['users'] == 1
+    assert manifest['totals']['password_history'] == 1
+    assert len(manifest['chunks']) == 4
+    
+    report = restore(lambda: get_repository(config), str(tmp_path), workers=2)
+    assert report['inserted'] == {'users': 0, 'password_entries': 0, 'attachments': 0, 'password_history': 0}
+    
+    drop_schema()
+    db_repo.migrate()
+    report = restore(lambda: get_repository(config), str(tmp_path), workers=2)
+    assert report['inserted']['password_history'] == 1
+    response = client.get(f'/api/passwords/{password_id}/history', headers=auth_headers)
+    assert [version['encrypted_password'] for version in json.loads(response.data)['versions']] == ['v1']
+
 # ============================================================================
 # SECURITY TESTS
 # ============================================================================
 
+def test_logout_revokes_token(client, auth_headers):
+    """Test a logged-out token is rejected"""
+    response = client.post('/api/auth/logout', headers=auth_headers)
+    assert response.status_code == 200
+    
+    response = client.get('/api/passwords', headers=auth_headers)
+    assert response.status_code == 401
+
 def test_unauthorized_access(client):
     """Test accessing protected endpoints without authentication"""
     response = client.get('/api/passwords')
@@ -289,6 +676,49 @@ def test_invalid_token(client):
     response = client.get('/api/passwords', headers=headers)
     assert response.status_code == 401
 
+def test_breached_password_rejected(tmp_path):
+    """Test the breach index rejects listed passwords only"""
+    from breach_filter import BreachedPasswordFilter, build_index, password_key
+    from crypto_utils import validate_password_strength
+    path = str(tmp_path / 'breached.idx')
+    build_index([password_key('Password123'), password_key('Summer2024')], path)
+    breached = BreachedPasswordFilter(path)
+    
+    assert validate_password_strength('Password123', breached)[0] is False
+    assert validate_password_strength('Unlisted123', breached)[0] is True
+
+def test_audit_log(client, auth_headers):
+    """Test security events are buffered, written in bulk and queryable per user"""
+    from app import audit, db_repo
+    from audit_log import AuditLog
+    client.post('/api/auth/login', json={'username': 'testuser', 'master_password': 'WrongPass123!'})
+    client.post('/api/passwords',
+        headers=auth_headers,
+        json={'website_url': 'https://example.com', 'encrypted_password': 'encrypted', 'iv': 'iv'})
+    assert audit.flush() >= 4
+    
+    response = client.get('/api/audit', headers=auth_headers)
+    events = [event['event'] for event in json.loads(response.data)['events']]
+    assert {'auth.register', 'auth.login_failed', 'token.used', 'vault.entry_created'} <= set(events)
+    response = client.get('/api/audit?event=vault.entry_created&limit=1', headers=auth_headers)
+    assert len(json.loads(response.data)['events']) == 1
+    
+    full = AuditLog(db_repo, capacity=2)
+    for i in range(3):
+        full.record('test', attempt=i)
+    assert full.pending() == 2 and full.dropped == 1
+    
+    class FailingRepo:
+        def insert_audit_events(self, events):
+            raise RuntimeError('database down')
+    
+    failing = AuditLog(FailingRepo(), max_attempts=2)
+    failing.record('test')
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            failing.flush()
+    assert failing.pending() == 0
+
 def test_password_limit(client, auth_headers):
     """Test password entry limit per user"""
     # This test would create MAX_PASSWORD_ENTRIES + 1 passwords
@@ -0,0 +1,147 @@
+"""
+JWT revocation list
+
+Revoked token IDs (jti) and per-user "signed out everywhere" cutoffs are
+held in memory, so token_required checks them with two dict lookups and no
+database round trip. Revocations are written through to the repository;
+each worker loads them at startup and polls for new ones in the background,
+so a logout in one worker reaches the others within one sync interval.
+Entries are evicted in expiry order once the tokens they cover have expired.
+"""
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from database.base_repository import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+USER_KEY_PREFIX = 'user:'
+
+
+def _epoch(value: datetime) -> float:
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _utc(epoch: float) -> datetime:
+    return datetime.utcfromtimestamp(epoch)
+
+
+class RevocationList:
+    def __init__(self, repo, token_lifetime_seconds: float, sync_interval: float = 5.0):
+        self.repo = repo
+        self.token_lifetime = token_lifetime_seconds
+        self.sync_interval = sync_interval
+        self._tokens: Dict[str, float] = {}              # jti -> token expiry
+        self._user_cutoffs: Dict[str, float] = {}        # user_id -> tokens issued at/before are revoked
+        self._expiry_heap = []                           # (expires, key)
+        self._expiry: Dict[str, float] = {}              # key -> expiry currently on the heap
+        self._last_sync: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def is_revoked(self, payload: Dict[str, Any]) -> bool:
+        """O(1) check of a decoded token payload"""
+        jti = payload.get('jti')
+        if jti is not None and jti in self._tokens:
+            return True
+        cutoff = self._user_cutoffs.get(payload.get('user_id'))
+        return cutoff is not None and payload.get('iat', 0) <= cutoff
+
+    def revoke(self, payload: Dict[str, Any]):
+        """Revoke a single token (logout)"""
+        jti = payload.get('jti')
+        if jti is None:
+            # Tokens issued before jti was added can only be revoked per user
+            self.revoke_all(payload['user_id'])
+            return
+        expires = float(payload['exp'])
+        self.repo.revoke_token(jti, payload['user_id'], datetime.utcnow(), _utc(expires))
+        self._apply(jti, payload['user_id'], time.time(), expires)
+
+    def revoke_all(self, user_id: str):
+        """Revoke every token issued to a user so far (sign out all devices)"""
+        now = time.time()
+        expires = now + self.token_lifetime
+        self.repo.revoke_token(USER_KEY_PREFIX + user_id, user_id, _utc(now), _utc(expires))
+        self._apply(USER_KEY_PREFIX + user_id, user_id, now, expires)
+
+    def _apply(self, key: str, user_id: str, revoked_at: float, expires: float):
+        with self._lock:
+            if key.startswith(USER_KEY_PREFIX):
+                self._user_cutoffs[user_id] = max(revoked_at, self._user_cutoffs.get(user_id, 0))
+            else:
+                self._tokens[key] = expires
+            if self._expiry.get(key) != expires:
+                self._expiry[key] = expires
+                heapq.heappush(self._expiry_heap, (expires, key))
+
+    def _evict(self, now: float):
+        """Drop entries whose tokens have expired, soonest first"""
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                expires, key = heapq.heappop(heap)
+                if self._expiry.get(key) != expires:
+                    continue  # superseded by a later revocation of the same key
+                del self._expiry[key]
+                if key.startswith(USER_KEY_PREFIX):
+                    self._user_cutoffs.pop(key[len(USER_KEY_PREFIX):], None)
+                else:
+                    self._tokens.pop(key, None)
+
+    def _since(self) -> Optional[datetime]:
+        # Overlap the window so rows committed late (or by a skewed clock) are not missed
+        return self._last_sync - timedelta(seconds=self.sync_interval * 2) if self._last_sync else None
+
+    def _merge(self, rows, started: datetime):
+        for row in rows:
+            self._apply(row['key'], row['user_id'],
+                        _epoch(parse_timestamp(row['revoked_at'])),
+                        _epoch(parse_timestamp(row['expires_at'])))
+        self._last_sync = started
+        self._evict(time.time())
+
+    def sync(self):
+        """Pull revocations recorded by other workers since the last sync"""
+        started = datetime.utcnow()
+        self._merge(self.repo.get_token_revocations(self._since()), started)
+
+    async def sync_async(self):
+        """sync() against an asyncio repository (the ASGI app)"""
+        started = datetime.utcnow()
+        self._merge(await self.repo.get_token_revocations(self._since()), started)
+
+    def run(self, sleep=time.sleep):
+        """Background loop: keep in sync and purge expired rows now and then"""
+        purge_every = max(int(3600 / self.sync_interval), 1)
+        iteration = 0
+        while True:
+            try:
+                self.sync()
+                if iteration % purge_every == 0:
+                    self.repo.purge_token_revocations(datetime.utcnow())
+            except Exception:
+                logger.exception("Token revocation sync failed")
+            iteration += 1
+            sleep(self.sync_interval)
+
+    async def run_async(self):
+        """run() as an asyncio task"""
+        purge_every = max(int(3600 / self.sync_interval), 1)
+        iteration = 0
+        while True:
+            try:
+                await self.sync_async()
+                if iteration % purge_every == 0:
+                    await self.repo.purge_token_revocations(datetime.utcnow())
+            except Exception:
+                logger.exception("Token revocation sync failed")
+            iteration += 1
+            await asyncio.sleep(self.sync_interval)
+
+    def __len__(self):
+        return len(self._tokens) + len(self._user_cutoffs)
@@ -0,0 +1,192 @@
+"""
+Lightweight request tracing: spans, Server-Timing headers and span export
+"""
+import json
+import os
+import queue
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+from structured_logging import _real_thread_primitives
+
+# Server-Timing metric for each span category, in header order
+SERVER_TIMING_CATEGORIES = ('auth', 'argon2', 'db', 'serialize', 'compress')
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.root_id = self.trace_id[:16]
+        self.spans = []
+        self.stack = []
+        self.totals = {}
+        self.started = time.perf_counter()
+
+
+def _current_trace():
+    return g.get('_trace') if has_request_context() else None
+
+
+@contextmanager
+def span(name, category=None, **attributes):
+    """Time a block as a span of the current request's trace (no-op outside requests)"""
+    trace = _current_trace()
+    if trace is None:
+        yield
+        return
+
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = trace.stack[-1] if trace.stack else trace.root_id
+    trace.stack.append(span_id)
+    start_wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        trace.stack.pop()
+        if category:
+            trace.totals[category] = trace.totals.get(category, 0.0) + duration_ms
+        trace.spans.append({
+            'trace_id': trace.trace_id,
+            'span_id': span_id,
+            'parent_id': parent_id,
+            'name': name,
+            'category': category,
+            'start': start_wall,
+            'duration_ms': round(duration_ms, 3),
+            'attributes': attributes
+        })
+
+
+def traced(name, category=None):
+    """Decorator form of span()"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedRepository:
+    """Proxy recording a 'db' span around every repository method call"""
+
+    def __init__(self, repo):
+        self._repo = repo
+
+    def __getattr__(self, name):
+        attr = getattr(self._repo, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        @wraps(attr)
+        def call(*args, **kwargs):
+            with span(f'repository.{name}', 'db'):
+                return attr(*args, **kwargs)
+        return call
+
+
+class TracedJSONProvider(DefaultJSONProvider):
+    """JSON provider recording jsonify() serialization as a span"""
+
+    def response(self, *args, **kwargs):
+        with span('jsonify', 'serialize'):
+            return super().response(*args, **kwargs)
+
+
+class JsonlSpanExporter:
+    """
+    Stand-in for a trace collector: finished spans are queued and appended
+    to a JSON-lines file by a background OS thread, off the request path
+    (and off the eventlet hub, so file writes never stall other requests).
+    """
+
+    def __init__(self, path, max_queue=10000):
+        self.path = path
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._start()
+        if hasattr(os, 'register_at_fork'):
+            # The writer thread does not survive fork; give each child its own
+            os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        real_threading, real_queue = _real_thread_primitives()
+        # Unpatched queue has its own Full class
+        self._full = real_queue.Full
+        self.queue = real_queue.Queue(maxsize=self.max_queue)
+        real_threading.Thread(target=self._run, name='span-exporter', daemon=True).start()
+
+    def export(self, spans):
+        try:
+            self.queue.put_nowait(spans)
+        except self._full:
+            self.dropped += len(spans)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty() and len(batch) < 100:
+                batch.append(self.queue.get_nowait())
+            self._write(batch)
+
+    def _write(self, batch):
+        with open(self.path, 'a') as f:
+            for spans in batch:
+                for s in spans:
+                    f.write(json.dumps(s) + '\n')
+
+    def flush(self):
+        """Write out whatever is still queued (called before a worker exits)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+
+def init_app(app, server_timing=True, exporter=None):
+    """Start a trace per request and emit Server-Timing / export spans at the end"""
+    app.json = TracedJSONProvider(app)
+
+    @app.before_request
+    def start_trace():
+        g._trace = Trace()
+
+    @app.after_request
+    def finish_trace(response):
+        trace = _current_trace()
+        if trace is None:
+            return response
+
+        total_ms = (time.perf_counter() - trace.started) * 1000
+        if server_timing:
+            metrics = [f'{cat};dur={trace.totals[cat]:.1f}'
+                       for cat in SERVER_TIMING_CATEGORIES if cat in trace.totals]
+            metrics.append(f'total;dur={total_ms:.1f}')
+            response.headers['Server-Timing'] = ', '.join(metrics)
+            response.headers['Timing-Allow-Origin'] = request.headers.get('Origin', '*')
+
+        if exporter is not None:
+            trace.spans.append({
+                'trace_id': trace.trace_id,
+                'span_id': trace.root_id,
+                'parent_id': None,
+                'name': f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+                'category': 'request',
+                'start': time.time() - total_ms / 1000,
+                'duration_ms': round(total_ms, 3),
+                'attributes': {'status': response.status_code}
+            })
+            exporter.export(trace.spans)
+        return response
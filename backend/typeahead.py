@@ -0,0 +1,172 @@
+"""
+Typeahead over site names and hosts
+
+Each user's vault is indexed as sorted parallel arrays of tokens and entry
+ids, so a prefix lookup is two bisects and a slice. Indexes are built lazily
+from the repository, held in a bounded LRU, patched in place on writes made
+through this worker, and rebuilt on a miss or once they are older than the
+TTL (writes handled by other workers become visible after at most one TTL).
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def entry_tokens(website_name: Optional[str], website_url: Optional[str]) -> set:
+    """Lowercased words of the site name plus the host and its labels"""
+    tokens = set(_WORD.findall((website_name or '').lower()))
+    url = (website_url or '').strip().lower()
+    host = urlsplit(url if '//' in url else '//' + url).hostname or ''
+    if host:
+        tokens.add(host)
+        if host.startswith('www.'):
+            tokens.add(host[4:])
+        tokens.update(label for label in host.split('.') if label and label != 'www')
+    return tokens
+
+
+class VaultIndex:
+    """Prefix index over one user's entries"""
+
+    def __init__(self, entries: Iterable[Dict[str, Any]] = ()):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.built_at = time.monotonic()
+        pairs = []
+        for entry in entries:
+            pairs.extend(self._add(entry))
+        pairs.sort()
+        self.tokens: List[str] = [token for token, _ in pairs]
+        self.ids: List[str] = [entry_id for _, entry_id in pairs]
+
+    @staticmethod
+    def _summary(entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': entry['id'],
+            'website_name': entry.get('website_name'),
+            'website_url': entry.get('website_url'),
+            'last_used': entry.get('last_used')
+        }
+
+    def _add(self, entry: Dict[str, Any]) -> List[tuple]:
+        """Register an entry; returns its (token, id) pairs"""
+        summary = self._summary(entry)
+        self.entries[summary['id']] = summary
+        return [(token, summary['id']) for token in entry_tokens(summary['website_name'], summary['website_url'])]
+
+    def _find(self, token: str, entry_id: str) -> int:
+        """Position of a (token, id) pair, or of where it belongs"""
+        lo = bisect.bisect_left(self.tokens, token)
+        hi = bisect.bisect_right(self.tokens, token, lo)
+        while lo < hi and self.ids[lo] < entry_id:
+            lo += 1
+        return lo
+
+    def remove(self, entry_id: str):
+        summary = self.entries.pop(entry_id, None)
+        if summary is None:
+            return
+        for token in entry_tokens(summary['website_name'], summary['website_url']):
+            i = self._find(token, entry_id)
+            if i < len(self.tokens) and self.tokens[i] == token and self.ids[i] == entry_id:
+                del self.tokens[i]
+                del self.ids[i]
+
+    def upsert(self, entry: Dict[str, Any]):
+        self.remove(entry['id'])
+        for token, entry_id in self._add(entry):
+            i = self._find(token, entry_id)
+            self.tokens.insert(i, token)
+            self.ids.insert(i, entry_id)
+
+    def touch(self, entry_id: str, last_used: Optional[str]):
+        if entry_id in self.entries:
+            self.entries[entry_id]['last_used'] = last_used
+
+    def _prefix_ids(self, prefix: str) -> set:
+        lo = bisect.bisect_left(self.tokens, prefix)
+        hi = bisect.bisect_left(self.tokens, prefix + '\uffff', lo)
+        return set(self.ids[lo:hi])
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Entries matching every query word as a token prefix, most recently used first"""
+        words = _WORD.findall(query.lower())
+        if not words:
+            return []
+        matches = None
+        for word in sorted(words, key=len, reverse=True):
+            ids = self._prefix_ids(word)
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        return heapq.nlargest(limit, (self.entries[i] for i in matches),
+                              key=lambda e: (e['last_used'] or '', e['website_name'] or ''))
+
+
+class TypeaheadCache:
+    """Bounded LRU of per-user VaultIndex objects"""
+
+    def __init__(self, loader: Callable[[str], List[Dict[str, Any]]], max_users: int = 1000,
+                 ttl_seconds: float = 60.0):
+        self.loader = loader
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._indexes: 'OrderedDict[str, VaultIndex]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id: str) -> Optional[VaultIndex]:
+        index = self._indexes.get(user_id)
+        if index is not None and time.monotonic() - index.built_at > self.ttl_seconds:
+            del self._indexes[user_id]
+            return None
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+        return index
+
+    def get(self, user_id: str) -> VaultIndex:
+        with self._lock:
+            index = self._cached(user_id)
+        if index is not None:
+            return index
+
+        index = VaultIndex(self.loader(user_id))
+        with self._lock:
+            self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def search(self, user_id: str, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        index = self.get(user_id)
+        with self._lock:
+            return index.search(query, limit)
+
+    # Write hooks: patch a cached index in place; uncached users are built on next lookup
+    def on_upsert(self, user_id: str, entry: Dict[str, Any]):
+        with self._lock:
+            index = self._cached(user_id)
+            if index is not None:
+                index.upsert(entry)
+
+    def on_delete(self, user_id: str, entry_id: str):
+        with self._lock:
+            index = self._cached(user_id)
+            if index is not None:
+                index.remove(entry_id)
+
+    def on_used(self, user_id: str, entry_id: str, last_used: Optional[str]):
+        with self._lock:
+            index = self._cached(user_id)
+            if index is not None:
+                index.touch(entry_id, last_used)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._indexes.pop(user_id, None)
@@ -0,0 +1,126 @@
+"""
+Resumable vault re-encryption for master password changes
+
+Changing the master password means the client re-encrypts every entry.
+Instead of one PUT per entry, which leaves a mixed vault behind when the
+client drops out halfway, the client opens a rotation, uploads re-encrypted
+entries in numbered chunks to a staging area and commits: the entries and
+the new master password hash are swapped in one transaction. Re-sending a
+chunk overwrites it, so after a disconnect the client reads the rotation's
+status and resumes from the first unacknowledged chunk. Staging records each
+entry's updated_at; commit refuses entries edited since, so the client
+re-reads and re-sends those instead of overwriting the edit with stale
+ciphertext. Abandoned rotations expire and are purged in the background.
+"""
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from crypto_utils import is_valid_fingerprint
+from database.base_repository import ROTATED_FIELDS
+
+logger = logging.getLogger(__name__)
+
+
+def next_chunk(chunks: List[int]) -> int:
+    """Lowest chunk number not yet acknowledged, given the acknowledged ones in ascending order"""
+    expected = 0
+    for seq in chunks:
+        if seq != expected:
+            break
+        expected += 1
+    return expected
+
+
+def validate_chunk(entries: Any, max_entries: int) -> List[Dict[str, Any]]:
+    """
+    Reduce a chunk to 'id' plus ROTATED_FIELDS per entry; raises ValueError if
+    malformed. Every field must be present (null where the entry has none):
+    commit overwrites them all and drops the history that could restore them.
+    """
+    if not isinstance(entries, list) or not 0 < len(entries) <= max_entries:
+        raise ValueError(f"entries must be a list of 1 to {max_entries} items")
+    cleaned = []
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get('id'), str) or not entry.get('encrypted_password'):
+            raise ValueError("Each entry needs an id and encrypted_password")
+        missing = [field for field in ROTATED_FIELDS if field not in entry]
+        if missing:
+            raise ValueError(f"Entry {entry['id']} is missing {', '.join(missing)}")
+        if entry.get('fingerprint') and not is_valid_fingerprint(entry['fingerprint']):
+            raise ValueError('Invalid password fingerprint')
+        cleaned.append({'id': entry['id'], **{field: entry[field] for field in ROTATED_FIELDS},
+                        'fingerprint': entry['fingerprint'] or None})
+    if len({entry['id'] for entry in cleaned}) != len(cleaned):
+        raise ValueError("Duplicate entry id in chunk")
+    return cleaned
+
+
+class VaultRotations:
+    def __init__(self, repo, ttl_seconds: float = 3600, max_chunk_entries: int = 200,
+                 purge_interval: float = 300):
+        self.repo = repo
+        self.ttl_seconds = ttl_seconds
+        self.max_chunk_entries = max_chunk_entries
+        self.purge_interval = purge_interval
+
+    def open(self, user_id: str, password_hash: str, salt: str) -> Dict[str, Any]:
+        """Start a rotation to the given (already hashed) master password, replacing any open one"""
+        rotation_id = str(uuid.uuid4())
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl_seconds)
+        self.repo.create_rotation(rotation_id, user_id, password_hash, salt, expires_at)
+        return {
+            'rotation_id': rotation_id,
+            'expires_at': expires_at.isoformat(),
+            'next_chunk': 0,
+            'max_chunk_entries': self.max_chunk_entries
+        }
+
+    def status(self, rotation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        rotation = self.repo.get_rotation(rotation_id, user_id)
+        if rotation is None:
+            return None
+        return {
+            'rotation_id': rotation['id'],
+            'expires_at': rotation['expires_at'],
+            'chunks': rotation['chunks'],
+            'staged': rotation['staged'],
+            'next_chunk': next_chunk(rotation['chunks']),
+            'max_chunk_entries': self.max_chunk_entries
+        }
+
+    def put_chunk(self, rotation_id: str, user_id: str, seq: int, entries: Any) -> Optional[Dict[str, Any]]:
+        """Stage one chunk; None if the rotation is unknown or expired"""
+        entries = validate_chunk(entries, self.max_chunk_entries)
+        rotation = self.repo.get_rotation(rotation_id, user_id)
+        if rotation is None:
+            return None
+        staged = self.repo.stage_rotation_chunk(rotation_id, user_id, seq, entries)
+        return {
+            'chunk': seq,
+            'entries': staged,
+            'next_chunk': next_chunk(sorted(set(rotation['chunks']) | {seq}))
+        }
+
+    def commit(self, rotation_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return self.repo.commit_rotation(rotation_id, user_id)
+
+    def abort(self, rotation_id: str, user_id: str) -> bool:
+        return self.repo.delete_rotation(rotation_id, user_id)
+
+    def purge(self) -> int:
+        removed = self.repo.purge_rotations(datetime.utcnow())
+        if removed:
+            logger.info(f"Purged {removed} expired vault rotations")
+        return removed
+
+    def run(self, sleep=time.sleep):
+        """Background loop: purge expired rotations and their staged entries"""
+        while True:
+            try:
+                self.purge()
+            except Exception:
+                logger.exception("Vault rotation purge failed")
+            sleep(self.purge_interval)
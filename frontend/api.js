@@ -2,6 +2,18 @@ class APIClient {
   constructor(baseURL = 'http://localhost:5000') {
     this.baseURL = baseURL
     this.token = null
+    this.lastTiming = null
+  }
+
+  parseServerTiming(header) {
+    const timing = {}
+    if (!header) return timing
+    for (const metric of header.split(',')) {
+      const [name, ...params] = metric.trim().split(';')
+      const dur = params.find((p) => p.trim().startsWith('dur='))
+      timing[name] = dur ? parseFloat(dur.trim().slice(4)) : null
+    }
+    return timing
   }
 
   async setToken(token) {
@@ -38,6 +50,7 @@ class APIClient {
     if (token) headers['Authorization'] = `Bearer ${token}`
 
     try {
+      const started = performance.now()
       const response = await fetch(`${this.baseURL}${endpoint}`, {
         ...options,
         headers,
@@ -45,6 +58,11 @@ class APIClient {
         credentials: 'include',
       })
       const data = await response.json()
+      this.lastTiming = {
+        endpoint,
+        clientMs: performance.now() - started,
+        server: this.parseServerTiming(response.headers.get('Server-Timing')),
+      }
       if (!response.ok) throw new Error(data.error || 'Request failed')
       return data
     } catch (error) {
@@ -75,6 +93,13 @@ class APIClient {
   }
 
   async logout() {
+    try {
+      if (await this.getToken()) {
+        await this.request('/api/auth/logout', { method: 'POST' })
+      }
+    } catch (error) {
+      console.warn('Server logout failed:', error.message)
+    }
     await this.clearToken()
   }
 
@@ -82,6 +107,19 @@ class APIClient {
     return await this.request('/api/passwords', { method: 'GET' })
   }
 
+  // One page filtered by folder and/or tag; pass the previous page's next_after to continue
+  async listPasswords({ folder, tag, limit = 100, after } = {}) {
+    const params = new URLSearchParams({ limit: String(limit) })
+    if (folder) params.set('folder', folder)
+    if (tag) params.set('tag', tag)
+    if (after) params.set('after', after)
+    return await this.request(`/api/passwords?${params}`, { method: 'GET' })
+  }
+
+  async getFolders() {
+    return await this.request('/api/folders', { method: 'GET' })
+  }
+
   async createPassword(passwordData) {
     return await this.request('/api/passwords', {
       method: 'POST',
@@ -96,6 +134,68 @@ class APIClient {
     })
   }
 
+  // Security audit trail, newest first; filters: since, until, event, limit, before (next_before)
+  async getAuditEvents(filters = {}) {
+    const params = new URLSearchParams(filters).toString()
+    return await this.request(`/api/audit${params ? `?${params}` : ''}`, { method: 'GET' })
+  }
+
+  // Previous versions of an entry, newest first; pass next_before to page further back
+  async getPasswordHistory(passwordId, before = null, limit = 20) {
+    const params = `limit=${limit}` + (before === null ? '' : `&before=${before}`)
+    return await this.request(`/api/passwords/${passwordId}/history?${params}`, { method: 'GET' })
+  }
+
+  async typeahead(query, limit = 10) {
+    const params = `q=${encodeURIComponent(query)}&limit=${limit}`
+    return await this.request(`/api/passwords/typeahead?${params}`, { method: 'GET' })
+  }
+
+  async getPasswordHealth(staleDays) {
+    const query = staleDays ? `?stale_days=${staleDays}` : ''
+    return await this.request(`/api/passwords/health${query}`, { method: 'GET' })
+  }
+
+  // Attachments are sent and received as raw (already encrypted) bytes
+  async uploadAttachment(passwordId, filename, encryptedBytes) {
+    const token = await this.getToken()
+    const response = await fetch(
+      `${this.baseURL}/api/passwords/${passwordId}/attachments?filename=${encodeURIComponent(filename)}`,
+      {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/octet-stream',
+          Authorization: `Bearer ${token}`,
+        },
+        body: encryptedBytes,
+        mode: 'cors',
+        credentials: 'include',
+      }
+    )
+    const data = await response.json()
+    if (!response.ok) throw new Error(data.error || 'Upload failed')
+    return data
+  }
+
+  async getAttachments(passwordId) {
+    return await this.request(`/api/passwords/${passwordId}/attachments`, { method: 'GET' })
+  }
+
+  async downloadAttachment(attachmentId) {
+    const token = await this.getToken()
+    const response = await fetch(`${this.baseURL}/api/attachments/${attachmentId}`, {
+      headers: { Authorization: `Bearer ${token}` },
+      mode: 'cors',
+      credentials: 'include',
+    })
+    if (!response.ok) throw new Error('Download failed')
+    return await response.arrayBuffer()
+  }
+
+  async deleteAttachment(attachmentId) {
+    return await this.request(`/api/attachments/${attachmentId}`, { method: 'DELETE' })
+  }
+
   async deletePassword(passwordId) {
     return await this.request(`/api/passwords/${passwordId}`, {
       method: 'DELETE',
@@ -108,4 +208,48 @@ class APIClient {
       body: JSON.stringify({ url }),
     })
   }
+
+  // Master password change: open, upload re-encrypted entries in chunks, commit
+  async openRotation(currentMasterPassword, newMasterPassword) {
+    return await this.request('/api/vault/rotations', {
+      method: 'POST',
+      body: JSON.stringify({
+        current_master_password: currentMasterPassword,
+        new_master_password: newMasterPassword,
+      }),
+    })
+  }
+
+  async getRotation(rotationId) {
+    return await this.request(`/api/vault/rotations/${rotationId}`, { method: 'GET' })
+  }
+
+  async putRotationChunk(rotationId, seq, entries) {
+    return await this.request(`/api/vault/rotations/${rotationId}/chunks/${seq}`, {
+      method: 'PUT',
+      body: JSON.stringify({ entries }),
+    })
+  }
+
+  async commitRotation(rotationId) {
+    const data = await this.request(`/api/vault/rotations/${rotationId}/commit`, { method: 'POST' })
+    // Every token was revoked; the caller signs in again with the new master password
+    await this.clearToken()
+    return data
+  }
+
+  async abortRotation(rotationId) {
+    return await this.request(`/api/vault/rotations/${rotationId}`, { method: 'DELETE' })
+  }
+
+  // Upload entries (already re-encrypted, same order on every attempt) from the
+  // first chunk the server has not acknowledged, then commit
+  async uploadRotation(rotationId, entries) {
+    const status = await this.getRotation(rotationId)
+    const size = status.max_chunk_entries
+    for (let seq = status.next_chunk; seq * size < entries.length; seq++) {
+      await this.putRotationChunk(rotationId, seq, entries.slice(seq * size, (seq + 1) * size))
+    }
+    return await this.commitRotation(rotationId)
+  }
 }
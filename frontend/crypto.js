@@ -39,6 +39,28 @@ class CryptoManager {
     );
   }
 
+  // Keyed fingerprint for server-side reuse detection; the HMAC key is
+  // derived once per session instead of once per entry
+  async fingerprint(plaintext, masterPassword, username) {
+    const encoder = new TextEncoder();
+    const cacheKey = `${username}\u0000${masterPassword}`;
+    if (!this.fingerprintKey || this.fingerprintKeyFor !== cacheKey) {
+      const keyMaterial = await this.cryptoAPI.subtle.importKey(
+        'raw', encoder.encode(masterPassword), 'PBKDF2', false, ['deriveKey']
+      );
+      this.fingerprintKey = await this.cryptoAPI.subtle.deriveKey(
+        { name: 'PBKDF2', salt: encoder.encode(`password-fingerprint:${username}`),
+          iterations: this.pbkdf2Iterations, hash: 'SHA-256' },
+        keyMaterial,
+        { name: 'HMAC', hash: 'SHA-256', length: 256 },
+        false, ['sign']
+      );
+      this.fingerprintKeyFor = cacheKey;
+    }
+    const mac = await this.cryptoAPI.subtle.sign('HMAC', this.fingerprintKey, encoder.encode(plaintext));
+    return Array.from(new Uint8Array(mac), (b) => b.toString(16).padStart(2, '0')).join('');
+  }
+
   async encrypt(plaintext, masterPassword) {
     try {
       const salt = this.generateRandomBytes(this.saltLength);
@@ -58,6 +80,29 @@ class CryptoManager {
     }
   }
 
+  // Binary variant of encrypt() for attachments: salt | iv | ciphertext bytes
+  async encryptBytes(data, masterPassword) {
+    const salt = this.generateRandomBytes(this.saltLength);
+    const iv = this.generateRandomBytes(this.ivLength);
+    const key = await this.deriveKey(masterPassword, salt);
+    const ciphertext = await this.cryptoAPI.subtle.encrypt({ name: this.algorithm, iv }, key, data);
+    const result = new Uint8Array(salt.length + iv.length + ciphertext.byteLength);
+    result.set(salt, 0);
+    result.set(iv, salt.length);
+    result.set(new Uint8Array(ciphertext), salt.length + iv.length);
+    return result;
+  }
+
+  async decryptBytes(data, masterPassword) {
+    const bytes = new Uint8Array(data);
+    const salt = bytes.slice(0, this.saltLength);
+    const iv = bytes.slice(this.saltLength, this.saltLength + this.ivLength);
+    const key = await this.deriveKey(masterPassword, salt);
+    return await this.cryptoAPI.subtle.decrypt(
+      { name: this.algorithm, iv }, key, bytes.slice(this.saltLength + this.ivLength)
+    );
+  }
+
   async decrypt(encryptedData, masterPassword) {
     try {
       const dataBuffer = this.base64ToArrayBuffer(encryptedData);
@@ -303,6 +303,7 @@ document.getElementById('password-form').addEventListener('submit', async (e) =>
     const encryptedPassword = await cryptoManager.encrypt(password, masterPassword);
     const encryptedUsername = username ? await cryptoManager.encrypt(username, masterPassword) : '';
     const encryptedNotes = notes ? await cryptoManager.encrypt(notes, masterPassword) : '';
+    const fingerprint = await cryptoManager.fingerprint(password, masterPassword, currentUser.username);
     
     const passwordData = {
       website_url: url,
@@ -310,6 +311,7 @@ document.getElementById('password-form').addEventListener('submit', async (e) =>
       username: encryptedUsername,
       encrypted_password: encryptedPassword,
       notes: encryptedNotes,
+      fingerprint,
       iv: 'client-handled'
     };
     